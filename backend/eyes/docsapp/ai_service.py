@@ -1,107 +1,466 @@
-import os
+import json
+import time
 import logging
-import requests
-from typing import Optional, Dict, Any
-from decouple import config
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterator, List
+from django.conf import settings
+from django.db import connections
+
+from .retrieval import ChunkIndex
+from .llm_backends import GeminiError, get_llm_backend
+from .tokens import (
+    estimate_tokens, output_tokens, record_call, split_into_token_chunks, text_budget
+)
 
 logger = logging.getLogger(__name__)
 
-class GeminiService:
-    """Service for interacting with Google Gemini API"""
+def _in_caller_context(func):
+    """
+    Run `func` in pool threads with a copy of the caller's context (e.g.
+    ratelimit.background()), closing the database connections the call
+    opened in that thread (rate limiter, token accounting) once it returns.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args):
+        try:
+            return context.copy().run(func, *args)
+        finally:
+            connections.close_all()
+    return run
+
+class GeminiPrompts:
+    """
+    The prompts of the document analyses and Q&A, shared by GeminiService
+    and AsyncGeminiService: templates, map prompts over the chunks of a
+    document, grouping of partial results for the reduce step and the
+    combined-analysis schema. Makes no calls itself.
+    """
     
-    def __init__(self):
-        self.api_key = config('GEMINI_API_KEY', default=None)
-        self.base_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+    # Bump the version of a prompt whenever its template changes so that
+    # cached results produced by the old wording are no longer served.
+    PROMPT_VERSIONS = {
+        'summary': '2',
+        'simplify': '2',
+        'risks': '2',
+        'qa': '2',
+    }
     
-    def _make_request(self, prompt: str) -> Optional[str]:
-        """Make a request to Gemini API"""
-        if not self.api_key:
-            logger.error("GEMINI_API_KEY not found in environment variables")
-            return None
-        
-        headers = {
-            'Content-Type': 'application/json',
-        }
-        
-        data = {
+    ANALYSIS_TYPES = ('summary', 'simplify', 'risks')
+    
+    # What each analysis asks for when several are requested in one combined prompt
+    COMBINED_INSTRUCTIONS = {
+        'summary': (
+            "A clear, concise summary of the document. Focus on the main purpose and type of "
+            "document, the key parties involved, important terms, dates and obligations, and "
+            "key risks or notable clauses."
+        ),
+        'simplify': (
+            "The document rewritten in simple, easy-to-understand language while maintaining the "
+            "original meaning. Explain any legal jargon and break down complex sentences."
+        ),
+        'risks': (
+            "A bullet-pointed list of potential risks, concerns, or unfavorable terms to watch out for."
+        ),
+    }
+    
+    @staticmethod
+    def request_body(prompt: str, operation: str, generation_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """generateContent body; the output is capped at the tokens reserved for the operation"""
+        return {
             "contents": [{
                 "parts": [{
                     "text": prompt
                 }]
-            }]
+            }],
+            "generationConfig": {
+                "maxOutputTokens": output_tokens(operation),
+                **(generation_config or {}),
+            },
+        }
+    
+    def fits_combined(self, analysis_types: List[str], text: str) -> bool:
+        """Whether several analyses of `text` can be requested in one combined prompt"""
+        combined_budget = text_budget('analyze', self.combined_prompt(analysis_types, ''))
+        return len(analysis_types) > 1 and estimate_tokens(text) <= combined_budget
+    
+    @staticmethod
+    def missing_analyses(analysis_types: List[str], results: Dict[str, str]) -> List[str]:
+        missing = [analysis_type for analysis_type in analysis_types if not results.get(analysis_type)]
+        if missing and results:
+            logger.warning(f"Combined analysis left out {', '.join(missing)}, requesting separately")
+        return missing
+    
+    def combined_generation_config(self, analysis_types: List[str]) -> Dict[str, Any]:
+        return {
+            "responseMimeType": "application/json",
+            "responseSchema": {
+                "type": "OBJECT",
+                "properties": {
+                    analysis_type: {"type": "STRING", "description": self.COMBINED_INSTRUCTIONS[analysis_type]}
+                    for analysis_type in analysis_types
+                },
+                "required": list(analysis_types),
+                "propertyOrdering": list(analysis_types),
+            },
         }
+    
+    @staticmethod
+    def parse_combined(analysis_types: List[str], response: Optional[str]) -> Dict[str, str]:
+        if response is None:
+            return {}
         
         try:
-            response = requests.post(
-                f"{self.base_url}?key={self.api_key}",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            result = response.json()
-            if 'candidates' in result and len(result['candidates']) > 0:
-                return result['candidates'][0]['content']['parts'][0]['text']
-            else:
-                logger.warning("No content returned from Gemini API")
-                return None
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error calling Gemini API: {str(e)}")
-            return None
-        except Exception as e:
-            logger.error(f"Unexpected error with Gemini API: {str(e)}")
-            return None
+            parsed = json.loads(response)
+        except ValueError:
+            logger.warning("Combined analysis response is not valid JSON")
+            return {}
+        if not isinstance(parsed, dict):
+            return {}
+        
+        return {
+            analysis_type: parsed[analysis_type].strip()
+            for analysis_type in analysis_types
+            if isinstance(parsed.get(analysis_type), str) and parsed[analysis_type].strip()
+        }
     
-    def summarize_document(self, text: str) -> Optional[str]:
-        """Generate a summary of the legal document"""
-        prompt = f"""
+    def combined_prompt(self, analysis_types: List[str], text: str) -> str:
+        fields = "\n".join(
+            f"        - {analysis_type}: {self.COMBINED_INSTRUCTIONS[analysis_type]}"
+            for analysis_type in analysis_types
+        )
+        return f"""
+        Please analyze this legal document. Respond with a JSON object containing these fields:
+{fields}
+        
+        Document text:
+        {text}
+        """
+    
+    def analysis_prompts(self, analysis_type: str):
+        """(map prompt, reduce prompt) builders of an analysis; reduce is None when parts are joined"""
+        prompts = {
+            'summary': (self._summary_prompt, self._summary_reduce_prompt),
+            # Each part is rewritten on its own, so the parts are simply joined in order
+            'simplify': (self._simplify_prompt, None),
+            'risks': (self._risks_prompt, self._risks_reduce_prompt),
+        }
+        return prompts[analysis_type]
+    
+    @staticmethod
+    def _summary_prompt(chunk: str, part: str) -> str:
+        return f"""
         Please provide a clear, concise summary of this legal document. Focus on:
         1. Main purpose and type of document
         2. Key parties involved
         3. Important terms, dates, and obligations
         4. Key risks or notable clauses
-        
+        {part}
         Document text:
-        {text[:4000]}  # Limit text to avoid token limits
+        {chunk}
         """
+    
+    @staticmethod
+    def _summary_reduce_prompt(partials: str) -> str:
+        return f"""
+        The following are summaries of consecutive parts of one legal document.
+        Combine them into a single clear, concise summary of the whole document. Focus on:
+        1. Main purpose and type of document
+        2. Key parties involved
+        3. Important terms, dates, and obligations
+        4. Key risks or notable clauses
         
-        return self._make_request(prompt)
+        Partial summaries:
+        {partials}
+        """
     
-    def simplify_clauses(self, text: str) -> Optional[str]:
-        """Simplify complex legal language"""
-        prompt = f"""
+    @staticmethod
+    def _simplify_prompt(chunk: str, part: str) -> str:
+        return f"""
         Please rewrite this legal text in simple, easy-to-understand language while maintaining the original meaning. 
         Explain any legal jargon and break down complex sentences:
-        
-        {text[:4000]}
+        {part}
+        {chunk}
         """
-        
-        return self._make_request(prompt)
     
-    def identify_risks(self, text: str) -> Optional[str]:
-        """Identify potential risks in the document"""
-        prompt = f"""
+    @staticmethod
+    def _risks_prompt(chunk: str, part: str) -> str:
+        return f"""
         Please analyze this legal document and identify potential risks, concerns, or unfavorable terms. 
         Provide a bullet-pointed list of issues to watch out for:
-        
-        {text[:4000]}
+        {part}
+        {chunk}
         """
+    
+    @staticmethod
+    def _risks_reduce_prompt(partials: str) -> str:
+        return f"""
+        The following are risk lists for consecutive parts of one legal document.
+        Merge them into a single bullet-pointed list of issues to watch out for.
+        Remove duplicates and put the most serious risks first:
         
-        return self._make_request(prompt)
+        {partials}
+        """
     
-    def answer_question(self, document_text: str, question: str) -> Optional[str]:
-        """Answer a specific question about the document"""
-        prompt = f"""
-        Based on the following legal document, please answer this question: {question}
+    @staticmethod
+    def _part_marker(index: int, count: int) -> str:
+        return f"\n        This is part {index} of {count} of the document.\n"
+    
+    def map_prompts(self, text: str, map_prompt, operation: str) -> List[str]:
+        """
+        One map prompt per chunk of the document, cut on clause/section
+        boundaries, each filled up to the operation's prompt token budget
+        """
+        budget = text_budget(operation, map_prompt("", self._part_marker(9999, 9999)))
+        chunks = split_into_token_chunks(text, budget)
+        if len(chunks) == 1:
+            return [map_prompt(chunks[0], "")]
+        return [
+            map_prompt(chunk, self._part_marker(index, len(chunks)))
+            for index, chunk in enumerate(chunks, start=1)
+        ]
+    
+    @staticmethod
+    def group_partials(partials: List[str], max_tokens: int) -> List[str]:
+        """Join consecutive partial results into groups of at most `max_tokens` (two at minimum)."""
+        separator = "\n\n---\n\n"
+        groups = []
+        current = []
+        current_tokens = 0
+        for partial in partials:
+            partial_tokens = estimate_tokens(partial) + estimate_tokens(separator)
+            if len(current) >= 2 and current_tokens + partial_tokens > max_tokens:
+                groups.append(separator.join(current))
+                current = []
+                current_tokens = 0
+            current.append(partial)
+            current_tokens += partial_tokens
+        groups.append(separator.join(current))
+        return groups
+    
+    def qa_context_tokens(self, question: str) -> int:
+        """Tokens of document context that fit in a Q&A prompt for `question`"""
+        return text_budget('qa', self._qa_template("", question))
+    
+    def qa_prompt(self, document_text: str, question: str) -> str:
+        max_tokens = self.qa_context_tokens(question)
+        if len(document_text) > max_tokens and estimate_tokens(document_text) > max_tokens:
+            index = ChunkIndex.build(document_text, settings.RETRIEVAL_CHUNK_CHARS)
+            document_text = index.context_for(document_text, question, max_tokens)
+        return self._qa_template(document_text, question)
+    
+    @staticmethod
+    def _qa_template(document_text: str, question: str) -> str:
+        return f"""
+        Based on the following excerpts of a legal document, please answer this question: {question}
         
         Document:
-        {document_text[:3000]}
+        {document_text}
         
         Question: {question}
         
         Please provide a clear, specific answer based only on the information in the document.
         """
+
+class GeminiService:
+    """Service for interacting with Google Gemini API"""
+    
+    PROMPT_VERSIONS = GeminiPrompts.PROMPT_VERSIONS
+    ANALYSIS_TYPES = GeminiPrompts.ANALYSIS_TYPES
+    
+    def __init__(self):
+        self.model_name = settings.GEMINI_MODEL
+        # Where calls go: the Gemini API, or a fake for offline work (LLM_BACKEND)
+        self.backend = get_llm_backend()
+        self.prompts = GeminiPrompts()
+    
+    def _make_request(self, prompt: str, operation: str = 'default',
+                      generation_config: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Make a request to Gemini API"""
+        data = self.prompts.request_body(prompt, operation, generation_config)
+        
+        started = time.monotonic()
+        usage = None
+        text = None
+        try:
+            result = self.backend.generate(self.model_name, data, operation)
+            usage = result.get('usageMetadata')
+            if 'candidates' in result and len(result['candidates']) > 0:
+                text = result['candidates'][0]['content']['parts'][0]['text']
+                return text
+            else:
+                logger.warning("No content returned from Gemini API")
+                return None
+                
+        except GeminiError as e:
+            logger.error(str(e))
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error with Gemini API: {str(e)}")
+            return None
+        finally:
+            record_call(operation, self.model_name, prompt, usage, time.monotonic() - started, text is not None)
+    
+    def _stream_request(self, prompt: str, operation: str = 'default') -> Iterator[str]:
+        """
+        Stream a response from Gemini's streamGenerateContent (server-sent
+        events), yielding text as it arrives. Raises GeminiError on failure.
+        """
+        data = self.prompts.request_body(prompt, operation)
+        
+        started = time.monotonic()
+        usage = None
+        succeeded = False
+        try:
+            for event in self.backend.stream(self.model_name, data, operation):
+                # Every event carries the running totals
+                usage = event.get('usageMetadata', usage)
+                for candidate in event.get('candidates', [])[:1]:
+                    for part in candidate.get('content', {}).get('parts', []):
+                        if part.get('text'):
+                            yield part['text']
+            succeeded = True
+        finally:
+            record_call(operation, self.model_name, prompt, usage, time.monotonic() - started, succeeded)
+    
+    def run_analysis(self, analysis_type: str, text: str) -> Optional[str]:
+        """Run one of the document analyses ('summary', 'simplify' or 'risks')"""
+        map_prompt, reduce_prompt = self.prompts.analysis_prompts(analysis_type)
+        return self._map_reduce(text, map_prompt, reduce_prompt, operation=analysis_type)
+    
+    def run_analyses(self, analysis_types: List[str], text: str) -> Dict[str, Optional[str]]:
+        """
+        Run several analyses of the same text, in whichever way costs fewer
+        round trips: one combined JSON-schema prompt when the document fits
+        the 'analyze' prompt budget, otherwise one map-reduce per analysis, run
+        concurrently. Failed analyses map to None.
+        """
+        results = {}
+        if self.prompts.fits_combined(analysis_types, text):
+            results = self._combined_analysis(analysis_types, text)
         
-        return self._make_request(prompt)
+        missing = self.prompts.missing_analyses(analysis_types, results)
+        if missing:
+            with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                separate = executor.map(_in_caller_context(lambda analysis_type: self.run_analysis(analysis_type, text)), missing)
+                results.update(zip(missing, separate))
+        return results
+    
+    def _combined_analysis(self, analysis_types: List[str], text: str) -> Dict[str, str]:
+        """
+        Request every analysis in one call, constrained to a JSON object with
+        one string per type. Returns the analyses that came back non-empty.
+        """
+        response = self._make_request(
+            self.prompts.combined_prompt(analysis_types, text), operation='analyze',
+            generation_config=self.prompts.combined_generation_config(analysis_types)
+        )
+        return self.prompts.parse_combined(analysis_types, response)
+    
+    def stream_analysis(self, analysis_type: str, text: str) -> Iterator[str]:
+        """Like run_analysis, but yields the output as Gemini generates it"""
+        map_prompt, reduce_prompt = self.prompts.analysis_prompts(analysis_type)
+        return self._stream_map_reduce(text, map_prompt, reduce_prompt, operation=analysis_type)
+    
+    def summarize_document(self, text: str) -> Optional[str]:
+        """Generate a summary of the legal document"""
+        return self.run_analysis('summary', text)
+    
+    def simplify_clauses(self, text: str) -> Optional[str]:
+        """Simplify complex legal language"""
+        return self.run_analysis('simplify', text)
+    
+    def identify_risks(self, text: str) -> Optional[str]:
+        """Identify potential risks in the document"""
+        return self.run_analysis('risks', text)
+    
+    def _map_reduce(self, text: str, map_prompt, reduce_prompt, operation: str) -> Optional[str]:
+        """
+        Run `map_prompt` over every chunk of the document and merge the
+        partial outputs with `reduce_prompt` (or by joining them in order when
+        it is None). Chunks are sent concurrently, at most AI_MAX_FANOUT at a
+        time, so a long document costs about two round trips instead of one
+        per chunk.
+        """
+        prompts = self.prompts.map_prompts(text, map_prompt, operation)
+        if not prompts:
+            return None
+        if len(prompts) == 1:
+            return self._make_request(prompts[0], operation=operation)
+        
+        partials = self._request_concurrently(prompts, operation)
+        if partials is None:
+            return None
+        if reduce_prompt is None:
+            return "\n\n".join(partials)
+        
+        final_prompt = self._final_reduce_prompt(partials, reduce_prompt, operation)
+        if final_prompt is None:
+            return None
+        return self._make_request(final_prompt, operation=operation)
+    
+    def _stream_map_reduce(self, text: str, map_prompt, reduce_prompt, operation: str) -> Iterator[str]:
+        """
+        Streaming counterpart of _map_reduce. The map step runs as usual and
+        the final reduce call is streamed. When parts are joined instead, the
+        first part is streamed while the others are generated concurrently.
+        Raises GeminiError if any call fails.
+        """
+        prompts = self.prompts.map_prompts(text, map_prompt, operation)
+        if not prompts:
+            return
+        if len(prompts) == 1:
+            yield from self._stream_request(prompts[0], operation=operation)
+            return
+        
+        if reduce_prompt is None:
+            with ThreadPoolExecutor(max_workers=min(settings.AI_MAX_FANOUT, len(prompts) - 1)) as executor:
+                rest = [executor.submit(_in_caller_context(self._make_request), prompt, operation) for prompt in prompts[1:]]
+                yield from self._stream_request(prompts[0], operation=operation)
+                for future in rest:
+                    partial = future.result()
+                    if partial is None:
+                        raise GeminiError(f"A {operation} request failed")
+                    yield "\n\n" + partial
+            return
+        
+        partials = self._request_concurrently(prompts, operation)
+        final_prompt = self._final_reduce_prompt(partials, reduce_prompt, operation) if partials else None
+        if final_prompt is None:
+            raise GeminiError(f"A {operation} request failed")
+        yield from self._stream_request(final_prompt, operation=operation)
+    
+    def _final_reduce_prompt(self, partials: List[str], reduce_prompt, operation: str) -> Optional[str]:
+        """Reduce partials in groups that fit one prompt until a single prompt remains"""
+        while True:
+            groups = self.prompts.group_partials(partials, text_budget(operation, reduce_prompt("")))
+            if len(groups) == 1:
+                return reduce_prompt(groups[0])
+            partials = self._request_concurrently([reduce_prompt(group) for group in groups], operation)
+            if partials is None:
+                return None
+    
+    def _request_concurrently(self, prompts: List[str], operation: str) -> Optional[List[str]]:
+        """Send prompts with bounded fan-out; results keep the order of `prompts`."""
+        with ThreadPoolExecutor(max_workers=min(settings.AI_MAX_FANOUT, len(prompts))) as executor:
+            results = list(executor.map(_in_caller_context(lambda prompt: self._make_request(prompt, operation=operation)), prompts))
+        
+        failed = sum(1 for result in results if result is None)
+        if failed:
+            logger.error(f"{failed} of {len(prompts)} {operation} requests failed")
+            return None
+        return results
+    
+    def answer_question(self, document_text: str, question: str) -> Optional[str]:
+        """
+        Answer a specific question about the document.
+        
+        `document_text` should already be the relevant context (see
+        retrieval.retrieve_context); longer text is narrowed down here.
+        """
+        return self._make_request(self.prompts.qa_prompt(document_text, question), operation='qa')
+    
+    def stream_answer(self, document_text: str, question: str) -> Iterator[str]:
+        """Like answer_question, but yields the answer as Gemini generates it"""
+        return self._stream_request(self.prompts.qa_prompt(document_text, question), operation='qa')
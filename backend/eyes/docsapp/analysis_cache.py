@@ -0,0 +1,309 @@
+import random
+import logging
+from datetime import timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics
+from .models import AnalysisResult, LegalDocument
+from .ai_service import GeminiService
+from .async_ai_service import AsyncGeminiService
+from .llm_backends import GeminiError
+from .singleflight import asingle_flight, single_flight
+from .text_store import aload_text, load_text, text_key
+
+logger = logging.getLogger(__name__)
+
+# Access times are only refreshed once per interval so cache hits stay read-only
+ACCESS_UPDATE_INTERVAL = timedelta(minutes=1)
+
+
+def content_key(document: LegalDocument) -> str:
+    """Key cached analyses by the uploaded bytes, or by the text for older rows."""
+    return document.content_hash or document.text_hash or text_key('')
+
+
+def get_cached_analysis(key: str, analysis_type: str, prompt_version: str, model_name: str) -> Optional[str]:
+    """
+    Return a cached result, or None on a miss or when the entry has expired.
+    Expired entries stay until pruned, as a fallback (get_stale_analysis).
+    """
+    entry = (
+        AnalysisResult.objects
+        .filter(content_hash=key, analysis_type=analysis_type, prompt_version=prompt_version, model_name=model_name)
+        .only('id', 'result', 'created_at', 'last_accessed_at')
+        .first()
+    )
+    if entry is None:
+        return None
+
+    now = timezone.now()
+    if settings.ANALYSIS_CACHE_TTL and entry.created_at < now - timedelta(seconds=settings.ANALYSIS_CACHE_TTL):
+        return None
+
+    if entry.last_accessed_at < now - ACCESS_UPDATE_INTERVAL:
+        AnalysisResult.objects.filter(id=entry.id).update(last_accessed_at=now)
+    return entry.result
+
+
+def get_stale_analysis(key: str, analysis_type: str) -> Optional[str]:
+    """
+    The latest cached result of any age, prompt version or model. Served
+    when Gemini fails (or its circuit breaker is open), as better than none.
+    """
+    result = (
+        AnalysisResult.objects
+        .filter(content_hash=key, analysis_type=analysis_type)
+        .order_by('-created_at')
+        .values_list('result', flat=True)
+        .first()
+    )
+    if result is not None:
+        metrics.increment('analysis_cache.stale_served')
+        logger.warning(f"Gemini unavailable; serving a stale {analysis_type} result for {key[:12]}")
+    return result
+
+
+def eviction_due() -> bool:
+    """Whether this cache write should also enforce the LRU size bounds (CACHE_EVICTION_SAMPLE_RATE)."""
+    return random.random() < settings.CACHE_EVICTION_SAMPLE_RATE
+
+
+def store_analysis(key: str, analysis_type: str, prompt_version: str, model_name: str, result: str):
+    """Save a result, now and then evicting the least recently used entries beyond the size bound."""
+    try:
+        AnalysisResult.objects.update_or_create(
+            content_hash=key,
+            analysis_type=analysis_type,
+            prompt_version=prompt_version,
+            model_name=model_name,
+            defaults={'result': result, 'created_at': timezone.now(), 'last_accessed_at': timezone.now()},
+        )
+        if eviction_due():
+            _evict_lru(settings.ANALYSIS_CACHE_MAX_ENTRIES)
+    except IntegrityError:
+        # A concurrent request stored the same result first
+        pass
+    except DatabaseError as e:
+        # Caching is best effort; the caller still gets its result
+        logger.error(f"Error caching {analysis_type} result: {str(e)}")
+
+
+def flight_key(key: str, analysis_type: str, prompt_version: str, model_name: str) -> str:
+    """Single-flight key: identical requests for the same cache entry share one Gemini call."""
+    return f"analysis:{key}:{analysis_type}:{prompt_version}:{model_name}"
+
+
+def get_or_run_analysis(document: LegalDocument, analysis_type: str, refresh: bool = False) -> Tuple[Optional[str], bool]:
+    """
+    Return (result, cached) for a document analysis, calling Gemini on a miss.
+
+    Concurrent misses for the same entry, in this or any other process, are
+    coalesced into one Gemini call whose result they all receive (reported
+    as cached). `refresh` skips the lookup and overwrites the cached entry.
+    If Gemini fails, the latest stale result is returned when there is one.
+    """
+    gemini_service = GeminiService()
+    key = content_key(document)
+    prompt_version = gemini_service.PROMPT_VERSIONS[analysis_type]
+
+    def lookup():
+        return get_cached_analysis(key, analysis_type, prompt_version, gemini_service.model_name)
+
+    def compute():
+        result = gemini_service.run_analysis(analysis_type, load_text(document))
+        if result:
+            store_analysis(key, analysis_type, prompt_version, gemini_service.model_name, result)
+        return result
+
+    if refresh:
+        result, cached = compute(), False
+    else:
+        result = lookup()
+        if result is not None:
+            return result, True
+        result, cached = single_flight(
+            flight_key(key, analysis_type, prompt_version, gemini_service.model_name), compute, lookup
+        )
+
+    if result is None:
+        stale = get_stale_analysis(key, analysis_type)
+        return stale, stale is not None
+    return result, cached
+
+
+def get_or_run_analyses(document: LegalDocument, analysis_types: List[str],
+                        refresh: bool = False) -> Dict[str, Tuple[Optional[str], bool]]:
+    """
+    get_or_run_analysis for several analysis types at once. Only the misses
+    go to Gemini, in as few round trips as possible, and each result is
+    cached under its own type so later single-type requests are hits.
+    Concurrent requests missing the same types share one Gemini call.
+    """
+    gemini_service = GeminiService()
+    key = content_key(document)
+    model_name = gemini_service.model_name
+    results = {}
+    missing = []
+
+    for analysis_type in analysis_types:
+        prompt_version = gemini_service.PROMPT_VERSIONS[analysis_type]
+        result = None
+        if not refresh:
+            result = get_cached_analysis(key, analysis_type, prompt_version, model_name)
+        if result is not None:
+            results[analysis_type] = (result, True)
+        else:
+            missing.append(analysis_type)
+
+    if not missing:
+        return results
+
+    def lookup():
+        found = {
+            analysis_type: get_cached_analysis(key, analysis_type, gemini_service.PROMPT_VERSIONS[analysis_type], model_name)
+            for analysis_type in missing
+        }
+        return found if all(result is not None for result in found.values()) else None
+
+    def compute():
+        generated = gemini_service.run_analyses(missing, load_text(document))
+        for analysis_type in missing:
+            if generated.get(analysis_type):
+                store_analysis(
+                    key, analysis_type, gemini_service.PROMPT_VERSIONS[analysis_type], model_name, generated[analysis_type]
+                )
+        return generated
+
+    if refresh:
+        generated, shared = compute(), False
+    else:
+        types = sorted(missing)
+        generated, shared = single_flight(
+            flight_key(
+                key, '+'.join(types), '+'.join(gemini_service.PROMPT_VERSIONS[name] for name in types), model_name
+            ),
+            compute, lookup
+        )
+
+    for analysis_type in missing:
+        result = (generated or {}).get(analysis_type)
+        if result:
+            results[analysis_type] = (result, shared)
+        else:
+            stale = get_stale_analysis(key, analysis_type)
+            results[analysis_type] = (stale, stale is not None)
+
+    return results
+
+
+async def aget_or_run_analysis(document: LegalDocument, analysis_type: str, refresh: bool = False) -> Tuple[Optional[str], bool]:
+    """Async variant of get_or_run_analysis for the ASGI endpoints."""
+    gemini_service = AsyncGeminiService()
+    key = content_key(document)
+    prompt_version = gemini_service.PROMPT_VERSIONS[analysis_type]
+
+    def lookup():
+        return get_cached_analysis(key, analysis_type, prompt_version, gemini_service.model_name)
+
+    async def compute():
+        result = await gemini_service.run_analysis(analysis_type, await aload_text(document))
+        if result:
+            await sync_to_async(store_analysis)(key, analysis_type, prompt_version, gemini_service.model_name, result)
+        return result
+
+    if refresh:
+        result, cached = await compute(), False
+    else:
+        result = await sync_to_async(lookup)()
+        if result is not None:
+            return result, True
+        result, cached = await asingle_flight(
+            flight_key(key, analysis_type, prompt_version, gemini_service.model_name), compute, lookup
+        )
+
+    if result is None:
+        stale = await sync_to_async(get_stale_analysis)(key, analysis_type)
+        return stale, stale is not None
+    return result, cached
+
+
+def stream_analysis(document: LegalDocument, analysis_type: str, refresh: bool = False) -> Iterator[str]:
+    """
+    Yield a document analysis as Gemini generates it and cache the complete
+    text once the stream ends. A cache hit, or a stale result when Gemini
+    fails before producing any text, is yielded in one piece.
+    """
+    gemini_service = GeminiService()
+    key = content_key(document)
+    prompt_version = gemini_service.PROMPT_VERSIONS[analysis_type]
+
+    if not refresh:
+        result = get_cached_analysis(key, analysis_type, prompt_version, gemini_service.model_name)
+        if result is not None:
+            yield result
+            return
+
+    parts = []
+    try:
+        for delta in gemini_service.stream_analysis(analysis_type, load_text(document)):
+            parts.append(delta)
+            yield delta
+    except GeminiError:
+        stale = None if parts else get_stale_analysis(key, analysis_type)
+        if stale is None:
+            raise
+        yield stale
+        return
+
+    result = ''.join(parts)
+    if result:
+        store_analysis(key, analysis_type, prompt_version, gemini_service.model_name, result)
+
+
+def invalidate_analyses(analysis_type: Optional[str] = None, key: Optional[str] = None, stale_only: bool = False) -> int:
+    """
+    Delete cached results. With `stale_only`, only entries produced by an
+    older prompt version or another model are removed.
+    """
+    queryset = AnalysisResult.objects.all()
+    if analysis_type:
+        queryset = queryset.filter(analysis_type=analysis_type)
+    if key:
+        queryset = queryset.filter(content_hash=key)
+
+    if stale_only:
+        current = Q()
+        for name, version in GeminiService.PROMPT_VERSIONS.items():
+            current |= Q(analysis_type=name, prompt_version=version)
+        queryset = queryset.exclude(current & Q(model_name=settings.GEMINI_MODEL))
+
+    deleted, _ = queryset.delete()
+    return deleted
+
+
+def prune_analysis_cache() -> int:
+    """Apply TTL expiry and the LRU size bound. Returns the number of entries removed."""
+    removed = 0
+    if settings.ANALYSIS_CACHE_TTL:
+        cutoff = timezone.now() - timedelta(seconds=settings.ANALYSIS_CACHE_TTL)
+        removed, _ = AnalysisResult.objects.filter(created_at__lt=cutoff).delete()
+    return removed + _evict_lru(settings.ANALYSIS_CACHE_MAX_ENTRIES)
+
+
+def _evict_lru(max_entries: int) -> int:
+    if not max_entries:
+        return 0
+    excess = AnalysisResult.objects.count() - max_entries
+    if excess <= 0:
+        return 0
+    oldest = list(
+        AnalysisResult.objects.order_by('last_accessed_at').values_list('id', flat=True)[:excess]
+    )
+    deleted, _ = AnalysisResult.objects.filter(id__in=oldest).delete()
+    return deleted
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DocsappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'docsapp'
+
+    def ready(self):
+        # Connects the receivers
+        from . import signals
@@ -0,0 +1,135 @@
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .ai_service import GeminiPrompts
+from .llm_backends import GeminiError, get_llm_backend
+from .tokens import record_call, text_budget
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGeminiService:
+    """
+    asyncio counterpart of GeminiService for the ASGI endpoints.
+
+    Prompts and chunking come from the same GeminiPrompts, so results and
+    cache keys match the sync service; only the transport differs (the
+    backend's agenerate), so a slow Gemini call holds a coroutine instead
+    of a thread. There is no streaming here: the streaming endpoints use
+    GeminiService.
+    """
+
+    PROMPT_VERSIONS = GeminiPrompts.PROMPT_VERSIONS
+
+    def __init__(self):
+        self.model_name = settings.GEMINI_MODEL
+        self.backend = get_llm_backend()
+        self.prompts = GeminiPrompts()
+
+    async def _make_request(self, prompt: str, operation: str = 'default',
+                            generation_config: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Make a request to Gemini API"""
+        data = self.prompts.request_body(prompt, operation, generation_config)
+
+        started = time.monotonic()
+        usage = None
+        text = None
+        try:
+            result = await self.backend.agenerate(self.model_name, data, operation)
+            usage = result.get('usageMetadata')
+            if 'candidates' in result and len(result['candidates']) > 0:
+                text = result['candidates'][0]['content']['parts'][0]['text']
+                return text
+            else:
+                logger.warning("No content returned from Gemini API")
+                return None
+
+        except GeminiError as e:
+            logger.error(str(e))
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error with Gemini API: {str(e)}")
+            return None
+        finally:
+            await sync_to_async(record_call)(
+                operation, self.model_name, prompt, usage, time.monotonic() - started, text is not None
+            )
+
+    async def run_analysis(self, analysis_type: str, text: str) -> Optional[str]:
+        """Run one of the document analyses ('summary', 'simplify' or 'risks')"""
+        map_prompt, reduce_prompt = self.prompts.analysis_prompts(analysis_type)
+        return await self._map_reduce(text, map_prompt, reduce_prompt, operation=analysis_type)
+
+    async def run_analyses(self, analysis_types: List[str], text: str) -> Dict[str, Optional[str]]:
+        """Run several analyses of the same text; see GeminiService.run_analyses"""
+        results = {}
+        if self.prompts.fits_combined(analysis_types, text):
+            results = await self._combined_analysis(analysis_types, text)
+
+        missing = self.prompts.missing_analyses(analysis_types, results)
+        if missing:
+            separate = await asyncio.gather(*(self.run_analysis(analysis_type, text) for analysis_type in missing))
+            results.update(zip(missing, separate))
+        return results
+
+    async def _combined_analysis(self, analysis_types: List[str], text: str) -> Dict[str, str]:
+        response = await self._make_request(
+            self.prompts.combined_prompt(analysis_types, text), operation='analyze',
+            generation_config=self.prompts.combined_generation_config(analysis_types)
+        )
+        return self.prompts.parse_combined(analysis_types, response)
+
+    async def answer_question(self, document_text: str, question: str) -> Optional[str]:
+        """Answer a specific question about the document"""
+        return await self._make_request(self.prompts.qa_prompt(document_text, question), operation='qa')
+
+    async def _map_reduce(self, text: str, map_prompt, reduce_prompt, operation: str) -> Optional[str]:
+        """Map-reduce over the document chunks; see GeminiService._map_reduce"""
+        prompts = self.prompts.map_prompts(text, map_prompt, operation)
+        if not prompts:
+            return None
+        if len(prompts) == 1:
+            return await self._make_request(prompts[0], operation=operation)
+
+        partials = await self._request_concurrently(prompts, operation)
+        if partials is None:
+            return None
+        if reduce_prompt is None:
+            return "\n\n".join(partials)
+
+        prompt = await self._final_reduce_prompt(partials, reduce_prompt, operation)
+        if prompt is None:
+            return None
+        return await self._make_request(prompt, operation=operation)
+
+    async def _final_reduce_prompt(self, partials: List[str], reduce_prompt, operation: str) -> Optional[str]:
+        """Reduce partials in groups that fit one prompt until a single prompt remains"""
+        while True:
+            groups = self.prompts.group_partials(partials, text_budget(operation, reduce_prompt("")))
+            if len(groups) == 1:
+                return reduce_prompt(groups[0])
+            partials = await self._request_concurrently([reduce_prompt(group) for group in groups], operation)
+            if partials is None:
+                return None
+
+    async def _request_concurrently(self, prompts: List[str], operation: str) -> Optional[List[str]]:
+        """Send prompts with at most AI_MAX_FANOUT in flight; results keep the order of `prompts`."""
+        semaphore = asyncio.Semaphore(settings.AI_MAX_FANOUT)
+
+        async def send(prompt):
+            async with semaphore:
+                return await self._make_request(prompt, operation=operation)
+
+        results = await asyncio.gather(*(send(prompt) for prompt in prompts))
+
+        failed = sum(1 for result in results if result is None)
+        if failed:
+            logger.error(f"{failed} of {len(prompts)} {operation} requests failed")
+            return None
+        return list(results)
+
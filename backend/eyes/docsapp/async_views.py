@@ -0,0 +1,147 @@
+"""
+Async variants of the AI endpoints, for deployments served over ASGI
+(eyes/asgi.py). Each in-flight Gemini call holds a coroutine rather than a
+worker thread, so one ASGI worker can serve hundreds of slow requests.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .models import LegalDocument
+from .analysis_cache import aget_or_run_analysis
+from .qa_cache import aget_or_answer_question
+
+logger = logging.getLogger(__name__)
+
+
+async def _authenticate(request):
+    """The user of the request's JWT bearer token, or None"""
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+async def _get_document(request, document_id):
+    """(document, error response) for the authenticated user's document with extracted text"""
+    document, error = await _find_document(request, document_id)
+    if error is None:
+        error = _text_unavailable(document)
+    return (None, error) if error else (document, None)
+
+
+async def _find_document(request, document_id):
+    """(document, error response) for the authenticated user's document"""
+    user = await _authenticate(request)
+    if user is None:
+        return None, JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+
+    document = await LegalDocument.objects.filter(id=document_id, user=user).afirst()
+    if document is None:
+        return None, JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    return document, None
+
+
+def _text_unavailable(document):
+    """Error response for a document whose text has not been extracted, or None"""
+    if not document.text_length:
+        return JsonResponse(
+            {'error': 'Document text not available. Processing may have failed.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return None
+
+
+def _wants_refresh(request):
+    return request.GET.get('refresh', '').lower() in ('1', 'true', 'yes')
+
+
+async def _document_analysis(request, document_id, analysis_type, result_key, error_message):
+    document, error = await _get_document(request, document_id)
+    if error:
+        return error
+
+    result, cached = await aget_or_run_analysis(document, analysis_type, refresh=_wants_refresh(request))
+
+    if result:
+        return JsonResponse({result_key: result, 'cached': cached})
+    else:
+        return JsonResponse({'error': error_message}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@require_POST
+async def document_summary(request, document_id):
+    """Generate a summary of the document using AI"""
+    return await _document_analysis(
+        request, document_id, 'summary', 'summary',
+        'Failed to generate summary. Please try again later.'
+    )
+
+
+@csrf_exempt
+@require_POST
+async def document_simplify(request, document_id):
+    """Simplify the document language using AI"""
+    return await _document_analysis(
+        request, document_id, 'simplify', 'simplified_text',
+        'Failed to simplify document. Please try again later.'
+    )
+
+
+@csrf_exempt
+@require_POST
+async def document_risks(request, document_id):
+    """Identify risks in the document using AI"""
+    return await _document_analysis(
+        request, document_id, 'risks', 'risks',
+        'Failed to identify risks. Please try again later.'
+    )
+
+
+@csrf_exempt
+@require_POST
+async def document_qa(request, document_id):
+    """Answer questions about the document using AI"""
+    # Checked in the same order as the sync endpoint: credentials, document, question, text
+    document, error = await _find_document(request, document_id)
+    if error:
+        return error
+
+    try:
+        question = json.loads(request.body or b'{}').get('question')
+    except (ValueError, AttributeError):
+        question = None
+
+    if not question:
+        return JsonResponse({'error': 'Question is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    error = _text_unavailable(document)
+    if error:
+        return error
+
+    answer, cached = await aget_or_answer_question(document, question, refresh=_wants_refresh(request))
+
+    if answer:
+        return JsonResponse({
+            'question': question,
+            'answer': answer,
+            'cached': cached
+        })
+    else:
+        return JsonResponse(
+            {'error': 'Failed to answer question. Please try again later.'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
@@ -0,0 +1,191 @@
+"""
+Bulk uploads: many files, or ZIP archives of them, in one request.
+
+Archives are read from the uploaded file (which Django spools to disk above
+FILE_UPLOAD_MAX_MEMORY_SIZE) one entry at a time: each entry is
+decompressed into a temporary file, checked and stored like a single
+upload, and closed before the next, so neither the archive nor its members
+are held in memory. The accepted files become LegalDocument rows in one
+bulk_create and an upload BatchJob tracks their extraction.
+"""
+import os
+import shutil
+import zipfile
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.db import transaction
+from rest_framework import serializers
+
+from .jobs import create_upload_batch
+from .models import BatchJob, LegalDocument
+from .serializers import EXTENSION_FILE_TYPES, store_upload, validate_upload
+from .services import hash_uploaded_file
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_TYPES = {'application/zip', 'application/x-zip-compressed', 'application/x-zip'}
+
+# Bytes decompressed at a time from an archive entry
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class BulkUploadError(Exception):
+    """Raised when a bulk upload is rejected as a whole."""
+
+
+def is_archive(file: UploadedFile) -> bool:
+    return file.content_type in ARCHIVE_TYPES or file.name.lower().endswith('.zip')
+
+
+def archive_members(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    """The entries of an archive that are files, leaving out folders and macOS/hidden metadata."""
+    return [
+        info for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith('__MACOSX/')
+        and not os.path.basename(info.filename).startswith('.')
+    ]
+
+
+def bulk_upload(user, files: List[UploadedFile]) -> Tuple[Optional[BatchJob], List[dict]]:
+    """
+    Store and queue the extraction of a set of uploaded files and archives.
+
+    Returns the upload batch (None when nothing was accepted) and one
+    outcome per file or archive entry, in upload order. Files that fail the
+    checks of a single upload are reported and skipped; BulkUploadError is
+    raised, before anything is stored, when the upload is too large.
+    """
+    archives = _open_archives(files)
+    try:
+        _check_limits(files, archives)
+
+        documents = []
+        outcomes = []
+        stored: Dict[str, str] = {}  # content hash -> stored file, for duplicates within the upload
+        for name, file, error in _iter_files(files, archives):
+            if error:
+                outcomes.append({'name': name, 'status': 'rejected', 'error': error})
+                continue
+            try:
+                validate_upload(file)
+            except serializers.ValidationError as e:
+                outcomes.append({'name': name, 'status': 'rejected', 'error': str(e.detail[0])})
+                continue
+
+            document = LegalDocument(
+                user=user,
+                original_name=name[:255],
+                file_type=file.content_type,
+                file_size=file.size,
+                content_hash=hash_uploaded_file(file)
+            )
+            if document.content_hash in stored:
+                document.file.name = stored[document.content_hash]
+            else:
+                store_upload(document, file)
+                stored[document.content_hash] = document.file.name
+            documents.append(document)
+            outcomes.append({'name': name, 'status': 'accepted', 'document': document})
+    finally:
+        for archive in archives.values():
+            archive.close()
+
+    if not documents:
+        return None, outcomes
+
+    with transaction.atomic():
+        documents = LegalDocument.objects.bulk_create(documents)
+    batch = create_upload_batch(user, documents, priority=settings.DOCS_BULK_UPLOAD_JOB_PRIORITY)
+
+    # Reused extractions (and eager mode) complete documents during the call
+    statuses = dict(
+        LegalDocument.objects.filter(id__in=[document.id for document in documents]).values_list('id', 'processing_status')
+    )
+    for outcome in outcomes:
+        document = outcome.pop('document', None)
+        if document:
+            outcome['document_id'] = document.id
+            outcome['processing_status'] = statuses[document.id]
+    return batch, outcomes
+
+
+def _open_archives(files: List[UploadedFile]) -> Dict[int, zipfile.ZipFile]:
+    """Open the archives among `files` (keyed by position); only their central directories are read."""
+    archives = {}
+    try:
+        for position, file in enumerate(files):
+            if is_archive(file):
+                try:
+                    archives[position] = zipfile.ZipFile(file)
+                except zipfile.BadZipFile:
+                    raise BulkUploadError(f"{file.name} is not a valid ZIP archive.")
+    except BulkUploadError:
+        for archive in archives.values():
+            archive.close()
+        raise
+    return archives
+
+
+def _check_limits(files: List[UploadedFile], archives: Dict[int, zipfile.ZipFile]):
+    """Reject the whole upload when it holds too many files or unpacks to too many bytes."""
+    count = 0
+    size = 0
+    for position, file in enumerate(files):
+        if position in archives:
+            members = archive_members(archives[position])
+            count += len(members)
+            # Declared sizes are safe to sum: zipfile never yields more than an entry declares
+            size += sum(info.file_size for info in members)
+        else:
+            count += 1
+            size += file.size
+
+    if count > settings.DOCS_BATCH_MAX_DOCUMENTS:
+        raise BulkUploadError(f"A bulk upload can contain at most {settings.DOCS_BATCH_MAX_DOCUMENTS} files.")
+    if size > settings.DOCS_BULK_UPLOAD_MAX_BYTES:
+        raise BulkUploadError(
+            f"A bulk upload can contain at most {settings.DOCS_BULK_UPLOAD_MAX_BYTES // (1024 * 1024)}MB of files."
+        )
+
+
+def _iter_files(
+    files: List[UploadedFile], archives: Dict[int, zipfile.ZipFile]
+) -> Iterator[Tuple[str, Optional[UploadedFile], Optional[str]]]:
+    """Yield (name, file, error) for every uploaded file and archive entry; error is set when it can't be read."""
+    for position, file in enumerate(files):
+        if position not in archives:
+            yield file.name, file, None
+            continue
+
+        archive = archives[position]
+        for info in archive_members(archive):
+            name = os.path.basename(info.filename)
+            extension = os.path.splitext(name)[1].lower()
+            # Size and type are checked before decompressing anything
+            entry = TemporaryUploadedFile(name, EXTENSION_FILE_TYPES.get(extension, ''), info.file_size, None)
+            try:
+                try:
+                    validate_upload(entry)
+                except serializers.ValidationError as e:
+                    yield name, None, str(e.detail[0])
+                    continue
+
+                if info.flag_bits & 0x1:
+                    yield name, None, "Encrypted archive entries are not supported."
+                    continue
+                try:
+                    with archive.open(info) as source:
+                        shutil.copyfileobj(source, entry, COPY_CHUNK_SIZE)
+                except (zipfile.BadZipFile, NotImplementedError, EOFError, OSError) as e:
+                    logger.warning(f"Could not unpack {info.filename} from {file.name}: {str(e)}")
+                    yield name, None, "The archive entry could not be unpacked."
+                    continue
+
+                entry.seek(0)
+                yield name, entry, None
+            finally:
+                entry.close()
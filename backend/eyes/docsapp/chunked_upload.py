@@ -0,0 +1,265 @@
+"""
+Resumable chunked uploads.
+
+A client starts an UploadSession with the file's name and size, sends the
+bytes as chunks at increasing offsets, then completes the session. Chunks
+are copied from the request stream straight into a partial file under
+DOCS_UPLOAD_SESSION_DIR, so a dropped connection only loses the part of the
+chunk that did not arrive: the session keeps the bytes received so far and
+the client resumes from `received`.
+
+The SHA-256 content hash is computed as chunks arrive, in the process that
+receives them. When consecutive chunks land on different processes (or a
+process restarts) the hash in progress is lost and the file is hashed again
+on completion instead. The file type is sniffed from the first bytes as soon
+as they arrive, so an unsupported file is turned away before the rest of it
+is sent. Completed files go through the same storage and extraction path as
+single uploads.
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+# To keep concurrent writers of the same session apart (one writer is assumed elsewhere)
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+from .jobs import enqueue_extraction
+from .models import LegalDocument, UploadSession
+from .serializers import store_upload
+from .services import SNIFF_BYTES, hash_uploaded_file, is_docx, sniff_file_type
+
+logger = logging.getLogger(__name__)
+
+DOCX_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+UNSUPPORTED_TYPE = "Only PDF, DOCX, and TXT files are supported."
+
+# Bytes read from the request at a time
+COPY_CHUNK_SIZE = 64 * 1024
+
+# Hashes in progress, by session id: (bytes hashed, hash object); oldest dropped first
+MAX_HASHERS = 1000
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+class UploadSessionError(Exception):
+    """Raised when a chunk or completion request cannot be applied to an upload session."""
+
+
+class OffsetMismatch(UploadSessionError):
+    """Raised when a chunk does not start where the received bytes end; the client should resume from there."""
+
+    def __init__(self, received: int):
+        super().__init__(f"Expected a chunk at offset {received}.")
+        self.received = received
+
+
+class SessionFile(File):
+    """The assembled upload; storage moves it into place instead of copying it."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def session_path(session: UploadSession) -> str:
+    return os.path.join(settings.DOCS_UPLOAD_SESSION_DIR, f"{session.id}.part")
+
+
+def start_session(user, name: str, size: int) -> UploadSession:
+    """Open an upload session and its empty partial file."""
+    if not name:
+        raise UploadSessionError("name is required.")
+    if size <= 0:
+        raise UploadSessionError("size must be a positive number of bytes.")
+    if size > settings.DOCS_CHUNKED_UPLOAD_MAX_SIZE:
+        raise UploadSessionError(
+            f"File size cannot exceed {settings.DOCS_CHUNKED_UPLOAD_MAX_SIZE // (1024 * 1024)}MB."
+        )
+
+    session = UploadSession.objects.create(
+        user=user,
+        original_name=os.path.basename(name)[:255],
+        file_size=size,
+        expires_at=timezone.now() + timedelta(seconds=settings.DOCS_UPLOAD_SESSION_TTL),
+    )
+    os.makedirs(settings.DOCS_UPLOAD_SESSION_DIR, exist_ok=True)
+    open(session_path(session), 'wb').close()
+    return session
+
+
+@contextmanager
+def _locked(session: UploadSession):
+    """The partial file, opened for writing and locked against other requests for the same session."""
+    try:
+        partial = open(session_path(session), 'r+b')
+    except FileNotFoundError:
+        raise UploadSessionError("The partial upload is gone; start a new upload.")
+    with partial:
+        if FCNTL_AVAILABLE:
+            fcntl.flock(partial.fileno(), fcntl.LOCK_EX)
+        # Another request may have moved the session on while this one waited
+        session.refresh_from_db()
+        yield partial
+
+
+def write_chunk(session: UploadSession, offset: int, stream, length: int) -> UploadSession:
+    """
+    Append `length` bytes read from `stream` at `offset`, which must be where
+    the received bytes end. A stream that ends early keeps what did arrive.
+    """
+    if length > settings.DOCS_UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadSessionError(
+            f"A chunk can be at most {settings.DOCS_UPLOAD_CHUNK_MAX_SIZE // (1024 * 1024)}MB."
+        )
+    if offset + length > session.file_size:
+        raise UploadSessionError("The chunk runs past the announced file size.")
+
+    with _locked(session) as partial:
+        if session.status != 'active':
+            raise UploadSessionError(f"The upload is {session.status}.")
+        if offset != session.received:
+            raise OffsetMismatch(session.received)
+
+        hasher = _take_hasher(session.id, offset)
+        partial.seek(offset)
+        written = 0
+        try:
+            while written < length:
+                data = stream.read(min(COPY_CHUNK_SIZE, length - written))
+                if not data:
+                    break
+                partial.write(data)
+                if hasher:
+                    hasher.update(data)
+                written += len(data)
+        except OSError as e:
+            logger.warning(f"Upload #{session.id}: chunk at {offset} cut short after {written} bytes: {str(e)}")
+        partial.flush()
+
+        session.received = offset + written
+        if hasher:
+            _keep_hasher(session.id, session.received, hasher)
+
+        # Turn unsupported files away as soon as there is enough of them to tell
+        if not session.file_type and session.received >= min(session.file_size, SNIFF_BYTES):
+            partial.seek(0)
+            file_type = sniff_file_type(partial.read(SNIFF_BYTES))
+            if file_type is None:
+                _fail(session, UNSUPPORTED_TYPE)
+                raise UploadSessionError(UNSUPPORTED_TYPE)
+            session.file_type = file_type
+
+        session.expires_at = timezone.now() + timedelta(seconds=settings.DOCS_UPLOAD_SESSION_TTL)
+        session.save(update_fields=['received', 'file_type', 'expires_at', 'updated_at'])
+    return session
+
+
+def complete_session(session: UploadSession) -> Tuple[LegalDocument, bool]:
+    """
+    Turn a fully received upload into a document and queue its extraction.
+
+    Returns the document and whether it was created by this call; completing
+    an already completed session returns its document again, so a client
+    that lost the response can safely retry.
+    """
+    if session.status == 'completed' and session.document_id:
+        return session.document, False
+
+    with _locked(session) as partial:
+        if session.status == 'completed' and session.document_id:
+            return session.document, False
+        if session.status != 'active':
+            raise UploadSessionError(f"The upload is {session.status}.")
+        if session.received < session.file_size:
+            raise UploadSessionError(f"Only {session.received} of {session.file_size} bytes have been received.")
+        # A ZIP signature is only a DOCX if the archive holds a Word document
+        if session.file_type == DOCX_TYPE and not is_docx(partial.name):
+            _fail(session, UNSUPPORTED_TYPE)
+            raise UploadSessionError(UNSUPPORTED_TYPE)
+
+        hasher = _take_hasher(session.id, session.received)
+        upload = SessionFile(partial, name=session.original_name)
+        document = LegalDocument(
+            user=session.user,
+            original_name=session.original_name,
+            file_type=session.file_type,
+            file_size=session.file_size,
+            content_hash=hasher.hexdigest() if hasher else hash_uploaded_file(upload)
+        )
+        store_upload(document, upload)
+        document.save()
+
+        session.status = 'completed'
+        session.document = document
+        session.save(update_fields=['status', 'document', 'updated_at'])
+        # Left behind when the document shares an existing blob
+        _remove_partial(session)
+
+    enqueue_extraction(document)
+    return document, True
+
+
+def abort_session(session: UploadSession):
+    """Drop an upload session and whatever was received."""
+    _forget_hasher(session.id)
+    _remove_partial(session)
+    session.delete()
+
+
+def purge_expired_sessions() -> int:
+    """Remove upload sessions past their expiry along with their partial files."""
+    expired = list(UploadSession.objects.filter(expires_at__lt=timezone.now()))
+    for session in expired:
+        abort_session(session)
+    return len(expired)
+
+
+def _fail(session: UploadSession, error: str):
+    session.status = 'failed'
+    session.error = error
+    session.save(update_fields=['status', 'error', 'updated_at'])
+    _forget_hasher(session.id)
+    _remove_partial(session)
+
+
+def _remove_partial(session: UploadSession):
+    try:
+        os.remove(session_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def _take_hasher(session_id: int, offset: int):
+    """The hash of the first `offset` bytes of an upload, if this process has it."""
+    with _hashers_lock:
+        entry = _hashers.pop(session_id, None)
+    if offset == 0:
+        return hashlib.sha256()
+    if entry and entry[0] == offset:
+        return entry[1]
+    return None
+
+
+def _keep_hasher(session_id: int, offset: int, hasher):
+    with _hashers_lock:
+        _hashers[session_id] = (offset, hasher)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def _forget_hasher(session_id: int):
+    with _hashers_lock:
+        _hashers.pop(session_id, None)
@@ -0,0 +1,70 @@
+import re
+from typing import List
+
+# Places where a legal document can be cut without splitting a clause,
+# strongest first: section/article headings, numbered clauses, blank lines,
+# line breaks, then sentence ends.
+BOUNDARY_PATTERNS = [
+    re.compile(r'\n(?=\s*(?:section|article|clause|schedule|exhibit|part)\b)', re.IGNORECASE),
+    re.compile(r'\n(?=\s*(?:\d+(?:\.\d+)*\.?|\([a-z0-9]+\)|[ivxlc]+\.)\s)', re.IGNORECASE),
+    re.compile(r'\n\s*\n'),
+    re.compile(r'\n'),
+    re.compile(r'(?<=[.;:])\s+'),
+]
+
+
+def split_into_chunks(text: str, max_chars: int) -> List[str]:
+    """
+    Split text into consecutive chunks of at most `max_chars` characters,
+    cutting on section and clause boundaries where possible.
+    """
+    text = text.strip()
+    if not text:
+        return []
+    if len(text) <= max_chars:
+        return [text]
+    return [chunk for chunk in _split(text, max_chars, 0) if chunk.strip()]
+
+
+def _split(text: str, max_chars: int, level: int) -> List[str]:
+    if len(text) <= max_chars:
+        return [text]
+    if level == len(BOUNDARY_PATTERNS):
+        # No boundary left to honour: hard cut
+        return [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
+
+    pieces = _split_keeping_separators(text, BOUNDARY_PATTERNS[level])
+    if len(pieces) == 1:
+        return _split(text, max_chars, level + 1)
+
+    # Greedily pack pieces into chunks; oversized pieces use finer boundaries
+    chunks = []
+    current = []
+    current_length = 0
+    for piece in pieces:
+        if len(piece) > max_chars:
+            if current:
+                chunks.append(''.join(current))
+                current, current_length = [], 0
+            chunks.extend(_split(piece, max_chars, level + 1))
+        elif current_length + len(piece) > max_chars:
+            chunks.append(''.join(current))
+            current, current_length = [piece], len(piece)
+        else:
+            current.append(piece)
+            current_length += len(piece)
+    if current:
+        chunks.append(''.join(current))
+    return [chunk.strip() for chunk in chunks]
+
+
+def _split_keeping_separators(text: str, pattern) -> List[str]:
+    """Split at each match, keeping the separator at the end of the left piece."""
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        if match.end() > start:
+            pieces.append(text[start:match.end()])
+            start = match.end()
+    pieces.append(text[start:])
+    return [piece for piece in pieces if piece]
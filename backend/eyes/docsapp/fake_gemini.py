@@ -0,0 +1,220 @@
+"""
+A local stand-in for the Gemini REST API, used for benchmarks and soak tests.
+
+It speaks the generateContent and streamGenerateContent (alt=sse) wire
+format closely enough for GeminiService and AsyncGeminiService, and
+answers deterministically after a configurable delay instead of calling a
+model. Error rate and throughput caps (concurrent requests, requests per
+minute) make it answer 503/429 the way the real API does under load.
+
+Run it with `python manage.py run_fake_gemini` and point GEMINI_API_BASE
+at it. FakeLLMBackend (llm_backends.py) serves the same responses in
+process, without HTTP.
+"""
+import sys
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_completion(prompt: str) -> str:
+    """Deterministic response text for a prompt."""
+    words = prompt.split()
+    return f"Fake Gemini response to a {len(words)} word prompt: {' '.join(words[:12])}"
+
+
+def prompt_text(body: dict) -> str:
+    return "".join(
+        part.get('text', '')
+        for content in body.get('contents', [])
+        for part in content.get('parts', [])
+    )
+
+
+def fake_response_text(body: dict) -> str:
+    """Response text for a request body; JSON-schema requests get an object with every property."""
+    prompt = prompt_text(body)
+    schema = body.get('generationConfig', {}).get('responseSchema')
+    if schema and schema.get('type') == 'OBJECT':
+        return json.dumps({name: fake_completion(f"{name} {prompt}") for name in schema.get('properties', {})})
+    return fake_completion(prompt)
+
+
+def stream_pieces(text: str) -> list:
+    """How a response is split into streamed events: four words at a time."""
+    words = text.split(' ')
+    return [' '.join(words[start:start + 4]) + ' ' for start in range(0, len(words), 4)]
+
+
+def completion_payload(text: str, body: dict) -> dict:
+    prompt_tokens = max(len(prompt_text(body)) // 4, 1)
+    completion_tokens = max(len(text) // 4, 1)
+    return {
+        'candidates': [{
+            'content': {'parts': [{'text': text}], 'role': 'model'},
+            'finishReason': 'STOP',
+            'index': 0,
+        }],
+        'usageMetadata': {
+            'promptTokenCount': prompt_tokens,
+            'candidatesTokenCount': completion_tokens,
+            'totalTokenCount': prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def error_payload(code: int, status: str, message: str) -> dict:
+    return {'error': {'code': code, 'message': message, 'status': status}}
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            body = json.loads(body)
+            body['contents'][0]['parts'][0]['text']
+        except (ValueError, KeyError, IndexError, TypeError):
+            self._send_json(400, error_payload(400, 'INVALID_ARGUMENT', 'Invalid request'))
+            return
+
+        if ':streamGenerateContent' not in self.path and ':generateContent' not in self.path:
+            self._send_json(404, error_payload(404, 'NOT_FOUND', 'Not found'))
+            return
+
+        server = self.server
+        rejection = server.admit()
+        if rejection:
+            self._send_json(429, error_payload(429, 'RESOURCE_EXHAUSTED', rejection), retry_after=1)
+            return
+
+        try:
+            if server.should_fail():
+                time.sleep(server.latency * 0.1)
+                self._send_json(503, error_payload(503, 'UNAVAILABLE', 'The model is overloaded. Please try again later.'))
+                return
+
+            text = fake_response_text(body)
+            if ':streamGenerateContent' in self.path:
+                self._stream(text, body)
+            else:
+                time.sleep(server.latency)
+                self._send_json(200, completion_payload(text, body))
+        finally:
+            server.release()
+
+    def _send_json(self, status_code, payload, retry_after=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if retry_after is not None:
+            self.send_header('Retry-After', str(retry_after))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, text, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        pieces = stream_pieces(text)
+        # First token after a fraction of the latency, the rest spread over the remainder
+        time.sleep(self.server.latency * 0.2)
+        for piece in pieces:
+            event = completion_payload(piece, body)
+            self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.server.latency * 0.8 / len(pieces))
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    """
+    Threaded fake Gemini server; use as a context manager.
+
+    `error_rate` is the fraction of admitted requests answered with 503.
+    `max_concurrent` and `rpm` (0 = unlimited) cap throughput; requests
+    over either cap are answered with 429 and Retry-After, like the real
+    API's quota errors. `seed` makes the injected errors reproducible.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.5,
+                 error_rate: float = 0.0, max_concurrent: int = 0, rpm: int = 0, seed=None):
+        super().__init__((host, port), FakeGeminiHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_concurrent = max_concurrent
+        self.rpm = rpm
+        self.stats = {'requests': 0, 'rejected': 0, 'errors': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._tokens = float(rpm)
+        self._refilled_at = time.monotonic()
+        self._thread = None
+
+    def admit(self):
+        """Count a request in; returns the reason when a throughput cap rejects it."""
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.max_concurrent and self._active >= self.max_concurrent:
+                self.stats['rejected'] += 1
+                return 'Too many concurrent requests.'
+            if self.rpm:
+                now = time.monotonic()
+                self._tokens = min(float(self.rpm), self._tokens + (now - self._refilled_at) * self.rpm / 60.0)
+                self._refilled_at = now
+                if self._tokens < 1:
+                    self.stats['rejected'] += 1
+                    return 'Quota exceeded for requests per minute.'
+                self._tokens -= 1
+            self._active += 1
+            return None
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.stats['errors'] += 1
+            return failed
+
+    def handle_error(self, request, client_address):
+        # A client that timed out closes the connection before the response is written
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        """Value for GEMINI_API_BASE"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,515 @@
+import os
+import socket
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import (
+    BatchJob, BatchJobItem, DocumentPage, LegalDocument, ProcessingJob, QAAnswer
+)
+from .services import ExtractionError, iter_document_pages, join_pages, page_offsets
+from .retrieval import build_document_index
+from .ai_service import GeminiService
+from .analysis_cache import content_key, get_cached_analysis, get_or_run_analysis
+from .ratelimit import background
+from .search import index_document
+from .text_store import save_text, share_text
+
+logger = logging.getLogger(__name__)
+
+# Extracted pages are written in batches of this size while extraction runs
+PAGE_SAVE_BATCH = 10
+
+
+class JobError(Exception):
+    """Raised by a job handler when the job should be retried or failed."""
+
+
+class JobLost(Exception):
+    """Raised when another worker reclaimed a job while this one was still running it."""
+
+
+def worker_name(index: int = 0) -> str:
+    """Identify a worker process in `ProcessingJob.locked_by`."""
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def enqueue_extraction(document: LegalDocument, priority: int = 0) -> Optional[ProcessingJob]:
+    """
+    Queue text extraction for a freshly uploaded document.
+
+    Nothing is queued when a document with the same content has already been
+    extracted; its pages are reused instead. In eager mode (DOCS_JOBS_EAGER)
+    the job runs immediately in the calling process, which keeps local
+    development free of workers.
+    """
+    twin = find_extracted_twin(document)
+    if twin:
+        share_extraction(twin, document)
+        return None
+
+    job = ProcessingJob.objects.create(
+        document=document,
+        job_type='extract',
+        priority=priority,
+        max_attempts=settings.DOCS_JOB_MAX_ATTEMPTS,
+    )
+
+    if settings.DOCS_JOBS_EAGER:
+        job = _run_eagerly(job) or job
+        document.refresh_from_db()
+
+    return job
+
+
+def create_analysis_batch(user: User, document_ids: List[int], analysis_type: str) -> BatchJob:
+    """
+    Queue one analysis job per document and group them in a BatchJob.
+
+    The jobs run on the worker pool like extraction jobs, but behind them
+    (DOCS_ANALYSIS_JOB_PRIORITY), so the pool size bounds how many Gemini
+    calls a batch makes at once and the shared rate limiter keeps them
+    within quota.
+    """
+    with transaction.atomic():
+        batch = BatchJob.objects.create(user=user, analysis_type=analysis_type)
+        items = BatchJobItem.objects.bulk_create(
+            [BatchJobItem(batch=batch, document_id=document_id) for document_id in document_ids]
+        )
+        jobs = ProcessingJob.objects.bulk_create([
+            ProcessingJob(
+                document_id=item.document_id,
+                job_type='analysis',
+                analysis_type=analysis_type,
+                batch_item=item,
+                priority=settings.DOCS_ANALYSIS_JOB_PRIORITY,
+                max_attempts=settings.DOCS_JOB_MAX_ATTEMPTS,
+            )
+            for item in items
+        ])
+
+    if settings.DOCS_JOBS_EAGER:
+        for job in jobs:
+            _run_eagerly(job)
+
+    return batch
+
+
+def create_upload_batch(user: User, documents: List[LegalDocument], priority: int = 0) -> BatchJob:
+    """
+    Group freshly uploaded documents in an upload BatchJob and queue their extraction.
+
+    Like enqueue_extraction, a document whose content was already extracted
+    reuses the earlier result; the others get an extraction job linked to
+    their batch item, so the batch reports extraction progress.
+    """
+    twins = {}
+    hashes = {document.content_hash for document in documents if document.content_hash}
+    # Newest first, so the oldest matching document ends up as the twin (as in find_extracted_twin)
+    for twin in LegalDocument.objects.filter(content_hash__in=hashes, processing_status='completed').order_by('-id'):
+        twins[(twin.content_hash, twin.file_type)] = twin
+
+    with transaction.atomic():
+        batch = BatchJob.objects.create(user=user, kind='upload')
+        items = BatchJobItem.objects.bulk_create(
+            [BatchJobItem(batch=batch, document=document) for document in documents]
+        )
+        jobs = ProcessingJob.objects.bulk_create([
+            ProcessingJob(
+                document=item.document,
+                job_type='extract',
+                batch_item=item,
+                priority=priority,
+                max_attempts=settings.DOCS_JOB_MAX_ATTEMPTS,
+            )
+            for item in items
+            if (item.document.content_hash, item.document.file_type) not in twins
+        ])
+
+    reused = []
+    for item in items:
+        twin = twins.get((item.document.content_hash, item.document.file_type))
+        if twin:
+            share_extraction(twin, item.document)
+            reused.append(item.id)
+    if reused:
+        BatchJobItem.objects.filter(id__in=reused).update(status='done', updated_at=timezone.now())
+
+    if settings.DOCS_JOBS_EAGER:
+        for job in jobs:
+            _run_eagerly(job)
+
+    return batch
+
+
+def enqueue_precompute(document: LegalDocument) -> List[ProcessingJob]:
+    """
+    Queue the DOCS_PRECOMPUTE_ANALYSES of a freshly extracted document that
+    are not cached yet, so its first summary or risk view is a cache hit.
+    Types already queued or running for the same content are skipped, so
+    calling this again (e.g. after a re-extraction) queues nothing twice.
+
+    The jobs run behind extraction and batch jobs, and draw on Gemini quota
+    as background work. An interactive request for the same analysis while
+    a job is running shares its call (single-flight); one made before the
+    job starts leaves the job a cache hit. Nothing is queued in eager mode,
+    where it would hold up the upload request.
+    """
+    if settings.DOCS_JOBS_EAGER or not settings.DOCS_PRECOMPUTE_ANALYSES:
+        return []
+
+    key = content_key(document)
+    model_name = settings.GEMINI_MODEL
+    same_content = Q(document=document)
+    if document.content_hash:
+        same_content |= Q(document__content_hash=document.content_hash)
+    pending = set(
+        ProcessingJob.objects
+        .filter(same_content, job_type='analysis', status__in=['queued', 'running'])
+        .values_list('analysis_type', flat=True)
+    )
+    analysis_types = [
+        analysis_type for analysis_type in settings.DOCS_PRECOMPUTE_ANALYSES
+        if analysis_type not in pending
+        and get_cached_analysis(key, analysis_type, GeminiService.PROMPT_VERSIONS[analysis_type], model_name) is None
+    ]
+    return ProcessingJob.objects.bulk_create([
+        ProcessingJob(
+            document=document,
+            job_type='analysis',
+            analysis_type=analysis_type,
+            priority=settings.DOCS_PRECOMPUTE_JOB_PRIORITY,
+            max_attempts=settings.DOCS_JOB_MAX_ATTEMPTS,
+        )
+        for analysis_type in analysis_types
+    ])
+
+
+def _run_eagerly(job: ProcessingJob) -> Optional[ProcessingJob]:
+    job = _claim(job.id, 'queued', None, worker_name())
+    if job:
+        run_job(job)
+    return job
+
+
+def claim_next_job(worker_id: str) -> Optional[ProcessingJob]:
+    """
+    Atomically claim the next runnable job.
+
+    A job is runnable when it is queued and due, or when it is running but
+    its lock has expired (the worker holding it crashed or hung). Claiming is
+    a conditional UPDATE, so concurrent workers never run the same job twice.
+    """
+    now = timezone.now()
+    candidates = (
+        ProcessingJob.objects
+        .filter(
+            Q(status='queued', run_after__lte=now) |
+            Q(status='running', locked_until__lt=now)
+        )
+        .order_by('-priority', 'id')
+        .values_list('id', 'status', 'locked_until')[:10]
+    )
+
+    for job_id, job_status, locked_until in candidates:
+        job = _claim(job_id, job_status, locked_until, worker_id)
+        if job:
+            if job_status == 'running':
+                logger.warning(f"Reclaimed abandoned job {job.id} (attempt {job.attempts})")
+            return job
+
+    return None
+
+
+def _claim(job_id: int, expected_status: str, expected_locked_until, worker_id: str) -> Optional[ProcessingJob]:
+    now = timezone.now()
+    claimed = ProcessingJob.objects.filter(
+        id=job_id,
+        status=expected_status,
+        locked_until=expected_locked_until,
+    ).update(
+        status='running',
+        locked_by=worker_id,
+        locked_until=now + timedelta(seconds=settings.DOCS_JOB_VISIBILITY_TIMEOUT),
+        attempts=F('attempts') + 1,
+        updated_at=now,
+    )
+    if not claimed:
+        return None
+    return ProcessingJob.objects.select_related('document', 'batch_item').get(id=job_id)
+
+
+def run_job(job: ProcessingJob) -> bool:
+    """Run a claimed job and record the outcome. Returns True on success."""
+    if job.attempts > job.max_attempts:
+        # Reclaimed after its last attempt was abandoned
+        _fail_job(job, 'Maximum attempts exceeded', retry=False)
+        return False
+
+    handler = JOB_HANDLERS.get(job.job_type)
+    if handler is None:
+        _fail_job(job, f"Unknown job type: {job.job_type}", retry=False)
+        return False
+
+    try:
+        handler(job)
+    except JobLost:
+        logger.warning(f"Job {job.id} was reclaimed by another worker while it ran; discarding its outcome")
+        return False
+    except Exception as e:
+        logger.error(f"Job {job.id} ({job.job_type}) failed on attempt {job.attempts}: {str(e)}")
+        _fail_job(job, str(e), retry=job.attempts < job.max_attempts)
+        return False
+    return True
+
+
+def _owned(job: ProcessingJob):
+    """
+    The job, as long as this worker still holds it. Once its lock expires
+    another worker may reclaim it, and the slow original must not overwrite
+    the new owner's state.
+    """
+    return ProcessingJob.objects.filter(id=job.id, status='running', locked_by=job.locked_by)
+
+
+@contextmanager
+def _finishing(job: ProcessingJob):
+    """
+    Mark the job done and commit whatever the block writes in the same
+    transaction, or nothing at all (JobLost) when the job is no longer ours.
+    Handlers write their final state inside this block.
+    """
+    with transaction.atomic():
+        finished = _owned(job).update(
+            status='done',
+            locked_until=None,
+            last_error='',
+            updated_at=timezone.now(),
+        )
+        if not finished:
+            raise JobLost()
+        yield
+
+
+def _fail_job(job: ProcessingJob, error: str, retry: bool):
+    now = timezone.now()
+
+    if retry:
+        backoff = settings.DOCS_JOB_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+        updated = _owned(job).update(
+            status='queued',
+            run_after=now + timedelta(seconds=backoff),
+            locked_by='',
+            locked_until=None,
+            last_error=error,
+            updated_at=now,
+        )
+    else:
+        updated = _owned(job).update(
+            status='failed',
+            locked_until=None,
+            last_error=error,
+            updated_at=now,
+        )
+    if not updated:
+        logger.warning(f"Job {job.id} was reclaimed by another worker while it ran; discarding its outcome")
+        return
+
+    if job.job_type == 'extract':
+        job.document.processing_status = 'pending' if retry else 'failed'
+        job.document.save(update_fields=['processing_status'])
+    if job.batch_item_id:
+        BatchJobItem.objects.filter(id=job.batch_item_id).update(
+            status='queued' if retry else 'failed',
+            error=error,
+            updated_at=now,
+        )
+
+
+def extend_lock(job: ProcessingJob):
+    """Heartbeat for long jobs: push the visibility timeout forward. Raises JobLost once the job was reclaimed."""
+    extended = _owned(job).update(
+        locked_until=timezone.now() + timedelta(seconds=settings.DOCS_JOB_VISIBILITY_TIMEOUT)
+    )
+    if not extended:
+        raise JobLost()
+
+
+def find_extracted_twin(document: LegalDocument) -> Optional[LegalDocument]:
+    """Another completed document with the same bytes and file type, if any."""
+    if not document.content_hash:
+        return None
+    return (
+        LegalDocument.objects
+        .filter(
+            content_hash=document.content_hash,
+            file_type=document.file_type,
+            processing_status='completed'
+        )
+        .exclude(id=document.id)
+        .order_by('id')
+        .first()
+    )
+
+
+def share_extraction(source: LegalDocument, target: LegalDocument):
+    """Give `target` the extraction results of an identical document, without storing them again."""
+    with transaction.atomic():
+        share_text(source, target)
+        target.processing_status = 'completed'
+        target.save(update_fields=['processing_status'])
+    index_document(target)
+    logger.info(f"Reused extraction of document {source.id} for document {target.id}")
+
+
+def process_document(job: ProcessingJob):
+    """
+    Extract the text of a document: pending -> processing -> completed.
+
+    Pages are saved as they are parsed so clients can read the start of a
+    long document early. Pages that fail are recorded and skipped; the
+    document only fails when no text could be extracted at all. A retried
+    job resumes after the last saved page.
+    """
+    document = job.document
+    if job.batch_item_id:
+        BatchJobItem.objects.filter(id=job.batch_item_id).update(status='running', updated_at=timezone.now())
+
+    # An identical upload may have finished while this job was queued
+    twin = find_extracted_twin(document)
+    if twin:
+        with _finishing(job):
+            share_extraction(twin, document)
+            _finish_batch_item(job)
+        return
+
+    document.processing_status = 'processing'
+    document.save(update_fields=['processing_status'])
+
+    batch = []
+    try:
+        for page in iter_document_pages(document.file.path, document.file_type, start_page=document.pages_extracted + 1):
+            batch.append(DocumentPage(
+                document=document,
+                page_number=page.number,
+                text=page.text,
+                error=page.error or ''
+            ))
+            if len(batch) >= PAGE_SAVE_BATCH:
+                _save_pages(job, document, batch)
+                batch = []
+        _save_pages(job, document, batch)
+    except ExtractionError as e:
+        raise JobError(str(e)) from e
+
+    pages = list(document.pages.filter(error=''))
+    texts = [page.text for page in pages]
+    extracted_text = join_pages(texts)
+    if not extracted_text:
+        raise JobError(f"No text could be extracted from document {document.id}")
+
+    failed_pages = document.pages.exclude(error='').count()
+    if failed_pages:
+        logger.warning(f"Document {document.id}: {failed_pages} page(s) could not be extracted")
+
+    save_text(document, extracted_text)
+    # Lets the text endpoint serve page ranges without reading other pages
+    for page, (start, end) in zip(pages, page_offsets(texts)):
+        page.char_start, page.char_end = start, end
+    DocumentPage.objects.bulk_update(pages, ['char_start', 'char_end'], batch_size=500)
+    # Answers based on an earlier extraction of this document no longer apply
+    QAAnswer.objects.filter(document=document).exclude(text_hash=document.text_hash).delete()
+
+    # Q&A retrieval index; documents without one get it built on first question
+    try:
+        build_document_index(document, extracted_text)
+    except Exception as e:
+        logger.error(f"Error building chunk index for document {document.id}: {str(e)}")
+    index_document(document, extracted_text)
+
+    with _finishing(job):
+        document.processing_status = 'completed'
+        document.save(update_fields=['processing_status'])
+        _finish_batch_item(job)
+        enqueue_precompute(document)
+
+
+def _finish_batch_item(job: ProcessingJob):
+    if job.batch_item_id:
+        BatchJobItem.objects.filter(id=job.batch_item_id).update(status='done', error='', updated_at=timezone.now())
+
+
+def _save_pages(job: ProcessingJob, document: LegalDocument, pages):
+    if not pages:
+        return
+    with transaction.atomic():
+        # Only the worker holding the job may add pages
+        extend_lock(job)
+        DocumentPage.objects.bulk_create(pages)
+        document.pages_extracted = pages[-1].page_number
+        document.save(update_fields=['pages_extracted'])
+
+
+def process_analysis(job: ProcessingJob):
+    """Run an AI analysis of a document through the analysis cache and record it on the batch item."""
+    document = job.document
+    if job.batch_item_id:
+        BatchJobItem.objects.filter(id=job.batch_item_id).update(status='running', updated_at=timezone.now())
+
+    if not document.text_length:
+        raise JobError(f"Text of document {document.id} is not available (status: {document.processing_status})")
+
+    # Leaves part of the Gemini quota to interactive requests
+    with background():
+        result, cached = get_or_run_analysis(document, job.analysis_type)
+    if not result:
+        raise JobError(f"Gemini returned no {job.analysis_type} result for document {document.id}")
+
+    with _finishing(job):
+        if job.batch_item_id:
+            BatchJobItem.objects.filter(id=job.batch_item_id).update(
+                status='done',
+                result=result,
+                cached=cached,
+                error='',
+                updated_at=timezone.now(),
+            )
+
+
+# Handlers write their final state inside _finishing(job), which also marks the job done
+JOB_HANDLERS = {
+    'extract': process_document,
+    'analysis': process_analysis,
+}
+
+
+def work(worker_id: str, stop_event, max_jobs: Optional[int] = None, exit_when_idle: bool = False) -> int:
+    """
+    Worker loop: claim and run jobs until `stop_event` is set.
+
+    Returns the number of jobs processed.
+    """
+    processed = 0
+    while not stop_event.is_set():
+        close_old_connections()
+        job = claim_next_job(worker_id)
+
+        if job is None:
+            if exit_when_idle:
+                break
+            stop_event.wait(settings.DOCS_JOB_POLL_INTERVAL)
+            continue
+
+        run_job(job)
+        processed += 1
+        if max_jobs is not None and processed >= max_jobs:
+            break
+
+    return processed
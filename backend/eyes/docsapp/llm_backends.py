@@ -0,0 +1,497 @@
+"""
+Model backends behind GeminiService.
+
+A backend takes a generateContent request body and returns the response
+payload (or the stream of streamGenerateContent events), so prompts,
+parsing, budgeting and usage logging stay in the service whatever answers
+the call. Select one with the LLM_BACKEND setting:
+
+    'gemini'  the Gemini REST API (default)
+    'fake'    deterministic in-process responses, for offline development,
+              tests and benchmarks (no network, no API key)
+
+or a dotted path to an LLMBackend subclass. Whichever is selected is
+wrapped in ResilientBackend, which hedges slow calls and fails fast
+through a circuit breaker while the upstream is erroring.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import ipaddress
+import logging
+import threading
+import weakref
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from decouple import config
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .fake_gemini import completion_payload, fake_response_text, stream_pieces
+from .ratelimit import RateLimitTimeout, aacquire, acquire, gemini_costs
+from .resilience import CircuitBreaker, HedgeBudget, HedgePool, hedge_delay
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    """Raised by backends when a call fails"""
+
+
+class GeminiLocalError(GeminiError):
+    """The call failed before reaching Gemini (no API key, no quota in time); says nothing about its health"""
+
+
+class CircuitOpenError(GeminiError):
+    """Rejected without calling upstream while the circuit breaker is open"""
+
+
+class LLMBackend:
+    """Interface between GeminiService and a model."""
+    name = 'base'
+
+    def generate(self, model_name: str, body: Dict[str, Any], operation: str) -> Dict[str, Any]:
+        """generateContent: the response payload for a request body"""
+        raise NotImplementedError
+
+    def stream(self, model_name: str, body: Dict[str, Any], operation: str) -> Iterator[Dict[str, Any]]:
+        """streamGenerateContent: the response events, as they arrive"""
+        raise NotImplementedError
+
+    async def agenerate(self, model_name: str, body: Dict[str, Any], operation: str) -> Dict[str, Any]:
+        """Async generate, for the ASGI endpoints"""
+        raise NotImplementedError
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    """
+    Process-wide keep-alive session shared by every GeminiService, so calls
+    reuse pooled TCP+TLS connections instead of handshaking each time.
+    """
+    global _session, _session_pid
+    # Connections must not be shared with a forked parent/child
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.GEMINI_POOL_MAXSIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+# One pooled async client per event loop (a client cannot be shared across loops)
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_client() -> httpx.AsyncClient:
+    """Keep-alive client shared by every AsyncGeminiService on the running loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.GEMINI_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GEMINI_ASYNC_MAX_CONNECTIONS,
+            )
+        )
+        _async_clients[loop] = client
+    return client
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given retry (0-based)."""
+    ceiling = min(settings.GEMINI_BACKOFF_MAX, settings.GEMINI_BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+def retry_after_delay(response) -> Optional[float]:
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP date)."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_loopback_url(url: str) -> bool:
+    """Whether `url` points at this machine, such as the fake Gemini server."""
+    host = urlsplit(url).hostname or ''
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class GeminiHTTPBackend(LLMBackend):
+    """The Gemini REST API, through pooled keep-alive clients with retries and the shared rate limiter."""
+    name = 'gemini'
+
+    def _api_key(self) -> Optional[str]:
+        api_key = config('GEMINI_API_KEY', default=None)
+        # A local stand-in (run_fake_gemini) needs no key
+        if not api_key and not is_loopback_url(settings.GEMINI_API_BASE):
+            raise GeminiLocalError("GEMINI_API_KEY not found in environment variables")
+        return api_key
+
+    @staticmethod
+    def _headers(api_key: Optional[str]) -> Dict[str, str]:
+        headers = {'Content-Type': 'application/json'}
+        if api_key:
+            # Sent as a header rather than ?key= so it never appears in logged URLs
+            headers['x-goog-api-key'] = api_key
+        return headers
+
+    @staticmethod
+    def _url(model_name: str, method: str) -> str:
+        return f"{settings.GEMINI_API_BASE}/models/{model_name}:{method}"
+
+    @staticmethod
+    def _read_timeout(operation: str) -> float:
+        return settings.GEMINI_TIMEOUTS.get(operation, settings.GEMINI_TIMEOUTS['default'])
+
+    def generate(self, model_name, body, operation):
+        try:
+            response = self._post(self._url(model_name, 'generateContent'), body, operation)
+            return response.json()
+        except RateLimitTimeout as e:
+            raise GeminiLocalError(str(e)) from e
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise GeminiError(f"Error calling Gemini API: {str(e)}") from e
+
+    def stream(self, model_name, body, operation):
+        try:
+            response = self._post(
+                self._url(model_name, 'streamGenerateContent'), body, operation, params={'alt': 'sse'}, stream=True
+            )
+        except RateLimitTimeout as e:
+            raise GeminiLocalError(str(e)) from e
+        except requests.exceptions.RequestException as e:
+            raise GeminiError(f"Error calling Gemini API: {str(e)}") from e
+
+        with response:
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and line.startswith('data:'):
+                        yield json.loads(line[len('data:'):])
+            except (requests.exceptions.RequestException, ValueError) as e:
+                raise GeminiError(f"Error reading Gemini stream: {str(e)}") from e
+
+    async def agenerate(self, model_name, body, operation):
+        try:
+            response = await self._apost(self._url(model_name, 'generateContent'), body, operation)
+            return response.json()
+        except RateLimitTimeout as e:
+            raise GeminiLocalError(str(e)) from e
+        except (httpx.HTTPError, ValueError) as e:
+            raise GeminiError(f"Error calling Gemini API: {str(e)}") from e
+
+    def _post(self, url: str, data: Dict[str, Any], operation: str,
+              params: Optional[Dict[str, str]] = None, stream: bool = False) -> requests.Response:
+        """
+        POST through the shared session, retrying 429/5xx responses and
+        connection failures with exponential backoff. A Retry-After header
+        is honored; if it asks for longer than GEMINI_BACKOFF_MAX we give up
+        rather than retry early. Every attempt first waits for capacity in
+        the shared GEMINI_RPM/GEMINI_TPM token buckets.
+
+        Read timeouts are not retried: the request reached Gemini, which may
+        still be generating (and charging for) it, and a retry would keep
+        the caller waiting another full read timeout. Slow calls are hedged
+        by ResilientBackend instead.
+        """
+        api_key = self._api_key()
+        session = get_http_session()
+        timeout = (settings.GEMINI_CONNECT_TIMEOUT, self._read_timeout(operation))
+        max_retries = settings.GEMINI_MAX_RETRIES
+
+        for attempt in range(max_retries + 1):
+            acquire(gemini_costs(data))
+            try:
+                with metrics.timer(f'gemini.http.{operation}'):
+                    response = session.post(
+                        url,
+                        params=params,
+                        headers=self._headers(api_key),
+                        json=data,
+                        timeout=timeout,
+                        stream=stream
+                    )
+            # Connect timeouts are ConnectionErrors; read timeouts are not (see above)
+            except requests.exceptions.ConnectionError as e:
+                if attempt == max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"Gemini connection error ({operation}), retrying in {delay:.1f}s: {str(e)}")
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt == max_retries:
+                    response.raise_for_status()
+                    return response
+
+                delay = retry_after_delay(response)
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                elif delay > settings.GEMINI_BACKOFF_MAX:
+                    response.raise_for_status()
+                response.close()
+                logger.warning(f"Gemini returned {response.status_code} ({operation}), retrying in {delay:.1f}s")
+
+            time.sleep(delay)
+
+    async def _apost(self, url: str, data: Dict[str, Any], operation: str) -> httpx.Response:
+        """Async _post, with the same retry, backoff and Retry-After rules (read timeouts are not retried)"""
+        api_key = self._api_key()
+        client = get_async_client()
+        timeout = httpx.Timeout(self._read_timeout(operation), connect=settings.GEMINI_CONNECT_TIMEOUT)
+        max_retries = settings.GEMINI_MAX_RETRIES
+
+        for attempt in range(max_retries + 1):
+            await aacquire(gemini_costs(data))
+            try:
+                with metrics.timer(f'gemini.http.{operation}'):
+                    response = await client.post(
+                        url,
+                        headers=self._headers(api_key),
+                        json=data,
+                        timeout=timeout
+                    )
+            except httpx.TransportError as e:
+                if attempt == max_retries or isinstance(e, httpx.ReadTimeout):
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"Gemini connection error ({operation}), retrying in {delay:.1f}s: {str(e)}")
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt == max_retries:
+                    response.raise_for_status()
+                    return response
+
+                delay = retry_after_delay(response)
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                elif delay > settings.GEMINI_BACKOFF_MAX:
+                    response.raise_for_status()
+                logger.warning(f"Gemini returned {response.status_code} ({operation}), retrying in {delay:.1f}s")
+
+            await asyncio.sleep(delay)
+
+
+class FakeLLMBackend(LLMBackend):
+    """
+    Deterministic in-process responses: the same prompt always gets the same
+    text, JSON-schema requests get a JSON object with every property, and
+    usage metadata is filled in. FAKE_LLM_LATENCY adds a delay per call.
+    """
+    name = 'fake'
+
+    def generate(self, model_name, body, operation):
+        time.sleep(settings.FAKE_LLM_LATENCY)
+        return self._payload(body)
+
+    def stream(self, model_name, body, operation):
+        text = fake_response_text(body)
+        pieces = stream_pieces(text)
+        for piece in pieces:
+            time.sleep(settings.FAKE_LLM_LATENCY / len(pieces))
+            yield completion_payload(piece, body)
+
+    async def agenerate(self, model_name, body, operation):
+        await asyncio.sleep(settings.FAKE_LLM_LATENCY)
+        return self._payload(body)
+
+    @staticmethod
+    def _payload(body):
+        return completion_payload(fake_response_text(body), body)
+
+
+class ResilientBackend(LLMBackend):
+    """
+    Wraps a backend with hedged requests and a circuit breaker (resilience.py).
+
+    A generate call still running after the hedge delay for its operation
+    (a high percentile of recent latencies) gets a second identical
+    request, within the hedge budget; the first successful response wins.
+    Streams are not hedged. While the breaker is open, calls raise
+    CircuitOpenError at once instead of waiting on a failing upstream.
+
+    A hedge is a full request: the inner backend takes its share of the
+    Gemini rate limit like any other. Async losers are cancelled, but a
+    sync loser cannot be, and runs to completion on the hedge pool.
+    """
+
+    def __init__(self, inner: LLMBackend):
+        self.inner = inner
+        self.name = inner.name
+        self.breaker = CircuitBreaker('gemini')
+        self.hedge_budget = HedgeBudget()
+        self.hedge_pool = HedgePool(settings.GEMINI_HEDGE_WORKERS)
+
+    def generate(self, model_name, body, operation):
+        self._admit()
+        with self._recording():
+            return self._hedged_generate(model_name, body, operation)
+
+    def stream(self, model_name, body, operation):
+        self._admit()
+        with self._recording():
+            yield from self.inner.stream(model_name, body, operation)
+
+    async def agenerate(self, model_name, body, operation):
+        self._admit()
+        with self._recording():
+            return await self._ahedged_generate(model_name, body, operation)
+
+    @contextmanager
+    def _recording(self):
+        """
+        Record the outcome of an admitted call on the breaker, however it
+        ends, so a half-open trial is never left running. Local errors count
+        as successes; cancellations and unexpected errors as failures.
+        """
+        try:
+            yield
+        except GeminiLocalError:
+            self.breaker.record(True)
+            raise
+        except GeneratorExit:
+            # The consumer closed the stream (e.g. the client disconnected): no outcome
+            self.breaker.release()
+            raise
+        except BaseException:
+            self.breaker.record(False)
+            raise
+        else:
+            self.breaker.record(True)
+
+    def _admit(self):
+        metrics.increment('gemini.calls')
+        if not self.breaker.allow():
+            metrics.increment('gemini.breaker_rejected')
+            raise CircuitOpenError("Gemini is failing; not calling it until the circuit breaker closes")
+        self.hedge_budget.earn()
+
+    def _timed(self, func, model_name, body, operation):
+        """
+        Call the inner backend, observing the latency of successful calls per
+        operation. This includes retries and quota waits, as callers see it;
+        gemini.http.<operation> times each HTTP attempt alone.
+        """
+        started = time.monotonic()
+        result = func(model_name, body, operation)
+        metrics.observe(f'gemini.{operation}', time.monotonic() - started)
+        return result
+
+    async def _atimed(self, model_name, body, operation):
+        started = time.monotonic()
+        result = await self.inner.agenerate(model_name, body, operation)
+        metrics.observe(f'gemini.{operation}', time.monotonic() - started)
+        return result
+
+    def _hedged_generate(self, model_name, body, operation):
+        delay = hedge_delay(f'gemini.{operation}')
+        primary = None
+        if delay is not None:
+            primary = self.hedge_pool.try_submit(self._timed, self.inner.generate, model_name, body, operation)
+        if primary is None:
+            return self._timed(self.inner.generate, model_name, body, operation)
+
+        pending = {primary}
+        done, pending = wait(pending, timeout=delay)
+        if not done and self.hedge_budget.spend():
+            hedge = self.hedge_pool.try_submit(self._timed, self.inner.generate, model_name, body, operation)
+            if hedge is not None:
+                metrics.increment('gemini.hedged')
+                pending.add(hedge)
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+        error = None
+        while True:
+            for future in done:
+                try:
+                    result = future.result()
+                except GeminiError as e:
+                    error = e
+                    continue
+                if future is not primary:
+                    metrics.increment('gemini.hedge_wins')
+                return result
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    async def _ahedged_generate(self, model_name, body, operation):
+        delay = hedge_delay(f'gemini.{operation}')
+        if delay is None:
+            return await self._atimed(model_name, body, operation)
+
+        primary = asyncio.ensure_future(self._atimed(model_name, body, operation))
+        pending = {primary}
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done and self.hedge_budget.spend():
+            metrics.increment('gemini.hedged')
+            pending.add(asyncio.ensure_future(self._atimed(model_name, body, operation)))
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+        error = None
+        try:
+            while True:
+                for task in done:
+                    try:
+                        result = task.result()
+                    except GeminiError as e:
+                        error = e
+                        continue
+                    if task is not primary:
+                        metrics.increment('gemini.hedge_wins')
+                    return result
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # The losing request is no longer needed
+            for task in pending:
+                task.cancel()
+
+
+LLM_BACKENDS = {
+    'gemini': GeminiHTTPBackend,
+    'fake': FakeLLMBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_llm_backend() -> LLMBackend:
+    """
+    The backend selected by LLM_BACKEND, wrapped in ResilientBackend.
+    Shared per process so its breaker and latency figures see every call.
+    """
+    name = settings.LLM_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend_class = LLM_BACKENDS.get(name) or import_string(name)
+            backend = _backends.setdefault(name, ResilientBackend(backend_class()))
+    return backend
@@ -0,0 +1,111 @@
+import os
+import time
+import shutil
+import tempfile
+import asyncio
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from docsapp.fake_gemini import FakeGeminiServer
+from docsapp.models import LegalDocument
+from docsapp.text_store import save_text
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrency of the sync (WSGI) and async (ASGI) AI endpoints "
+        "against a local fake Gemini server. Runs on a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Concurrent requests per run.")
+        parser.add_argument('--latency', type=float, default=0.5, help="Fake Gemini latency in seconds.")
+        parser.add_argument(
+            '--sync-threads', type=int, default=8,
+            help="WSGI worker threads available to the sync run (e.g. gunicorn workers x threads)."
+        )
+
+    def handle(self, *args, **options):
+        # Concurrent requests write to the database (rate limiter, call log); an
+        # in-memory SQLite test database fails such writes instead of waiting
+        temp_dir = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = User.objects.create_user('bench', password='bench-password')
+            document = LegalDocument.objects.create(
+                user=user,
+                file='documents/bench.txt',
+                original_name='bench.txt',
+                file_type='text/plain',
+                file_size=1024,
+                processing_status='completed',
+            )
+            save_text(document, "The Tenant shall give ninety days written notice of termination. " * 20)
+            token = str(RefreshToken.for_user(user).access_token)
+
+            with FakeGeminiServer(latency=options['latency']) as server, \
+                    override_settings(GEMINI_API_BASE=server.base_url, ALLOWED_HOSTS=['testserver']):
+                self.stdout.write(
+                    f"{options['requests']} concurrent Q&A requests, fake Gemini latency "
+                    f"{options['latency'] * 1000:.0f} ms"
+                )
+                self._report('sync  (WSGI)', *self._run_sync(document.id, token, options))
+                self._report('async (ASGI)', *self._run_async(document.id, token, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # Every request arrives at once, so latencies are measured from the start
+    # of the run and include time spent waiting for a free worker. Questions
+    # are distinct so the Q&A cache and single-flight don't absorb the load.
+
+    def _run_sync(self, document_id, token, options):
+        path = f'/api/docs/{document_id}/qa/'
+        started = time.perf_counter()
+
+        def request(number):
+            response = Client().post(
+                path, {'question': f'What is the notice period? (sync {number})'},
+                content_type='application/json', headers={'Authorization': f'Bearer {token}'}
+            )
+            return response.status_code, time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=options['sync_threads']) as executor:
+            results = list(executor.map(request, range(options['requests'])))
+        return results, time.perf_counter() - started
+
+    def _run_async(self, document_id, token, options):
+        path = f'/api/docs/{document_id}/qa/async/'
+        started = time.perf_counter()
+
+        async def request(client, number):
+            response = await client.post(
+                path, {'question': f'What is the notice period? (async {number})'},
+                content_type='application/json', headers={'Authorization': f'Bearer {token}'}
+            )
+            return response.status_code, time.perf_counter() - started
+
+        async def run():
+            client = AsyncClient()
+            return await asyncio.gather(*(request(client, number) for number in range(options['requests'])))
+
+        results = asyncio.run(run())
+        return results, time.perf_counter() - started
+
+    def _report(self, label, results, elapsed):
+        latencies = sorted(latency for _, latency in results)
+        ok = sum(1 for status_code, _ in results if status_code == 200)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        self.stdout.write(
+            f"{label}: {ok}/{len(results)} ok, wall {elapsed:6.2f} s, "
+            f"{len(results) / elapsed:7.1f} req/s, p50 {statistics.median(latencies) * 1000:7.0f} ms, "
+            f"p95 {p95 * 1000:7.0f} ms"
+        )
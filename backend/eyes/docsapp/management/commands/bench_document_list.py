@@ -0,0 +1,166 @@
+import os
+import time
+import shutil
+import tempfile
+import statistics
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from docsapp.models import DocumentTextChunk, LegalDocument
+from docsapp.serializers import LegalDocumentSerializer
+from docsapp.text_store import compress_chunks, text_key
+
+INDEX_NAME = 'document_user_uploaded_idx'
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the document list for a user with many documents: the old "
+        "unpaginated full-row query against cursor pages over the "
+        "(user, -uploaded_at, -id) index. Runs on a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=10000, help="Documents owned by the benchmark user.")
+        parser.add_argument('--other-documents', type=int, default=10000, help="Documents owned by other users.")
+        parser.add_argument('--text-kb', type=int, default=20, help="Extracted text per document, in KB.")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement (median is reported).")
+
+    def handle(self, *args, **options):
+        temp_dir = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = self._populate(options)
+            token = str(RefreshToken.for_user(user).access_token)
+            self.stdout.write(
+                f"{options['documents']} documents ({options['text_kb']} KB of text each) for one user, "
+                f"{options['other_documents']} for others"
+            )
+
+            with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=True):
+                everything = LegalDocument.objects.filter(user=user)
+                listed = everything.only(*LegalDocumentSerializer.Meta.fields)
+                self._measure("fetch all rows, all columns", lambda: len(list(everything.all())), options, 'rows')
+                self._measure("fetch all rows, listed columns", lambda: len(list(listed.all())), options, 'rows')
+                self._measure("unpaginated list (before)", lambda: self._serialize(everything), options, 'rows')
+                self._measure("unpaginated list, listed columns", lambda: self._serialize(listed), options, 'rows')
+                self._measure("first page via API", lambda: self._get(token, '/api/docs/'), options)
+                last_page = self._last_page_url(token)
+                self._measure("last page via API", lambda: self._get(token, last_page), options)
+                self._walk_pages(token)
+
+                self.stdout.write("\nQuery plan of a cursor page:")
+                self._explain(user)
+                with connection.schema_editor() as editor:
+                    editor.remove_index(LegalDocument, self._index())
+                self._measure("first page via API, without index", lambda: self._get(token, '/api/docs/'), options)
+                self.stdout.write("Query plan without the index:")
+                self._explain(user)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _populate(self, options):
+        user = User.objects.create_user('bench', password='bench-password')
+        others = [User.objects.create_user(f'other{i}') for i in range(10)]
+        text = ("The Tenant shall give ninety days written notice of termination. " * 16 * options['text_kb'])[:options['text_kb'] * 1024]
+        now = timezone.now()
+
+        def documents(owner_for, count):
+            return [
+                LegalDocument(
+                    user=owner_for(i),
+                    file=f'documents/bench-{i}.txt',
+                    original_name=f'contract-{i}.txt',
+                    file_type='text/plain',
+                    file_size=len(text),
+                    text_length=len(text),
+                    text_hash=text_key(text),
+                    processing_status='completed',
+                )
+                for i in range(count)
+            ]
+
+        LegalDocument.objects.bulk_create(documents(lambda i: user, options['documents']), batch_size=500)
+        LegalDocument.objects.bulk_create(
+            documents(lambda i: others[i % len(others)], options['other_documents']), batch_size=500
+        )
+        chunks = compress_chunks(text)
+        DocumentTextChunk.objects.bulk_create(
+            (
+                DocumentTextChunk(document_id=document_id, index=index, data=data)
+                for document_id in LegalDocument.objects.values_list('id', flat=True)
+                for index, data in enumerate(chunks)
+            ),
+            batch_size=500
+        )
+        # auto_now_add gives a whole batch the same time; spread uploads out like real ones
+        ids = list(LegalDocument.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), 500):
+            batch = LegalDocument.objects.filter(id__in=ids[start:start + 500]).only('id')
+            for offset, document in enumerate(batch):
+                document.uploaded_at = now - timedelta(minutes=len(ids) - start - offset)
+            LegalDocument.objects.bulk_update(batch, ['uploaded_at'])
+        connection.cursor().execute('ANALYZE')
+        return user
+
+    @staticmethod
+    def _serialize(queryset):
+        return len(LegalDocumentSerializer(queryset.all(), many=True).data)
+
+    @staticmethod
+    def _get(token, url):
+        response = Client().get(url, headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 200, response.content
+        return len(response.content)
+
+    def _last_page_url(self, token):
+        url, previous = '/api/docs/', None
+        while url:
+            previous = url
+            url = Client().get(url, headers={'Authorization': f'Bearer {token}'}).json()['next']
+        return previous
+
+    def _walk_pages(self, token):
+        started = time.perf_counter()
+        url, pages, rows = '/api/docs/?page_size=200', 0, 0
+        while url:
+            data = Client().get(url, headers={'Authorization': f'Bearer {token}'}).json()
+            pages += 1
+            rows += len(data['results'])
+            url = data['next']
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{'walk all pages of 200':<38} {elapsed * 1000:9.1f} ms  ({pages} pages, {rows} rows)")
+
+    def _measure(self, label, run, options, unit='bytes'):
+        timings = []
+        for _ in range(options['repeat']):
+            reset_queries()
+            started = time.perf_counter()
+            size = run()
+            timings.append(time.perf_counter() - started)
+        self.stdout.write(
+            f"{label:<38} {statistics.median(timings) * 1000:9.1f} ms  "
+            f"({size} {unit}, {len(connection.queries)} queries)"
+        )
+
+    @staticmethod
+    def _index():
+        return next(index for index in LegalDocument._meta.indexes if index.name == INDEX_NAME)
+
+    def _explain(self, user):
+        queryset = (
+            LegalDocument.objects.filter(user=user)
+            .only(*LegalDocumentSerializer.Meta.fields)
+            .order_by('-uploaded_at', '-id')[:50]
+        )
+        for line in queryset.explain().splitlines():
+            self.stdout.write(f"  {line}")
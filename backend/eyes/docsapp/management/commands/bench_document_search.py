@@ -0,0 +1,129 @@
+import os
+import time
+import random
+import shutil
+import tempfile
+import statistics
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from docsapp import search
+from docsapp.models import LegalDocument
+from docsapp.text_store import save_text
+
+# Clauses documents are assembled from; rare ones make selective queries
+COMMON_CLAUSES = [
+    "The Tenant shall pay rent monthly in advance on the first day of each month.",
+    "Either party may terminate this agreement with ninety days written notice.",
+    "This agreement is governed by the laws of the State of New York.",
+    "The Supplier warrants that the goods are free from defects in material and workmanship.",
+    "Notices shall be delivered in writing to the addresses set out above.",
+    "The Employee shall keep all confidential information strictly confidential.",
+]
+RARE_CLAUSES = [
+    "The Contractor shall indemnify and hold harmless the Owner against all claims.",
+    "Any dispute shall be settled by binding arbitration in Geneva.",
+    "Liquidated damages of five hundred dollars per day apply to late completion.",
+]
+QUERIES = ['force majeure', 'indemnification', 'arbitration Geneva', 'terminate notice', 'rent']
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark /api/docs/search/ for a user with many documents, with the "
+        "full-text index and with the fallback scan. Runs on a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=20000, help="Documents owned by the benchmark user.")
+        parser.add_argument('--other-documents', type=int, default=20000, help="Documents owned by other users.")
+        parser.add_argument('--text-kb', type=int, default=8, help="Extracted text per document, in KB.")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement (median is reported).")
+
+    def handle(self, *args, **options):
+        temp_dir = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            search._available.clear()
+            user = self._populate(options)
+            token = str(RefreshToken.for_user(user).access_token)
+            backend = search.search_backend()
+            self.stdout.write(
+                f"{options['documents']} documents ({options['text_kb']} KB of text each) for one user, "
+                f"{options['other_documents']} for others; index: {backend or 'none'}"
+            )
+
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                for query in QUERIES:
+                    self._measure(f"search {query!r}", token, query, options)
+                if backend:
+                    started = time.perf_counter()
+                    indexed = search.rebuild_index()
+                    self.stdout.write(f"{'rebuild index':<38} {(time.perf_counter() - started) * 1000:9.1f} ms  ({indexed} documents)")
+                    search._available[connection.alias] = None
+                    for query in QUERIES[:3]:
+                        self._measure(f"scan {query!r} (no index)", token, query, options)
+        finally:
+            search._available.clear()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _populate(self, options):
+        user = User.objects.create_user('bench', password='bench-password')
+        others = [User.objects.create_user(f'other{i}') for i in range(10)]
+        rng = random.Random(0)
+        size = options['text_kb'] * 1024
+
+        def text(i):
+            clauses = []
+            while sum(len(clause) + 1 for clause in clauses) < size:
+                clauses.append(rng.choice(RARE_CLAUSES) if rng.random() < 0.002 else rng.choice(COMMON_CLAUSES))
+            if i % 100 == 0:
+                clauses.insert(len(clauses) // 2, "Indemnification obligations survive termination.")
+            if i == options['documents'] // 3:
+                clauses.insert(len(clauses) // 2, "Neither party is liable for delays caused by force majeure.")
+            return ' '.join(clauses)
+
+        def documents(owner_for, start, count):
+            return [
+                LegalDocument(
+                    user=owner_for(i),
+                    file=f'documents/bench-{i}.txt',
+                    original_name=f'contract-{i}.txt',
+                    file_type='text/plain',
+                    file_size=size,
+                    processing_status='completed',
+                )
+                for i in range(start, start + count)
+            ]
+
+        started = time.perf_counter()
+        for owner_for, count in ((lambda i: user, options['documents']),
+                                 (lambda i: others[i % len(others)], options['other_documents'])):
+            for start in range(0, count, 500):
+                with transaction.atomic():
+                    batch = LegalDocument.objects.bulk_create(documents(owner_for, start, min(500, count - start)))
+                    for offset, document in enumerate(batch):
+                        body = text(start + offset)
+                        save_text(document, body)
+                        search.index_document(document, body)
+        self.stdout.write(f"{'populate and index':<38} {(time.perf_counter() - started) * 1000:9.1f} ms")
+        connection.cursor().execute('ANALYZE')
+        return user
+
+    def _measure(self, label, token, query, options):
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            response = Client().get('/api/docs/search/', {'q': query}, headers={'Authorization': f'Bearer {token}'})
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.content
+        self.stdout.write(
+            f"{label:<38} {statistics.median(timings) * 1000:9.1f} ms  ({len(response.json()['results'])} results)"
+        )
@@ -0,0 +1,87 @@
+import os
+import time
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from docsapp.services import extract_pdf_pages
+
+
+def build_sample_pdf(path: str, pages: int, lines_per_page: int = 45):
+    """Write a plain-text PDF with `pages` pages of contract-like filler."""
+    line = "The Tenant shall indemnify and hold harmless the Landlord against all claims, section {page}.{line}."
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page object ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for page in range(pages):
+        stream = ["BT /F1 9 Tf 40 800 Td 11 TL"]
+        for number in range(lines_per_page):
+            stream.append(f"({line.format(page=page + 1, line=number + 1)}) '")
+        stream.append("ET")
+        content = "\n".join(stream).encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    with open(path, 'wb') as out:
+        out.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(out.tell())
+            out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = out.tell()
+        out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            out.write(b"%010d 00000 n \n" % offset)
+        out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+class Command(BaseCommand):
+    help = "Benchmark sharded PDF extraction against single-process extraction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help="PDF to benchmark (a synthetic one is generated if omitted).")
+        parser.add_argument('--pages', type=int, default=240, help="Pages in the synthetic PDF.")
+        parser.add_argument('--workers', default='1,2,4', help="Comma separated worker counts to compare.")
+        parser.add_argument('--min-pages', type=int, default=25, help="PDF_MIN_PAGES_PER_SHARD for the run.")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per worker count (best is reported).")
+
+    def handle(self, *args, **options):
+        path = options['file']
+        temp_dir = None
+        if not path:
+            temp_dir = tempfile.TemporaryDirectory()
+            path = os.path.join(temp_dir.name, 'sample.pdf')
+            build_sample_pdf(path, options['pages'])
+
+        try:
+            baseline = None
+            for workers in [int(value) for value in options['workers'].split(',')]:
+                with override_settings(
+                    PDF_EXTRACTION_WORKERS=workers, PDF_MIN_PAGES_PER_SHARD=options['min_pages'], PDF_PARALLEL_MIN_PAGES=0
+                ):
+                    timings = []
+                    for _ in range(options['repeat']):
+                        started = time.perf_counter()
+                        pages = extract_pdf_pages(path)
+                        timings.append(time.perf_counter() - started)
+
+                best = min(timings)
+                baseline = baseline or best
+                self.stdout.write(
+                    f"workers={workers:<3} pages={len(pages or []):<5} "
+                    f"best={best * 1000:8.1f} ms  speedup={baseline / best:4.2f}x"
+                )
+        finally:
+            if temp_dir:
+                temp_dir.cleanup()
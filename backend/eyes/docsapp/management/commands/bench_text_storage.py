@@ -0,0 +1,130 @@
+import os
+import time
+import random
+import shutil
+import tempfile
+import statistics
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from docsapp.models import DocumentTextChunk, LegalDocument
+from docsapp.text_store import load_range, load_text, save_text
+
+# Documents are random sentences over this vocabulary, so they compress
+# roughly like prose rather than like one repeated paragraph
+VOCABULARY = (
+    "the party parties shall agreement contract tenant landlord supplier customer employee employer "
+    "notice days written terminate termination breach remedy cure period payment invoice fees rent "
+    "liability damages indemnify indemnification confidential information disclose obligations "
+    "warranty warrants goods services delivery acceptance governing law jurisdiction dispute "
+    "arbitration court reasonable efforts consent assign assignment subcontract insurance policy "
+    "force majeure event delay performance renewal term effective date schedule exhibit section "
+    "hereto hereof herein thereof pursuant subject to provided that in accordance with any all each "
+    "not without prior of to in on by for from with as such or and a an this that which may must will"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure compressed text storage: stored bytes against raw text, and the "
+        "time to fetch a document row, load its whole text, load a small "
+        "character range, or read one through the text endpoint. Runs on a "
+        "throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=500, help="Documents to store.")
+        parser.add_argument('--text-kb', type=int, default=400, help="Extracted text per document, in KB.")
+        parser.add_argument('--repeat', type=int, default=50, help="Runs per measurement (median is reported).")
+
+    def handle(self, *args, **options):
+        temp_dir = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            raw_bytes = self._populate(options)
+            stored = sum(len(data) for data in DocumentTextChunk.objects.values_list('data', flat=True).iterator())
+            self.stdout.write(
+                f"{options['documents']} documents of {options['text_kb']} KB: "
+                f"{raw_bytes / 2 ** 20:.1f} MB of text stored in {stored / 2 ** 20:.1f} MB "
+                f"({raw_bytes / stored:.1f}x)"
+            )
+
+            ids = list(LegalDocument.objects.values_list('id', flat=True))
+            rng = random.Random(1)
+            document = LegalDocument.objects.get(id=ids[0])
+            self._measure("fetch document row", lambda: LegalDocument.objects.get(id=rng.choice(ids)), options)
+            self._measure("load whole text", lambda: load_text(document), options)
+
+            def read_range():
+                offset = rng.randrange(document.text_length - 2048)
+                return load_range(document, offset, offset + 2048)
+
+            self._measure("load 2 KB at a random offset", read_range, options)
+
+            headers = {'Authorization': f'Bearer {RefreshToken.for_user(document.user).access_token}'}
+            url = f'/api/docs/{document.id}/text/'
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                def get_range():
+                    offset = rng.randrange(document.text_length - 20000)
+                    response = Client().get(
+                        url, {'start': offset, 'end': offset + 20000},
+                        headers={**headers, 'Accept-Encoding': 'gzip'}
+                    )
+                    assert response.status_code == 200, response.content
+
+                def revalidate():
+                    response = Client().get(url, headers={**headers, 'If-None-Match': etag})
+                    assert response.status_code == 304, response.status_code
+
+                etag = Client().get(url, headers=headers)['ETag']
+                self._measure("text endpoint, 20 KB range", get_range, options)
+                self._measure("text endpoint, 304 revalidation", revalidate, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _populate(self, options):
+        user = User.objects.create_user('bench', password='bench-password')
+        rng = random.Random(0)
+        size = options['text_kb'] * 1024
+        raw_bytes = 0
+        for start in range(0, options['documents'], 50):
+            with transaction.atomic():
+                for i in range(start, min(start + 50, options['documents'])):
+                    document = LegalDocument.objects.create(
+                        user=user,
+                        file=f'documents/bench-{i}.txt',
+                        original_name=f'contract-{i}.txt',
+                        file_type='text/plain',
+                        file_size=size,
+                        processing_status='completed',
+                    )
+                    text = self._text(rng, size)
+                    raw_bytes += len(text.encode('utf-8'))
+                    save_text(document, text)
+        return raw_bytes
+
+    @staticmethod
+    def _text(rng, size):
+        sentences = []
+        length = 0
+        while length < size:
+            words = rng.choices(VOCABULARY, k=rng.randint(8, 30))
+            sentence = ' '.join(words).capitalize() + f" ({rng.randint(1, 999)})."
+            sentences.append(sentence)
+            length += len(sentence) + 1
+        return ' '.join(sentences)[:size]
+
+    def _measure(self, label, run, options):
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        self.stdout.write(f"{label:<32} {statistics.median(timings) * 1000:8.2f} ms")
@@ -0,0 +1,130 @@
+import os
+import time
+import logging
+import shutil
+import tempfile
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent upload throughput (with extraction run in the request, "
+        "so every upload writes its extracted text) while other clients read the "
+        "document list. Compares the configured database settings against untuned "
+        "ones. Runs on a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uploads', type=int, default=200, help="Uploads per run.")
+        parser.add_argument('--threads', type=int, default=16, help="Concurrent uploading clients.")
+        parser.add_argument('--readers', type=int, default=4, help="Clients listing documents during the uploads.")
+        parser.add_argument('--text-kb', type=int, default=200, help="Size of each uploaded text file, in KB.")
+
+    def handle(self, *args, **options):
+        temp_dir = tempfile.mkdtemp()
+        settings_dict = connection.settings_dict
+        configured = (settings_dict['OPTIONS'], settings_dict['CONN_MAX_AGE'])
+
+        if connection.vendor == 'sqlite':
+            settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'bench.sqlite3')
+            profiles = [
+                ("sqlite, default journal", {}, 0),
+                ("sqlite, configured", *configured),
+            ]
+        else:
+            untuned = {key: value for key, value in configured[0].items() if key != 'pool'}
+            profiles = [
+                (f"{connection.vendor}, new connection per request", untuned, 0),
+                (f"{connection.vendor}, configured", *configured),
+            ]
+
+        self.stdout.write(
+            f"{options['uploads']} uploads of {options['text_kb']} KB from {options['threads']} threads, "
+            f"{options['readers']} readers listing documents"
+        )
+        # Failed uploads are counted in the report instead of logged
+        logging.disable(logging.ERROR)
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=['testserver'], MEDIA_ROOT=temp_dir, DOCS_JOBS_EAGER=True,
+                DEBUG_PROPAGATE_EXCEPTIONS=False
+            ):
+                for label, db_options, conn_max_age in profiles:
+                    settings_dict['OPTIONS'], settings_dict['CONN_MAX_AGE'] = db_options, conn_max_age
+                    connection.close()
+                    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                    try:
+                        self._report(label, *self._run(options))
+                    finally:
+                        connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            logging.disable(logging.NOTSET)
+            settings_dict['OPTIONS'], settings_dict['CONN_MAX_AGE'] = configured
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _run(self, options):
+        user = User.objects.create_user('bench', password='bench-password')
+        headers = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+        body = ("The Tenant shall give ninety days written notice of termination. " * 16 * options['text_kb'])
+        body = body[:options['text_kb'] * 1024]
+        uploading = threading.Event()
+        uploading.set()
+        read_timings = []
+
+        def upload(number):
+            client = Client(raise_request_exception=False)
+            started = time.perf_counter()
+            try:
+                content = f"Agreement {number}.\n{body}".encode()
+                response = client.post(
+                    '/api/docs/upload/',
+                    {'file': SimpleUploadedFile(f'contract-{number}.txt', content, content_type='text/plain')},
+                    headers=headers
+                )
+                return response.status_code, time.perf_counter() - started
+            finally:
+                connection.close()
+
+        def read():
+            client = Client(raise_request_exception=False)
+            try:
+                while uploading.is_set():
+                    started = time.perf_counter()
+                    client.get('/api/docs/', headers=headers)
+                    read_timings.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        readers = [threading.Thread(target=read) for _ in range(options['readers'])]
+        for reader in readers:
+            reader.start()
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                results = list(executor.map(upload, range(options['uploads'])))
+        finally:
+            elapsed = time.perf_counter() - started
+            uploading.clear()
+            for reader in readers:
+                reader.join()
+        return results, elapsed, read_timings
+
+    def _report(self, label, results, elapsed, read_timings):
+        latencies = sorted(seconds for code, seconds in results if code == 201)
+        failed = sum(1 for code, seconds in results if code != 201)
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+        reads_p95 = sorted(read_timings)[int(len(read_timings) * 0.95)] if read_timings else 0.0
+        self.stdout.write(
+            f"{label:<40} {len(latencies) / elapsed:7.1f} uploads/s  "
+            f"p50 {statistics.median(latencies) * 1000 if latencies else 0:7.0f} ms  p95 {p95 * 1000:7.0f} ms  "
+            f"failed {failed:3d}  list p95 {reads_p95 * 1000:6.0f} ms ({len(read_timings)} reads)"
+        )
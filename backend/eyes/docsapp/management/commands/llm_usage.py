@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Q, Sum
+from django.utils import timezone
+
+from docsapp.models import LLMCallLog
+from docsapp.tokens import output_tokens, prompt_limit
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize recorded model calls per operation: token usage against the "
+        "configured budgets, estimator accuracy and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help="Only include calls from the last N days.")
+        parser.add_argument('--prune', action='store_true', help="Delete call records older than --days.")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+
+        if options['prune']:
+            deleted, _ = LLMCallLog.objects.filter(created_at__lt=since).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} call records"))
+            return
+
+        rows = (
+            LLMCallLog.objects
+            .filter(created_at__gte=since)
+            .values('operation')
+            .annotate(
+                calls=Count('id'),
+                failed=Count('id', filter=Q(succeeded=False)),
+                total_prompt=Sum('prompt_tokens'),
+                total_completion=Sum('completion_tokens'),
+                avg_prompt=Avg('prompt_tokens'),
+                avg_estimated=Avg('estimated_prompt_tokens', filter=Q(prompt_tokens__isnull=False)),
+                avg_completion=Avg('completion_tokens'),
+                avg_latency=Avg('latency_ms'),
+            )
+            .order_by('operation')
+        )
+
+        self.stdout.write(
+            f"{'operation':<10} {'calls':>6} {'failed':>6} {'prompt tok':>11} {'completion':>11} "
+            f"{'avg prompt':>11} {'/ budget':>9} {'avg output':>11} {'/ reserved':>10} {'estimate':>9} {'latency':>9}"
+        )
+        for row in rows:
+            operation = row['operation']
+            avg_prompt = row['avg_prompt'] or 0
+            avg_completion = row['avg_completion'] or 0
+            # Ratio of estimated to reported prompt tokens; > 1 means budgets are conservative
+            accuracy = row['avg_estimated'] / avg_prompt if avg_prompt and row['avg_estimated'] else None
+            self.stdout.write(
+                f"{operation:<10} {row['calls']:>6} {row['failed']:>6} {row['total_prompt'] or 0:>11} "
+                f"{row['total_completion'] or 0:>11} {avg_prompt:>11.0f} "
+                f"{avg_prompt / prompt_limit(operation):>8.0%} {avg_completion:>11.0f} "
+                f"{avg_completion / output_tokens(operation):>9.0%} "
+                f"{(f'{accuracy:.2f}x' if accuracy else '-'):>9} {row['avg_latency'] or 0:>7.0f}ms"
+            )
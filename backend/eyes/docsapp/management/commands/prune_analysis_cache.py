@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from docsapp.analysis_cache import invalidate_analyses, prune_analysis_cache
+from docsapp.qa_cache import invalidate_answers, prune_qa_cache
+
+
+class Command(BaseCommand):
+    help = "Expire and evict cached AI analysis results and Q&A answers, or invalidate them explicitly."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale', action='store_true',
+            help="Remove results produced by older prompt versions or another model."
+        )
+        parser.add_argument(
+            '--invalidate', action='store_true',
+            help="Remove all results (of --type, if given) and Q&A answers regardless of age."
+        )
+        parser.add_argument('--type', dest='analysis_type', help="Restrict invalidation to one analysis type.")
+
+    def handle(self, *args, **options):
+        if options['invalidate'] or options['stale']:
+            removed = invalidate_analyses(
+                analysis_type=options['analysis_type'],
+                stale_only=not options['invalidate']
+            )
+            self.stdout.write(f"Invalidated {removed} cached analyses")
+        if options['invalidate'] and not options['analysis_type']:
+            removed = invalidate_answers()
+            self.stdout.write(f"Invalidated {removed} cached Q&A answers")
+
+        removed = prune_analysis_cache()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {removed} expired or least recently used analyses"))
+        removed = prune_qa_cache()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {removed} expired or least recently used Q&A answers"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from docsapp.chunked_upload import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Remove chunked upload sessions past their expiry, with their partial files."
+
+    def handle(self, *args, **options):
+        removed = purge_expired_sessions()
+        self.stdout.write(self.style.SUCCESS(f"Purged {removed} expired upload sessions"))
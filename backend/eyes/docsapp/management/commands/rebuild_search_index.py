@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from docsapp.search import rebuild_index, search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from the extracted text of every document."
+
+    def handle(self, *args, **options):
+        backend = search_backend()
+        if backend is None:
+            self.stdout.write(self.style.WARNING("No search index on this database; search scans documents instead."))
+            return
+        indexed = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} documents ({backend})"))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from docsapp.fake_gemini import FakeGeminiServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for the Gemini API (generateContent and "
+        "streamGenerateContent) for load and latency testing without network "
+        "access. Point GEMINI_API_BASE at the printed URL; no GEMINI_API_KEY is "
+        "needed for a local address."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.5, help="Seconds per response.")
+        parser.add_argument(
+            '--error-rate', type=float, default=0.0,
+            help="Fraction of requests answered with 503 UNAVAILABLE (0-1)."
+        )
+        parser.add_argument(
+            '--max-concurrent', type=int, default=0,
+            help="Requests in flight beyond this get 429 RESOURCE_EXHAUSTED (0 = unlimited)."
+        )
+        parser.add_argument(
+            '--rpm', type=int, default=0,
+            help="Requests per minute beyond this get 429 RESOURCE_EXHAUSTED (0 = unlimited)."
+        )
+        parser.add_argument('--seed', type=int, help="Seed for reproducible error injection.")
+
+    def handle(self, *args, **options):
+        server = FakeGeminiServer(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            max_concurrent=options['max_concurrent'],
+            rpm=options['rpm'],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Fake Gemini listening; set GEMINI_API_BASE={server.base_url}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            stats = server.stats
+            self.stdout.write(
+                f"Served {stats['requests']} requests: {stats['rejected']} rejected by throughput caps, "
+                f"{stats['errors']} injected errors"
+            )
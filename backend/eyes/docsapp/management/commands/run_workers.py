@@ -0,0 +1,66 @@
+import signal
+import logging
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from docsapp.jobs import work, worker_name
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(index, stop_event, exit_when_idle):
+    # Children get their own database connections
+    connections.close_all()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    processed = work(worker_name(index), stop_event, exit_when_idle=exit_when_idle)
+    logger.info(f"Worker {index} stopped after {processed} jobs")
+
+
+class Command(BaseCommand):
+    help = "Run the background worker pool that processes queued document jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help="Number of worker processes (defaults to DOCS_WORKER_CONCURRENCY)."
+        )
+        parser.add_argument(
+            '--drain', action='store_true',
+            help="Exit once the queue is empty instead of polling forever."
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or settings.DOCS_WORKER_CONCURRENCY
+        stop_event = multiprocessing.Event()
+
+        def shutdown(signum, frame):
+            self.stdout.write("Stopping workers...")
+            stop_event.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        # Don't share the parent's connection with forked children
+        connections.close_all()
+
+        # Workers are not daemonic so they may run their own process pools
+        processes = [
+            multiprocessing.Process(
+                target=_worker_main,
+                args=(index, stop_event, options['drain']),
+                name=f"docs-worker-{index}",
+            )
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        self.stdout.write(f"Started {workers} document workers")
+
+        for process in processes:
+            process.join()
+
+        self.stdout.write(self.style.SUCCESS("Workers stopped"))
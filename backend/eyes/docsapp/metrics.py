@@ -0,0 +1,123 @@
+"""
+In-process counters and latency timings for the AI endpoints.
+
+Each server process keeps its own figures since it started; the metrics
+endpoint reports those of the process that answers it. Timings count
+observations in HISTOGRAM_BUCKETS and keep the most recent TIMING_SAMPLES
+for percentiles.
+"""
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+TIMING_SAMPLES = 1024
+
+# Upper bounds of the latency histogram buckets, in seconds
+HISTOGRAM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+
+
+class _Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=TIMING_SAMPLES)
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+        self.buckets[next(
+            (i for i, bound in enumerate(HISTOGRAM_BUCKETS) if seconds <= bound), len(HISTOGRAM_BUCKETS)
+        )] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        samples = sorted(self.samples)
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 1) if self.count else 0.0,
+            'p50_ms': round(_percentile(samples, 0.5) * 1000, 1),
+            'p95_ms': round(_percentile(samples, 0.95) * 1000, 1),
+            'max_ms': round(self.max * 1000, 1),
+            # Cumulative counts per upper bound, like a Prometheus histogram
+            'histogram': dict(zip(
+                [f'le_{bound:g}s' for bound in HISTOGRAM_BUCKETS] + ['le_inf'],
+                _cumulative(self.buckets)
+            )),
+        }
+
+
+def _cumulative(counts):
+    total = 0
+    for count in counts:
+        total += count
+        yield total
+
+
+def _percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def increment(name: str, value: int = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, seconds: float):
+    """Record one latency observation."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = _Timing()
+        timing.add(seconds)
+
+
+@contextmanager
+def timer(name: str):
+    """Observe the duration of the block under `name`."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started)
+
+
+def percentile(name: str, fraction: float, min_samples: int = 1) -> Optional[float]:
+    """A percentile of recent observations in seconds, or None with fewer than `min_samples`."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None or len(timing.samples) < max(min_samples, 1):
+            return None
+        return _percentile(sorted(timing.samples), fraction)
+
+
+def ratio(hits: str, misses: str) -> float:
+    """Share of `hits` among hits and misses, from two counters."""
+    with _lock:
+        total = _counters[hits] + _counters[misses]
+        return round(_counters[hits] / total, 4) if total else 0.0
+
+
+def snapshot() -> Dict[str, Any]:
+    """Current counters and timing summaries."""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'timings': {name: timing.summary() for name, timing in _timings.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0002_processingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='legaldocument',
+            name='pages_extracted',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='DocumentPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('text', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='docsapp.legaldocument')),
+            ],
+            options={
+                'ordering': ['page_number'],
+                'constraints': [models.UniqueConstraint(fields=('document', 'page_number'), name='unique_document_page')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:44
+
+import docsapp.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0003_documentpage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='legaldocument',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='legaldocument',
+            name='file',
+            field=models.FileField(upload_to=docsapp.models.document_upload_path),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0004_legaldocument_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('analysis_type', models.CharField(max_length=20)),
+                ('prompt_version', models.CharField(max_length=20)),
+                ('model_name', models.CharField(max_length=100)),
+                ('result', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'analysis_type', 'prompt_version', 'model_name'), name='unique_analysis_result')],
+            },
+        ),
+    ]
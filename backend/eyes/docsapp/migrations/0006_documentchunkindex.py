@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0005_analysisresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentChunkIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_count', models.PositiveIntegerField()),
+                ('vocabulary', models.TextField()),
+                ('arrays', models.BinaryField()),
+                ('built_at', models.DateTimeField(auto_now=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='chunk_index', to='docsapp.legaldocument')),
+            ],
+        ),
+    ]
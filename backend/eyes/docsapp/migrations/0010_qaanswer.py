@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:06
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0009_llmcalllog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QAAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_key', models.CharField(max_length=64)),
+                ('question', models.TextField()),
+                ('text_hash', models.CharField(max_length=64)),
+                ('prompt_version', models.CharField(max_length=20)),
+                ('model_name', models.CharField(max_length=100)),
+                ('answer', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='qa_answers', to='docsapp.legaldocument')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('document', 'question_key', 'prompt_version', 'model_name'), name='unique_qa_answer')],
+            },
+        ),
+    ]
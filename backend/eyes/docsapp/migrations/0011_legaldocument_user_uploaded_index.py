@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0010_qaanswer'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='legaldocument',
+            index=models.Index(fields=['user', '-uploaded_at', '-id'], name='document_user_uploaded_idx'),
+        ),
+    ]
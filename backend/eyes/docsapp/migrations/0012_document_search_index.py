@@ -0,0 +1,76 @@
+from django.db import migrations
+
+# Full-text index of document names and extracted text (see docsapp/search.py).
+# SQLite gets an FTS5 table keyed by document id; PostgreSQL a tsvector table
+# with a GIN index. Other databases, or SQLite builds without FTS5, get no
+# table and search falls back to a scan.
+
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE docsapp_documentsearch USING fts5(
+    owner, name, body, tokenize = 'porter unicode61 remove_diacritics 2'
+)
+"""
+
+POSTGRES_CREATE = [
+    """
+    CREATE TABLE docsapp_documentsearch (
+        document_id bigint PRIMARY KEY
+            REFERENCES docsapp_legaldocument (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        user_id integer NOT NULL,
+        body text NOT NULL,
+        search_vector tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX docsapp_documentsearch_vector_idx ON docsapp_documentsearch USING GIN (search_vector)",
+    "CREATE INDEX docsapp_documentsearch_user_idx ON docsapp_documentsearch (user_id)",
+]
+
+POSTGRES_INSERT = """
+INSERT INTO docsapp_documentsearch (document_id, user_id, body, search_vector)
+SELECT id, user_id, left(extracted_text, %s),
+       setweight(to_tsvector('english', original_name), 'A') ||
+       setweight(to_tsvector('english', left(extracted_text, %s)), 'B')
+FROM docsapp_legaldocument
+WHERE extracted_text IS NOT NULL AND extracted_text <> ''
+"""
+
+# Matches SEARCH_INDEX_MAX_CHARS at the time of this migration
+MAX_CHARS = 1000000
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute(SQLITE_CREATE)
+            except Exception:
+                # SQLite built without FTS5
+                return
+            cursor.execute(
+                "INSERT INTO docsapp_documentsearch (rowid, owner, name, body) "
+                "SELECT id, 'u' || user_id, original_name, substr(extracted_text, 1, %s) "
+                "FROM docsapp_legaldocument WHERE extracted_text IS NOT NULL AND extracted_text <> ''",
+                [MAX_CHARS]
+            )
+        elif connection.vendor == 'postgresql':
+            for statement in POSTGRES_CREATE:
+                cursor.execute(statement)
+            cursor.execute(POSTGRES_INSERT, [MAX_CHARS, MAX_CHARS])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS docsapp_documentsearch")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0011_legaldocument_user_uploaded_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
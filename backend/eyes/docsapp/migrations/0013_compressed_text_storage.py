@@ -0,0 +1,116 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:37
+
+import hashlib
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Match TEXT_CHUNK_CHARS and TEXT_COMPRESSION_LEVEL at the time of this migration
+TEXT_CHUNK_CHARS = 64 * 1024
+COMPRESSION_LEVEL = 6
+
+BATCH_SIZE = 200
+
+
+def compress(text):
+    return zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def move_text_to_chunks(apps, schema_editor):
+    """Compress extracted_text into DocumentTextChunk rows and page texts into DocumentPage.data."""
+    LegalDocument = apps.get_model('docsapp', 'LegalDocument')
+    DocumentPage = apps.get_model('docsapp', 'DocumentPage')
+    DocumentTextChunk = apps.get_model('docsapp', 'DocumentTextChunk')
+
+    document_ids = list(
+        LegalDocument.objects.exclude(extracted_text__isnull=True).exclude(extracted_text='').values_list('id', flat=True)
+    )
+    for document_id in document_ids:
+        text = LegalDocument.objects.filter(id=document_id).values_list('extracted_text', flat=True).get()
+        DocumentTextChunk.objects.bulk_create([
+            DocumentTextChunk(document_id=document_id, index=index, data=compress(text[start:start + TEXT_CHUNK_CHARS]))
+            for index, start in enumerate(range(0, len(text), TEXT_CHUNK_CHARS))
+        ])
+        LegalDocument.objects.filter(id=document_id).update(
+            text_length=len(text),
+            text_hash=hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        )
+
+    pages = DocumentPage.objects.exclude(text='').only('id', 'text')
+    batch = []
+    for page in pages.iterator(chunk_size=BATCH_SIZE):
+        page.data = compress(page.text)
+        batch.append(page)
+        if len(batch) >= BATCH_SIZE:
+            DocumentPage.objects.bulk_update(batch, ['data'])
+            batch = []
+    DocumentPage.objects.bulk_update(batch, ['data'])
+
+
+def move_text_back(apps, schema_editor):
+    LegalDocument = apps.get_model('docsapp', 'LegalDocument')
+    DocumentPage = apps.get_model('docsapp', 'DocumentPage')
+    DocumentTextChunk = apps.get_model('docsapp', 'DocumentTextChunk')
+
+    for document_id in LegalDocument.objects.filter(text_length__gt=0).values_list('id', flat=True):
+        chunks = DocumentTextChunk.objects.filter(document_id=document_id).order_by('index').values_list('data', flat=True)
+        text = ''.join(zlib.decompress(bytes(data)).decode('utf-8') for data in chunks)
+        LegalDocument.objects.filter(id=document_id).update(extracted_text=text)
+
+    pages = DocumentPage.objects.exclude(data=b'').only('id', 'data')
+    batch = []
+    for page in pages.iterator(chunk_size=BATCH_SIZE):
+        page.text = zlib.decompress(bytes(page.data)).decode('utf-8')
+        batch.append(page)
+        if len(batch) >= BATCH_SIZE:
+            DocumentPage.objects.bulk_update(batch, ['text'])
+            batch = []
+    DocumentPage.objects.bulk_update(batch, ['text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0012_document_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpage',
+            name='data',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='legaldocument',
+            name='text_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='legaldocument',
+            name='text_length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='DocumentTextChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='text_chunks', to='docsapp.legaldocument')),
+            ],
+            options={
+                'ordering': ['index'],
+                'constraints': [models.UniqueConstraint(fields=('document', 'index'), name='unique_document_text_chunk')],
+            },
+        ),
+        migrations.RunPython(move_text_to_chunks, move_text_back),
+        migrations.RemoveField(
+            model_name='documentpage',
+            name='text',
+        ),
+        migrations.RemoveField(
+            model_name='legaldocument',
+            name='extracted_text',
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:42
+
+import zlib
+
+from django.db import migrations, models
+
+
+def page_offsets(pages):
+    """services.page_offsets at the time of this migration."""
+    joined = "\n".join(pages)
+    lead = len(joined) - len(joined.lstrip())
+    length = len(joined.strip())
+    spans = []
+    position = 0
+    for text in pages:
+        spans.append((
+            min(max(position - lead, 0), length),
+            min(max(position + len(text) - lead, 0), length),
+        ))
+        position += len(text) + 1
+    return spans
+
+
+def set_page_offsets(apps, schema_editor):
+    """Locate the pages of already extracted documents within their text."""
+    LegalDocument = apps.get_model('docsapp', 'LegalDocument')
+    DocumentPage = apps.get_model('docsapp', 'DocumentPage')
+
+    for document_id in LegalDocument.objects.filter(text_length__gt=0).values_list('id', flat=True):
+        pages = list(DocumentPage.objects.filter(document_id=document_id, error='').order_by('page_number'))
+        texts = [zlib.decompress(bytes(page.data)).decode('utf-8') if page.data else '' for page in pages]
+        for page, (start, end) in zip(pages, page_offsets(texts)):
+            page.char_start, page.char_end = start, end
+        DocumentPage.objects.bulk_update(pages, ['char_start', 'char_end'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0013_compressed_text_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpage',
+            name='char_end',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='char_start',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_page_offsets, migrations.RunPython.noop),
+    ]
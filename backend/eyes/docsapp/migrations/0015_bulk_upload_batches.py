@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0014_documentpage_char_offsets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='kind',
+            field=models.CharField(choices=[('analysis', 'AI analysis'), ('upload', 'Bulk upload')], default='analysis', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='batchjob',
+            name='analysis_type',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
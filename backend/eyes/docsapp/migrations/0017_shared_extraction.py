@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docsapp', '0016_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='legaldocument',
+            name='extraction_source',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='extraction_copies', to='docsapp.legaldocument'),
+        ),
+    ]
@@ -1,14 +1,31 @@
+import os
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .services import compress_text, decompress_text
+
+
+def document_upload_path(instance, filename):
+    """Store uploads under their content hash so identical files share one blob."""
+    if instance.content_hash:
+        extension = os.path.splitext(filename)[1].lower()
+        return f"documents/{instance.content_hash[:2]}/{instance.content_hash}{extension}"
+    return f"documents/{filename}"
+
 
 class LegalDocument(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    file = models.FileField(upload_to="documents/")
+    file = models.FileField(upload_to=document_upload_path)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of the file bytes
     original_name = models.CharField(max_length=255)
     file_type = models.CharField(max_length=50)
     file_size = models.PositiveIntegerField()  # in bytes
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    extracted_text = models.TextField(blank=True, null=True)
+    # The extracted text itself is stored compressed in DocumentTextChunk rows (see text_store.py)
+    text_length = models.PositiveIntegerField(default=0)  # characters; 0 until text is extracted
+    text_hash = models.CharField(max_length=64, blank=True)  # SHA-256 of the extracted text
     processing_status = models.CharField(
         max_length=20,
         choices=[
@@ -19,9 +36,284 @@ class LegalDocument(models.Model):
         ],
         default='pending'
     )
+    pages_extracted = models.PositiveIntegerField(default=0)
+    # Set on a duplicate upload: its pages, text and chunk index are those of this document
+    extraction_source = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, blank=True, null=True, related_name='extraction_copies'
+    )
     
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            # Serves the newest-first document list of a user; id breaks ties for cursor pagination
+            models.Index(fields=['user', '-uploaded_at', '-id'], name='document_user_uploaded_idx'),
+        ]
     
     def __str__(self):
         return f"{self.original_name} - {self.user.username}"
+
+    @property
+    def extraction_id(self) -> int:
+        """Id of the document whose DocumentPage, DocumentTextChunk and DocumentChunkIndex rows hold this one's extraction."""
+        return self.extraction_source_id or self.id
+
+
+class DocumentPage(models.Model):
+    """Text of one page (or section, for formats without pages) of a document."""
+    document = models.ForeignKey(LegalDocument, on_delete=models.CASCADE, related_name='pages')
+    page_number = models.PositiveIntegerField()  # 1-based
+    data = models.BinaryField(default=b'')  # zlib-compressed text, see `text`
+    error = models.TextField(blank=True)  # set when this page could not be extracted
+    # Span of the page within the document's extracted text, set once extraction completes
+    char_start = models.PositiveIntegerField(blank=True, null=True)
+    char_end = models.PositiveIntegerField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['page_number']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'page_number'], name='unique_document_page'),
+        ]
+
+    def __str__(self):
+        return f"Page {self.page_number} of {self.document_id}"
+
+    @property
+    def text(self) -> str:
+        return decompress_text(self.data)
+
+    @text.setter
+    def text(self, value: str):
+        self.data = compress_text(value) if value else b''
+
+
+class DocumentTextChunk(models.Model):
+    """A fixed-size, zlib-compressed slice of a document's extracted text (see text_store.py)."""
+    document = models.ForeignKey(LegalDocument, on_delete=models.CASCADE, related_name='text_chunks')
+    index = models.PositiveIntegerField()  # covers characters [index, index + 1) * TEXT_CHUNK_CHARS
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'index'], name='unique_document_text_chunk'),
+        ]
+
+    def __str__(self):
+        return f"Text chunk {self.index} of {self.document_id}"
+
+
+class UploadSession(models.Model):
+    """A resumable upload: chunks are written to a partial file until it is complete (see chunked_upload.py)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    original_name = models.CharField(max_length=255)
+    file_size = models.PositiveBigIntegerField()  # announced when the upload starts, in bytes
+    received = models.PositiveBigIntegerField(default=0)  # bytes written so far, from the start
+    file_type = models.CharField(max_length=100, blank=True)  # sniffed from the first bytes
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            ('active', 'Active'),
+            ('completed', 'Completed'),
+            ('failed', 'Failed'),
+        ],
+        default='active'
+    )
+    error = models.TextField(blank=True)
+    document = models.ForeignKey(
+        LegalDocument, on_delete=models.SET_NULL, related_name='upload_sessions', blank=True, null=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField(db_index=True)  # unfinished uploads are purged after this
+
+    def __str__(self):
+        return f"Upload #{self.id} of {self.original_name} ({self.received}/{self.file_size}, {self.status})"
+
+
+class BatchJob(models.Model):
+    """A set of documents submitted together, for the same AI analysis or as one bulk upload."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='batch_jobs')
+    kind = models.CharField(
+        max_length=20,
+        choices=[
+            ('analysis', 'AI analysis'),
+            ('upload', 'Bulk upload'),  # items track text extraction
+        ],
+        default='analysis'
+    )
+    analysis_type = models.CharField(max_length=20, blank=True)  # for analysis batches
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.analysis_type or self.kind} batch #{self.id} - {self.user.username}"
+
+
+class BatchJobItem(models.Model):
+    """One document of a batch job, with its analysis result once it has run (analysis batches)."""
+    batch = models.ForeignKey(BatchJob, on_delete=models.CASCADE, related_name='items')
+    document = models.ForeignKey(LegalDocument, on_delete=models.CASCADE, related_name='batch_items')
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            ('queued', 'Queued'),
+            ('running', 'Running'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+        ],
+        default='queued'
+    )
+    result = models.TextField(blank=True)
+    cached = models.BooleanField(default=False)  # served from the analysis cache
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'document'], name='unique_batch_document'),
+        ]
+
+    def __str__(self):
+        return f"Batch #{self.batch_id} item {self.document_id} ({self.status})"
+
+
+class ProcessingJob(models.Model):
+    """A unit of background work for a document, picked up by the worker pool."""
+    document = models.ForeignKey(LegalDocument, on_delete=models.CASCADE, related_name='jobs')
+    job_type = models.CharField(
+        max_length=20,
+        choices=[
+            ('extract', 'Text extraction'),
+            ('analysis', 'AI analysis'),
+        ],
+        default='extract'
+    )
+    analysis_type = models.CharField(max_length=20, blank=True)  # for analysis jobs
+    batch_item = models.ForeignKey(
+        BatchJobItem, on_delete=models.CASCADE, related_name='jobs', blank=True, null=True
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            ('queued', 'Queued'),
+            ('running', 'Running'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+        ],
+        default='queued'
+    )
+    priority = models.IntegerField(default=0)  # higher runs first
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(blank=True, null=True)  # visibility timeout
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-priority', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.job_type} #{self.id} ({self.status}) - {self.document_id}"
+
+
+class AnalysisResult(models.Model):
+    """Cached AI analysis output, shared by every document with the same content."""
+    content_hash = models.CharField(max_length=64)
+    analysis_type = models.CharField(max_length=20)
+    prompt_version = models.CharField(max_length=20)
+    model_name = models.CharField(max_length=100)
+    result = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True)  # for LRU eviction
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['content_hash', 'analysis_type', 'prompt_version', 'model_name'],
+                name='unique_analysis_result'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.analysis_type} v{self.prompt_version} ({self.model_name}) - {self.content_hash[:12]}"
+
+
+class DocumentChunkIndex(models.Model):
+    """BM25 index over the chunks of a document's text, used to retrieve Q&A context."""
+    document = models.OneToOneField(LegalDocument, on_delete=models.CASCADE, related_name='chunk_index')
+    chunk_count = models.PositiveIntegerField()
+    vocabulary = models.TextField()  # JSON object: term -> term id
+    arrays = models.BinaryField()  # NumPy .npz with chunk offsets and postings
+    built_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Chunk index of {self.document_id} ({self.chunk_count} chunks)"
+
+
+class RateLimitBucket(models.Model):
+    """Token bucket shared by every process; see ratelimit.py."""
+    name = models.CharField(max_length=50, unique=True)
+    tokens = models.FloatField()
+    updated_at = models.FloatField()  # Unix time of the last refill
+    version = models.PositiveIntegerField(default=0)  # compare-and-swap counter
+
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.0f} tokens"
+
+
+class InflightRequest(models.Model):
+    """Cross-process lock held while one caller computes a result others are waiting for."""
+    key = models.CharField(max_length=255, unique=True)
+    owner = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()  # an abandoned lock can be taken over after this
+
+    def __str__(self):
+        return f"{self.key} ({self.owner})"
+
+
+class LLMCallLog(models.Model):
+    """Token usage and latency of one model call, for tuning prompt budgets against cost."""
+    operation = models.CharField(max_length=20)
+    model_name = models.CharField(max_length=100)
+    estimated_prompt_tokens = models.PositiveIntegerField()
+    prompt_tokens = models.PositiveIntegerField(blank=True, null=True)  # as reported by the API
+    completion_tokens = models.PositiveIntegerField(blank=True, null=True)
+    latency_ms = models.PositiveIntegerField()
+    succeeded = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.operation} ({self.model_name}): {self.prompt_tokens}+{self.completion_tokens} tokens"
+
+
+class QAAnswer(models.Model):
+    """Cached answer to a question about a document, valid while its extracted text is unchanged."""
+    document = models.ForeignKey(LegalDocument, on_delete=models.CASCADE, related_name='qa_answers')
+    question_key = models.CharField(max_length=64)  # SHA-256 of the normalized question
+    question = models.TextField()  # as first asked
+    text_hash = models.CharField(max_length=64)  # SHA-256 of the text the answer is based on
+    prompt_version = models.CharField(max_length=20)
+    model_name = models.CharField(max_length=100)
+    answer = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True)  # for LRU eviction
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['document', 'question_key', 'prompt_version', 'model_name'],
+                name='unique_qa_answer'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Q&A on {self.document_id}: {self.question[:50]}"
@@ -0,0 +1,18 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class DocumentCursorPagination(CursorPagination):
+    """
+    Newest-first pages of a user's documents. A cursor seeks from the last
+    row seen over the (user, -uploaded_at, -id) index, so deep pages cost the
+    same as the first and stay stable while new documents are uploaded.
+    """
+    ordering = ('-uploaded_at', '-id')
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        # Read per request rather than at import, so setting changes apply
+        self.page_size = settings.DOCS_LIST_PAGE_SIZE
+        self.max_page_size = settings.DOCS_LIST_MAX_PAGE_SIZE
+        return super().get_page_size(request)
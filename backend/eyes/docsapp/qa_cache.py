@@ -0,0 +1,293 @@
+"""
+Per-document cache of Q&A answers.
+
+Questions are keyed by a normalized form, so "What is the termination
+notice period?" and "what is  termination notice period" share an entry.
+An answer is only served while the document's extracted text is the one
+it was generated from; re-extraction makes older answers misses.
+"""
+import re
+import time
+import hashlib
+import logging
+import unicodedata
+from datetime import timedelta
+from typing import Iterator, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError
+from django.db.models import Count
+from django.utils import timezone
+
+from . import metrics
+from .models import LegalDocument, QAAnswer
+from .ai_service import GeminiService
+from .async_ai_service import AsyncGeminiService
+from .analysis_cache import ACCESS_UPDATE_INTERVAL, eviction_due
+from .retrieval import retrieve_context
+from .llm_backends import GeminiError
+from .singleflight import asingle_flight, single_flight
+
+logger = logging.getLogger(__name__)
+
+# Words dropped from questions before keying. Deliberately narrower than
+# retrieval.STOP_WORDS: negations, question words, modals and pronouns
+# ("who may", "must not", "our obligations") change the answer.
+QUESTION_STOP_WORDS = frozenset("""
+a an the please kindly is are does do
+""".split())
+
+QUESTION_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def normalize_question(question: str) -> str:
+    """Lower-cased words of a question, without punctuation or filler words."""
+    text = unicodedata.normalize('NFKC', question).casefold()
+    return ' '.join(
+        token for token in QUESTION_TOKEN_PATTERN.findall(text) if token not in QUESTION_STOP_WORDS
+    )
+
+
+def question_key(question: str) -> str:
+    return hashlib.sha256(normalize_question(question).encode('utf-8')).hexdigest()
+
+
+def get_cached_answer(document: LegalDocument, key: str, text_hash: str,
+                      prompt_version: str, model_name: str) -> Optional[str]:
+    """
+    Return a cached answer, or None on a miss, when the entry has expired or
+    when the document text changed. Expired entries stay until pruned, as a
+    fallback (get_stale_answer); answers to older text are deleted.
+    """
+    entry = (
+        QAAnswer.objects
+        .filter(document=document, question_key=key, prompt_version=prompt_version, model_name=model_name)
+        .only('id', 'answer', 'text_hash', 'created_at', 'last_accessed_at')
+        .first()
+    )
+    if entry is None:
+        return None
+
+    if entry.text_hash != text_hash:
+        entry.delete()
+        return None
+
+    now = timezone.now()
+    if settings.QA_CACHE_TTL and entry.created_at < now - timedelta(seconds=settings.QA_CACHE_TTL):
+        return None
+
+    if entry.last_accessed_at < now - ACCESS_UPDATE_INTERVAL:
+        QAAnswer.objects.filter(id=entry.id).update(last_accessed_at=now)
+    return entry.answer
+
+
+def get_stale_answer(document: LegalDocument, key: str, text_hash: str) -> Optional[str]:
+    """
+    The latest cached answer to the question about the current text, of any
+    age, prompt version or model. Served when Gemini fails.
+    """
+    answer = (
+        QAAnswer.objects
+        .filter(document=document, question_key=key, text_hash=text_hash)
+        .order_by('-created_at')
+        .values_list('answer', flat=True)
+        .first()
+    )
+    if answer is not None:
+        metrics.increment('qa_cache.stale_served')
+        logger.warning(f"Gemini unavailable; serving a stale answer for document {document.id}")
+    return answer
+
+
+def store_answer(document: LegalDocument, question: str, key: str, text_hash: str,
+                 prompt_version: str, model_name: str, answer: str):
+    """Save an answer, now and then evicting the least recently used entries beyond the size bounds."""
+    try:
+        QAAnswer.objects.update_or_create(
+            document=document,
+            question_key=key,
+            prompt_version=prompt_version,
+            model_name=model_name,
+            defaults={
+                'question': question,
+                'text_hash': text_hash,
+                'answer': answer,
+                'created_at': timezone.now(),
+                'last_accessed_at': timezone.now(),
+            },
+        )
+        if eviction_due():
+            _evict_lru(QAAnswer.objects.filter(document=document), settings.QA_CACHE_MAX_PER_DOCUMENT)
+            _evict_lru(QAAnswer.objects.all(), settings.QA_CACHE_MAX_ENTRIES)
+    except IntegrityError:
+        # A concurrent request stored the same answer first
+        pass
+    except DatabaseError as e:
+        # Caching is best effort; the caller still gets its answer
+        logger.error(f"Error caching answer for document {document.id}: {str(e)}")
+
+
+def _record(cached: bool, started: float):
+    """Count a hit or miss and its end-to-end latency."""
+    metrics.increment('qa_cache.hits' if cached else 'qa_cache.misses')
+    metrics.observe('qa.hit' if cached else 'qa.miss', time.monotonic() - started)
+
+
+def get_or_answer_question(document: LegalDocument, question: str, refresh: bool = False) -> Tuple[Optional[str], bool]:
+    """
+    Return (answer, cached) for a question about a document, calling Gemini
+    on a miss. Concurrent misses for the same normalized question share one
+    call; `refresh` skips the lookup and overwrites the cached answer. If
+    Gemini fails, the latest stale answer is returned when there is one.
+    """
+    started = time.monotonic()
+    gemini_service = GeminiService()
+    key = question_key(question)
+    text_hash = document.text_hash
+    prompt_version = gemini_service.PROMPT_VERSIONS['qa']
+
+    def lookup():
+        return get_cached_answer(document, key, text_hash, prompt_version, gemini_service.model_name)
+
+    def compute():
+        context = retrieve_context(document, question, gemini_service.prompts.qa_context_tokens(question))
+        answer = gemini_service.answer_question(context, question)
+        if answer:
+            store_answer(document, question, key, text_hash, prompt_version, gemini_service.model_name, answer)
+        return answer
+
+    if refresh:
+        answer, cached = compute(), False
+    else:
+        answer = lookup()
+        if answer is not None:
+            cached = True
+        else:
+            answer, cached = single_flight(flight_key(document, key, text_hash, prompt_version), compute, lookup)
+
+    if not answer:
+        stale = get_stale_answer(document, key, text_hash)
+        return stale, stale is not None
+    _record(cached, started)
+    return answer, cached
+
+
+async def aget_or_answer_question(document: LegalDocument, question: str,
+                                  refresh: bool = False) -> Tuple[Optional[str], bool]:
+    """Async variant of get_or_answer_question for the ASGI endpoints."""
+    started = time.monotonic()
+    gemini_service = AsyncGeminiService()
+    key = question_key(question)
+    text_hash = document.text_hash
+    prompt_version = gemini_service.PROMPT_VERSIONS['qa']
+
+    def lookup():
+        return get_cached_answer(document, key, text_hash, prompt_version, gemini_service.model_name)
+
+    async def compute():
+        # Index loading touches the database
+        context = await sync_to_async(retrieve_context)(document, question, gemini_service.prompts.qa_context_tokens(question))
+        answer = await gemini_service.answer_question(context, question)
+        if answer:
+            await sync_to_async(store_answer)(
+                document, question, key, text_hash, prompt_version, gemini_service.model_name, answer
+            )
+        return answer
+
+    if refresh:
+        answer, cached = await compute(), False
+    else:
+        answer = await sync_to_async(lookup)()
+        if answer is not None:
+            cached = True
+        else:
+            answer, cached = await asingle_flight(flight_key(document, key, text_hash, prompt_version), compute, lookup)
+
+    if not answer:
+        stale = await sync_to_async(get_stale_answer)(document, key, text_hash)
+        return stale, stale is not None
+    _record(cached, started)
+    return answer, cached
+
+
+def stream_answer(document: LegalDocument, question: str, refresh: bool = False) -> Iterator[str]:
+    """
+    Yield an answer as Gemini generates it and cache the complete text once
+    the stream ends. A cached answer, or a stale one when Gemini fails before
+    producing any text, is yielded in one piece.
+    """
+    started = time.monotonic()
+    gemini_service = GeminiService()
+    key = question_key(question)
+    text_hash = document.text_hash
+    prompt_version = gemini_service.PROMPT_VERSIONS['qa']
+
+    if not refresh:
+        answer = get_cached_answer(document, key, text_hash, prompt_version, gemini_service.model_name)
+        if answer is not None:
+            _record(True, started)
+            yield answer
+            return
+
+    context = retrieve_context(document, question, gemini_service.prompts.qa_context_tokens(question))
+    parts = []
+    try:
+        for delta in gemini_service.stream_answer(context, question):
+            parts.append(delta)
+            yield delta
+    except GeminiError:
+        stale = None if parts else get_stale_answer(document, key, text_hash)
+        if stale is None:
+            raise
+        yield stale
+        return
+
+    answer = ''.join(parts)
+    if answer:
+        store_answer(document, question, key, text_hash, prompt_version, gemini_service.model_name, answer)
+        _record(False, started)
+
+
+def flight_key(document: LegalDocument, key: str, text_hash: str, prompt_version: str) -> str:
+    return f"qa:{document.id}:{key}:{text_hash[:16]}:{prompt_version}"
+
+
+def invalidate_answers(document: Optional[LegalDocument] = None) -> int:
+    """Delete cached answers, of one document or all of them."""
+    queryset = QAAnswer.objects.all()
+    if document is not None:
+        queryset = queryset.filter(document=document)
+    deleted, _ = queryset.delete()
+    return deleted
+
+
+def prune_qa_cache() -> int:
+    """Apply TTL expiry and the LRU size bounds. Returns the number of entries removed."""
+    removed = 0
+    if settings.QA_CACHE_TTL:
+        cutoff = timezone.now() - timedelta(seconds=settings.QA_CACHE_TTL)
+        removed, _ = QAAnswer.objects.filter(created_at__lt=cutoff).delete()
+
+    if settings.QA_CACHE_MAX_PER_DOCUMENT:
+        crowded = (
+            QAAnswer.objects.values('document')
+            .annotate(entries=Count('id'))
+            .filter(entries__gt=settings.QA_CACHE_MAX_PER_DOCUMENT)
+            .values_list('document', flat=True)
+        )
+        for document_id in list(crowded):
+            removed += _evict_lru(QAAnswer.objects.filter(document_id=document_id), settings.QA_CACHE_MAX_PER_DOCUMENT)
+
+    return removed + _evict_lru(QAAnswer.objects.all(), settings.QA_CACHE_MAX_ENTRIES)
+
+
+def _evict_lru(queryset, max_entries: int) -> int:
+    if not max_entries:
+        return 0
+    excess = queryset.count() - max_entries
+    if excess <= 0:
+        return 0
+    oldest = list(queryset.order_by('last_accessed_at').values_list('id', flat=True)[:excess])
+    deleted, _ = QAAnswer.objects.filter(id__in=oldest).delete()
+    return deleted
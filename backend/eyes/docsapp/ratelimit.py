@@ -0,0 +1,147 @@
+"""
+Token-bucket rate limiting shared by every process that talks to Gemini.
+
+Bucket state lives in RateLimitBucket rows, so web workers, ASGI workers
+and the job worker pool draw from the same quota. Tokens are taken with a
+compare-and-swap UPDATE on the row's version; when a bucket is short the
+caller sleeps until enough tokens have refilled.
+
+Background work (queued analysis jobs) runs inside `background()` and
+leaves GEMINI_BACKGROUND_RESERVE of each bucket to interactive requests,
+so a backlog of jobs cannot make users wait for quota.
+"""
+import time
+import random
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import RateLimitBucket
+from .tokens import estimate_tokens, request_text
+
+logger = logging.getLogger(__name__)
+
+# (bucket name, limit per minute, cost of this call)
+Cost = Tuple[str, float, float]
+
+# Set while running background work; see background()
+_background = ContextVar('ratelimit_background', default=False)
+
+
+class RateLimitTimeout(Exception):
+    """Raised when the quota would not allow a call within the maximum wait."""
+
+
+class _Conflict(Exception):
+    """Another process updated a bucket between our read and write."""
+
+
+@contextmanager
+def background():
+    """Mark calls made in this block (and in thread pools it starts with the context copied) as background work."""
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+def try_acquire(costs: List[Cost]) -> Optional[float]:
+    """
+    Take the cost of a call from every bucket, or from none of them.
+
+    Buckets hold at most one minute's worth of tokens and refill
+    continuously. Background calls also need the reserved share of the
+    bucket to be left over. Returns None when the tokens were taken,
+    otherwise the number of seconds to wait before trying again.
+    """
+    now = time.time()
+    reserve = settings.GEMINI_BACKGROUND_RESERVE if _background.get() else 0.0
+    buckets = {bucket.name: bucket for bucket in RateLimitBucket.objects.filter(name__in=[name for name, _, _ in costs])}
+
+    wait = 0.0
+    updates = []
+    for name, limit, cost in costs:
+        bucket = buckets.get(name)
+        if bucket is None:
+            bucket = _create_bucket(name, limit, now)
+        rate = limit / 60.0
+        cost = min(cost, limit)  # a call larger than the bucket waits for a full bucket
+        available = min(float(limit), bucket.tokens + max(now - bucket.updated_at, 0.0) * rate)
+        required = min(cost + limit * reserve, float(limit))
+        if available < required:
+            wait = max(wait, (required - available) / rate)
+        updates.append((bucket, available - cost))
+
+    if wait:
+        return wait
+
+    try:
+        with transaction.atomic():
+            for bucket, remaining in updates:
+                swapped = RateLimitBucket.objects.filter(id=bucket.id, version=bucket.version).update(
+                    tokens=remaining,
+                    updated_at=now,
+                    version=F('version') + 1,
+                )
+                if not swapped:
+                    raise _Conflict()
+    except _Conflict:
+        return 0.0
+    return None
+
+
+def _create_bucket(name: str, limit: float, now: float) -> RateLimitBucket:
+    try:
+        with transaction.atomic():
+            return RateLimitBucket.objects.create(name=name, tokens=limit, updated_at=now)
+    except IntegrityError:
+        return RateLimitBucket.objects.get(name=name)
+
+
+def _next_wait(wait: float, deadline: float) -> float:
+    """Sleep before the next attempt, with jitter so waiting processes do not retry in lockstep."""
+    if time.monotonic() + wait > deadline:
+        raise RateLimitTimeout(f"Gemini quota exhausted; no capacity within {settings.GEMINI_RATE_LIMIT_MAX_WAIT:.0f}s")
+    return wait + random.uniform(0, 0.05)
+
+
+def acquire(costs: List[Cost]):
+    """Block until every bucket has capacity for the call."""
+    if not costs:
+        return
+    deadline = time.monotonic() + settings.GEMINI_RATE_LIMIT_MAX_WAIT
+    while True:
+        wait = try_acquire(costs)
+        if wait is None:
+            return
+        time.sleep(_next_wait(wait, deadline))
+
+
+async def aacquire(costs: List[Cost]):
+    """Async variant of acquire; waits without holding a thread."""
+    if not costs:
+        return
+    deadline = time.monotonic() + settings.GEMINI_RATE_LIMIT_MAX_WAIT
+    while True:
+        wait = await sync_to_async(try_acquire)(costs)
+        if wait is None:
+            return
+        await asyncio.sleep(_next_wait(wait, deadline))
+
+
+def gemini_costs(data: Dict[str, Any]) -> List[Cost]:
+    """Bucket costs of one Gemini request body under GEMINI_RPM and GEMINI_TPM."""
+    costs = []
+    if settings.GEMINI_RPM:
+        costs.append(('gemini-requests', settings.GEMINI_RPM, 1))
+    if settings.GEMINI_TPM:
+        costs.append(('gemini-tokens', settings.GEMINI_TPM, max(estimate_tokens(request_text(data)), 1)))
+    return costs
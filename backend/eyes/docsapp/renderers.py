@@ -0,0 +1,17 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets content negotiation accept `Accept: text/event-stream`. Streaming
+    views return a StreamingHttpResponse themselves, so this only renders
+    errors raised before the stream starts.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"event: error\ndata: {json.dumps(data)}\n\n".encode(self.charset)
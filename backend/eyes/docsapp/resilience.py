@@ -0,0 +1,177 @@
+"""
+Tail-latency and failure handling for upstream model calls.
+
+CircuitBreaker fails calls fast once the recent upstream error rate
+crosses a threshold, then lets a single trial call through after a
+cooldown. HedgeBudget bounds how many calls may send a second, hedged
+request, and HedgePool the threads they run in. All are per process; see
+ResilientBackend in llm_backends.py.
+"""
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through and their outcomes are recorded over a sliding
+    window of the last GEMINI_BREAKER_WINDOW calls. Once at least
+    GEMINI_BREAKER_MIN_CALLS are recorded and the error rate reaches
+    GEMINI_BREAKER_ERROR_RATE, the breaker opens and rejects calls for
+    GEMINI_BREAKER_COOLDOWN seconds. Then it is half-open: one trial call
+    goes through, and its outcome closes or reopens the breaker.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = 'closed'
+        self.opened_at = None
+        self._outcomes = deque()
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.GEMINI_BREAKER_ERROR_RATE > 0
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now."""
+        if not self.enabled():
+            return True
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < settings.GEMINI_BREAKER_COOLDOWN:
+                    return False
+                self._set_state('half_open')
+            if self.state == 'half_open':
+                if self._trial_running:
+                    return False
+                self._trial_running = True
+            return True
+
+    def record(self, succeeded: bool):
+        """Record the outcome of a call that allow() let through."""
+        if not self.enabled():
+            return
+        with self._lock:
+            if self.state == 'half_open':
+                self._trial_running = False
+                if succeeded:
+                    self._outcomes.clear()
+                    self._set_state('closed')
+                else:
+                    self._open()
+                return
+
+            self._outcomes.append(succeeded)
+            while len(self._outcomes) > settings.GEMINI_BREAKER_WINDOW:
+                self._outcomes.popleft()
+            if self.state == 'closed' and len(self._outcomes) >= settings.GEMINI_BREAKER_MIN_CALLS:
+                if self._error_rate() >= settings.GEMINI_BREAKER_ERROR_RATE:
+                    self._open()
+
+    def release(self):
+        """Give up a call that allow() let through without an outcome, such as a stream its consumer closed."""
+        if not self.enabled():
+            return
+        with self._lock:
+            # A half-open breaker lets the next call be the trial
+            self._trial_running = False
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._set_state('open')
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            metrics.increment(f'{self.name}.breaker_{state}')
+        self.state = state
+
+    def _error_rate(self) -> float:
+        return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = None
+            if self.state == 'open':
+                retry_in = max(settings.GEMINI_BREAKER_COOLDOWN - (time.monotonic() - self.opened_at), 0.0)
+            return {
+                'state': self.state,
+                'error_rate': round(self._error_rate(), 4),
+                'window_calls': len(self._outcomes),
+                'retry_in_seconds': round(retry_in, 1) if retry_in is not None else None,
+            }
+
+
+class HedgeBudget:
+    """
+    Token bucket that earns GEMINI_HEDGE_BUDGET of a token per call, so at
+    most that share of calls are hedged (with a small burst allowance).
+    """
+    BURST = 10.0
+
+    def __init__(self):
+        self._tokens = self.BURST
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self._tokens = min(self.BURST, self._tokens + settings.GEMINI_HEDGE_BUDGET)
+
+    def spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class HedgePool:
+    """
+    A fixed set of threads shared by all calls that may be hedged. Work is
+    only handed over while a thread is free, so neither a call nor its
+    hedge ever queues behind busy ones; when none is, try_submit returns
+    None and the caller goes without hedging.
+    """
+
+    def __init__(self, workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gemini-hedge')
+        self._free = threading.BoundedSemaphore(workers)
+
+    def try_submit(self, func, *args) -> Optional[Future]:
+        """Run `func` on a free thread with a copy of the caller's context, or return None if all are busy."""
+        if not self._free.acquire(blocking=False):
+            return None
+        context = contextvars.copy_context()
+
+        def run():
+            try:
+                return context.run(func, *args)
+            finally:
+                # The rate limiter opened a connection in this thread
+                connections.close_all()
+                self._free.release()
+
+        return self._executor.submit(run)
+
+
+def hedge_delay(latency_metric: str) -> Optional[float]:
+    """
+    Seconds after which a call should be hedged: the GEMINI_HEDGE_PERCENTILE
+    latency of recent successful calls, at least GEMINI_HEDGE_MIN_DELAY.
+    None when hedging is off or there are too few samples to judge.
+    """
+    if not settings.GEMINI_HEDGE_PERCENTILE:
+        return None
+    threshold = metrics.percentile(latency_metric, settings.GEMINI_HEDGE_PERCENTILE, settings.GEMINI_HEDGE_MIN_SAMPLES)
+    if threshold is None:
+        return None
+    return max(threshold, settings.GEMINI_HEDGE_MIN_DELAY)
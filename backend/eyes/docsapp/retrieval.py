@@ -0,0 +1,264 @@
+import io
+import re
+import json
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .chunking import split_into_chunks
+from .tokens import estimate_tokens, truncate_to_tokens
+from .models import DocumentChunkIndex, LegalDocument
+from .text_store import load_ranges, load_text
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOP_WORDS = frozenset("""
+a an and are as at be but by can could did do does for from had has have how i if in into is it its
+may me might must my no not of on or our shall should so such than that the their them then there
+these they this those to under upon us was we were what when where which who whom why will with would
+you your
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens without stop words."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+class ChunkIndex:
+    """
+    BM25 index over the chunks of one document.
+
+    Postings are stored term-major in flat NumPy arrays (CSC layout):
+    the chunks containing term t are `chunk_ids[term_ptr[t]:term_ptr[t + 1]]`
+    with frequencies in `term_freqs`, so scoring a query is a handful of
+    vectorized operations regardless of document length.
+    """
+
+    def __init__(self, vocabulary, offsets, term_ptr, chunk_ids, term_freqs, chunk_lengths, chunk_tokens):
+        self.vocabulary = vocabulary  # term -> term id
+        self.offsets = offsets  # (n_chunks, 2) character [start, end) of each chunk
+        self.chunk_tokens = chunk_tokens  # estimated model tokens of each chunk, for prompt budgets
+        self.term_ptr = term_ptr
+        self.chunk_ids = chunk_ids
+        self.term_freqs = term_freqs
+        self.chunk_lengths = chunk_lengths
+
+        chunk_count = len(offsets)
+        document_freqs = np.diff(term_ptr).astype(np.float32)
+        self.idf = np.log1p((chunk_count - document_freqs + 0.5) / (document_freqs + 0.5)).astype(np.float32)
+        average_length = float(chunk_lengths.mean()) if chunk_count else 1.0
+        self.length_norm = (BM25_K1 * (1 - BM25_B + BM25_B * chunk_lengths / max(average_length, 1.0))).astype(np.float32)
+
+    @classmethod
+    def build(cls, text: str, chunk_chars: int) -> 'ChunkIndex':
+        """Chunk `text` on clause boundaries and index the chunks."""
+        chunks = split_into_chunks(text, chunk_chars)
+
+        offsets = np.zeros((len(chunks), 2), dtype=np.int64)
+        position = 0
+        for number, chunk in enumerate(chunks):
+            start = text.find(chunk, position)
+            offsets[number] = (start, start + len(chunk))
+            position = start + len(chunk)
+
+        vocabulary = {}
+        term_ids, chunk_ids, term_freqs = [], [], []
+        chunk_lengths = np.zeros(len(chunks), dtype=np.float32)
+        chunk_tokens = np.zeros(len(chunks), dtype=np.int32)
+        for number, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            chunk_lengths[number] = len(tokens)
+            chunk_tokens[number] = estimate_tokens(chunk)
+            for term, count in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                chunk_ids.append(number)
+                term_freqs.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind='stable')
+        term_ptr = np.zeros(len(vocabulary) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=term_ptr[1:])
+
+        return cls(
+            vocabulary,
+            offsets,
+            term_ptr,
+            np.asarray(chunk_ids, dtype=np.int32)[order],
+            np.asarray(term_freqs, dtype=np.float32)[order],
+            chunk_lengths,
+            chunk_tokens,
+        )
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            offsets=self.offsets,
+            term_ptr=self.term_ptr,
+            chunk_ids=self.chunk_ids,
+            term_freqs=self.term_freqs,
+            chunk_lengths=self.chunk_lengths,
+            chunk_tokens=self.chunk_tokens,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, vocabulary: dict) -> 'ChunkIndex':
+        """Load a stored index; raises KeyError for indexes stored by an older version."""
+        arrays = np.load(io.BytesIO(data))
+        return cls(
+            vocabulary,
+            arrays['offsets'],
+            arrays['term_ptr'],
+            arrays['chunk_ids'],
+            arrays['term_freqs'],
+            arrays['chunk_lengths'],
+            arrays['chunk_tokens'],
+        )
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def score(self, query: str) -> np.ndarray:
+        """BM25 score of every chunk for `query`."""
+        term_ids = [self.vocabulary[term] for term in set(tokenize(query)) if term in self.vocabulary]
+        if not term_ids:
+            return np.zeros(len(self), dtype=np.float32)
+
+        slices = [np.arange(self.term_ptr[term], self.term_ptr[term + 1]) for term in term_ids]
+        postings = np.concatenate(slices)
+        idf = np.repeat(self.idf[term_ids], [len(positions) for positions in slices])
+        ids = self.chunk_ids[postings]
+        tf = self.term_freqs[postings]
+
+        contributions = idf * tf * (BM25_K1 + 1) / (tf + self.length_norm[ids])
+        return np.bincount(ids, weights=contributions, minlength=len(self)).astype(np.float32)
+
+    def top_chunks(self, query: str, k: int) -> List[int]:
+        """Ids of the `k` best matching chunks, best first (only chunks that match)."""
+        scores = self.score(query)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [int(chunk) for chunk in candidates if scores[chunk] > 0]
+
+    def context_spans(self, query: str, max_tokens: int) -> Optional[List[Tuple[int, int]]]:
+        """
+        Character ranges of the most relevant chunks for `query`, in document
+        order, up to `max_tokens` (estimated); None when the whole text fits.
+        Falls back to the start of the document when nothing matches. A lone
+        chunk over the budget is returned whole, to be truncated by the caller.
+        """
+        if int(self.chunk_tokens.sum()) <= max_tokens:
+            return None
+
+        selected = []
+        used = 0
+        for chunk in self.top_chunks(query, settings.RETRIEVAL_TOP_K) or range(len(self)):
+            start, end = (int(offset) for offset in self.offsets[chunk])
+            tokens = int(self.chunk_tokens[chunk])
+            if used + tokens > max_tokens:
+                if selected:
+                    continue
+                tokens = max_tokens
+            selected.append((start, end))
+            used += tokens
+            if used >= max_tokens:
+                break
+        return sorted(selected)
+
+    def context_for(self, text: str, query: str, max_tokens: int) -> str:
+        """The most relevant chunks of `text` for `query`, up to `max_tokens` (see context_spans)."""
+        spans = self.context_spans(query, max_tokens)
+        if spans is None:
+            return text
+        return join_context([text[start:end] for start, end in spans], max_tokens)
+
+
+def join_context(parts: List[str], max_tokens: int) -> str:
+    """Join the chunks picked by context_spans, truncating a lone oversized chunk."""
+    if len(parts) == 1:
+        parts = [truncate_to_tokens(parts[0], max_tokens)]
+    return "\n...\n".join(parts)
+
+
+# Recently used indexes, keyed by (index id, build time)
+_loaded_indexes = OrderedDict()
+_loaded_indexes_lock = threading.Lock()
+LOADED_INDEX_CACHE_SIZE = 32
+
+
+def build_document_index(document: LegalDocument, text: Optional[str] = None) -> Optional[DocumentChunkIndex]:
+    """Build (or rebuild) the persisted chunk index of a document, from `text` if already loaded."""
+    if not document.text_length:
+        return None
+    if text is None:
+        text = load_text(document)
+    index = ChunkIndex.build(text, settings.RETRIEVAL_CHUNK_CHARS)
+    stored, _ = DocumentChunkIndex.objects.update_or_create(
+        document_id=document.extraction_id,
+        defaults={
+            'chunk_count': len(index),
+            'vocabulary': json.dumps(index.vocabulary, separators=(',', ':')),
+            'arrays': index.to_bytes(),
+        }
+    )
+    return stored
+
+
+def load_document_index(document: LegalDocument) -> Optional[ChunkIndex]:
+    """The chunk index of a document, built on first use for older documents."""
+    stored = DocumentChunkIndex.objects.filter(document_id=document.extraction_id).only('id', 'built_at').first()
+    if stored is None:
+        stored = build_document_index(document)
+        if stored is None:
+            return None
+
+    cache_key = (stored.id, stored.built_at)
+    with _loaded_indexes_lock:
+        index = _loaded_indexes.get(cache_key)
+        if index is not None:
+            _loaded_indexes.move_to_end(cache_key)
+            return index
+
+    stored = DocumentChunkIndex.objects.get(id=stored.id)
+    try:
+        index = ChunkIndex.from_bytes(bytes(stored.arrays), json.loads(stored.vocabulary))
+    except KeyError:
+        stored = build_document_index(document)
+        cache_key = (stored.id, stored.built_at)
+        index = ChunkIndex.from_bytes(bytes(stored.arrays), json.loads(stored.vocabulary))
+    with _loaded_indexes_lock:
+        _loaded_indexes[cache_key] = index
+        while len(_loaded_indexes) > LOADED_INDEX_CACHE_SIZE:
+            _loaded_indexes.popitem(last=False)
+    return index
+
+
+def retrieve_context(document: LegalDocument, question: str, max_tokens: int) -> str:
+    """
+    The parts of a document most relevant to `question`, within `max_tokens`
+    (see GeminiPrompts.qa_context_tokens).
+    """
+    # Every token covers at least one character
+    if document.text_length <= max_tokens:
+        return load_text(document)
+    index = load_document_index(document)
+    spans = index.context_spans(question, max_tokens)
+    if spans is None:
+        return load_text(document)
+    # Only the stored chunks under the selected ranges are read
+    return join_context(load_ranges(document, spans), max_tokens)
@@ -0,0 +1,227 @@
+"""
+Full-text search over a user's documents.
+
+Names and extracted text are indexed in docsapp_documentsearch, created by
+migration 0012: an FTS5 table on SQLite, a tsvector table with a GIN index
+on PostgreSQL. Documents are (re)indexed when extraction completes. On
+databases without either, search falls back to a case-insensitive scan.
+
+Snippets come back HTML-escaped with the matched terms in <mark> tags.
+"""
+import re
+import html
+import logging
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from .models import LegalDocument
+from .text_store import load_text
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'docsapp_documentsearch'
+
+# Private-use characters mark matches inside snippets until they are escaped
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+
+SNIPPET_WORDS = 24
+
+QUERY_TERM_PATTERN = re.compile(r"\w+")
+
+# Search backend by database alias, once its index exists
+_available = {}
+
+
+def search_backend() -> Optional[str]:
+    """
+    'fts5', 'postgres', or None when the database has no search index. A
+    missing index is looked up again next time, so a migration that adds it
+    takes effect without a restart.
+    """
+    alias = connection.alias
+    if alias not in _available:
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            return None
+        with connection.cursor() as cursor:
+            if SEARCH_TABLE not in connection.introspection.table_names(cursor):
+                return None
+        _available[alias] = 'fts5' if connection.vendor == 'sqlite' else 'postgres'
+    return _available[alias]
+
+
+def query_terms(query: str) -> List[str]:
+    return QUERY_TERM_PATTERN.findall(query.lower())
+
+
+def index_document(document: LegalDocument, text: Optional[str] = None):
+    """Add or replace a document in the search index, with its text if already loaded."""
+    backend = search_backend()
+    if backend is None:
+        return
+    if text is None:
+        text = load_text(document)
+    text = text[:settings.SEARCH_INDEX_MAX_CHARS]
+    try:
+        with connection.cursor() as cursor:
+            if backend == 'fts5':
+                cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [document.id])
+                cursor.execute(
+                    f"INSERT INTO {SEARCH_TABLE} (rowid, owner, name, body) VALUES (%s, %s, %s, %s)",
+                    [document.id, f'u{document.user_id}', document.original_name, text]
+                )
+            else:
+                cursor.execute(
+                    f"""
+                    INSERT INTO {SEARCH_TABLE} (document_id, user_id, body, search_vector)
+                    VALUES (%s, %s, %s, setweight(to_tsvector('english', %s), 'A') ||
+                                        setweight(to_tsvector('english', %s), 'B'))
+                    ON CONFLICT (document_id) DO UPDATE
+                    SET user_id = EXCLUDED.user_id, body = EXCLUDED.body, search_vector = EXCLUDED.search_vector
+                    """,
+                    [document.id, document.user_id, text, document.original_name, text]
+                )
+    except DatabaseError as e:
+        logger.error(f"Error indexing document {document.id} for search: {str(e)}")
+
+
+def remove_document(document_id: int):
+    """Drop a document from the search index (PostgreSQL also cascades on delete)."""
+    backend = search_backend()
+    if backend is None:
+        return
+    column = 'rowid' if backend == 'fts5' else 'document_id'
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE {column} = %s", [document_id])
+
+
+def rebuild_index() -> int:
+    """Reindex every extracted document and drop entries of deleted ones. Returns the count indexed."""
+    backend = search_backend()
+    if backend is None:
+        return 0
+    indexed = 0
+    documents = (
+        LegalDocument.objects.filter(text_length__gt=0)
+        .only('id', 'user_id', 'original_name', 'text_length')
+    )
+    # One transaction so searches keep seeing the old index until the new one is complete
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        for document in documents.iterator(chunk_size=200):
+            index_document(document)
+            indexed += 1
+    return indexed
+
+
+def search_documents(user, query: str, limit: int) -> List[Dict[str, Any]]:
+    """The user's documents matching every term of `query`, best first."""
+    terms = query_terms(query)
+    if not terms:
+        return []
+    backend = search_backend()
+    if backend == 'fts5':
+        rows = _search_fts5(user.id, terms, limit)
+    elif backend == 'postgres':
+        rows = _search_postgres(user.id, query, limit)
+    else:
+        return _search_scan(user, terms, limit)
+
+    uploaded = dict(
+        LegalDocument.objects.filter(id__in=[row[0] for row in rows]).values_list('id', 'uploaded_at')
+    )
+    return [
+        {
+            'id': document_id,
+            'original_name': name,
+            'uploaded_at': uploaded.get(document_id),
+            'snippet': _highlight(snippet),
+            'score': round(float(score), 4),
+        }
+        for document_id, name, snippet, score in rows
+        if document_id in uploaded
+    ]
+
+
+def _search_fts5(user_id: int, terms: List[str], limit: int):
+    # Terms are quoted so FTS5 query syntax in user input is taken literally
+    match = f'owner : "u{user_id}" AND {{name body}} : (' + ' AND '.join(f'"{term}"' for term in terms) + ')'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT rowid, name,
+                   snippet({SEARCH_TABLE}, 2, %s, %s, '…', %s),
+                   -bm25({SEARCH_TABLE}, 0.0, 5.0, 1.0) AS score
+            FROM {SEARCH_TABLE}
+            WHERE {SEARCH_TABLE} MATCH %s
+            ORDER BY bm25({SEARCH_TABLE}, 0.0, 5.0, 1.0)
+            LIMIT %s
+            """,
+            [MATCH_START, MATCH_END, SNIPPET_WORDS, match, limit]
+        )
+        return cursor.fetchall()
+
+
+def _search_postgres(user_id: int, query: str, limit: int):
+    options = f'StartSel={MATCH_START}, StopSel={MATCH_END}, MaxWords={SNIPPET_WORDS}, MinWords=10, MaxFragments=2'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT s.document_id, d.original_name,
+                   ts_headline('english', s.body, q, %s),
+                   ts_rank_cd(s.search_vector, q) AS score
+            FROM {SEARCH_TABLE} s
+            JOIN docsapp_legaldocument d ON d.id = s.document_id,
+                 websearch_to_tsquery('english', %s) q
+            WHERE s.user_id = %s AND s.search_vector @@ q
+            ORDER BY score DESC
+            LIMIT %s
+            """,
+            [options, query, user_id, limit]
+        )
+        return cursor.fetchall()
+
+
+def _search_scan(user, terms: List[str], limit: int) -> List[Dict[str, Any]]:
+    """Fallback without a search index: substring match on every term, newest first."""
+    documents = LegalDocument.objects.filter(user=user, text_length__gt=0).only(
+        'id', 'original_name', 'uploaded_at', 'text_length'
+    )
+    results = []
+    for document in documents.iterator(chunk_size=100):
+        text = load_text(document)
+        lowered = text.lower()
+        if not all(term in lowered for term in terms):
+            continue
+        results.append({
+            'id': document.id,
+            'original_name': document.original_name,
+            'uploaded_at': document.uploaded_at,
+            'snippet': _highlight(_scan_snippet(text, terms)),
+            'score': None,
+        })
+        if len(results) >= limit:
+            break
+    return results
+
+
+def _scan_snippet(text: str, terms: List[str]) -> str:
+    lowered = text.lower()
+    position = min((lowered.find(term) for term in terms if term in lowered), default=0)
+    start = max(position - 80, 0)
+    snippet = text[start:position + 160]
+    for term in terms:
+        snippet = re.sub(f"(?i)({re.escape(term)})", f"{MATCH_START}\\1{MATCH_END}", snippet)
+    return ('…' if start else '') + snippet + '…'
+
+
+def _highlight(snippet: str) -> str:
+    """Escape a snippet for HTML and turn the match markers into <mark> tags."""
+    return (
+        html.escape(snippet or '')
+        .replace(MATCH_START, '<mark>')
+        .replace(MATCH_END, '</mark>')
+    )
@@ -1,37 +1,130 @@
+from collections import Counter
+
 from rest_framework import serializers
-from .models import LegalDocument
+from .models import BatchJob, BatchJobItem, DocumentPage, LegalDocument, UploadSession
+from .services import hash_uploaded_file
+
+# Upload limits, shared by single and bulk uploads
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+SUPPORTED_FILE_TYPES = [
+    'application/pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'text/plain',
+]
+# File types of archive entries, which come without a content type
+EXTENSION_FILE_TYPES = {
+    '.pdf': 'application/pdf',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.txt': 'text/plain',
+}
+
+def validate_upload(file):
+    """Size and type checks of an uploaded file."""
+    if file.size > MAX_UPLOAD_SIZE:
+        raise serializers.ValidationError("File size cannot exceed 10MB.")
+    if file.content_type not in SUPPORTED_FILE_TYPES:
+        raise serializers.ValidationError("Only PDF, DOCX, and TXT files are supported.")
+    return file
+
+def store_upload(document, file):
+    """Point `document` at a stored file with the same content hash, or store `file` for it."""
+    # Identical bytes already stored: point at the existing blob instead of writing a copy
+    existing = (
+        LegalDocument.objects
+        .filter(content_hash=document.content_hash)
+        .exclude(file='')
+        .values_list('file', flat=True)
+        .first()
+    )
+    storage = document.file.storage
+    if existing and storage.exists(existing):
+        document.file.name = existing
+        return
+
+    # The content-addressed path may still hold the blob after its documents were deleted
+    path = document.file.field.generate_filename(document, file.name)
+    if document.content_hash and storage.exists(path):
+        document.file.name = path
+    else:
+        document.file.save(file.name, file, save=False)
 
 class LegalDocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = LegalDocument
-        fields = ['id', 'original_name', 'file_type', 'file_size', 'uploaded_at', 'processing_status']
-        read_only_fields = ['id', 'uploaded_at', 'processing_status']
+        fields = ['id', 'original_name', 'file_type', 'file_size', 'uploaded_at', 'processing_status', 'text_length']
+        read_only_fields = ['id', 'uploaded_at', 'processing_status', 'text_length']
+
+class DocumentPageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DocumentPage
+        fields = ['page_number', 'text', 'error']
+
+class BatchJobItemSerializer(serializers.ModelSerializer):
+    document_id = serializers.IntegerField(read_only=True)
+    original_name = serializers.CharField(source='document.original_name', read_only=True)
+    
+    class Meta:
+        model = BatchJobItem
+        fields = ['document_id', 'original_name', 'status', 'cached', 'result', 'error', 'updated_at']
+
+class BatchJobSerializer(serializers.ModelSerializer):
+    status = serializers.SerializerMethodField()
+    progress = serializers.SerializerMethodField()
+    items = BatchJobItemSerializer(many=True, read_only=True)
+    
+    class Meta:
+        model = BatchJob
+        fields = ['id', 'kind', 'analysis_type', 'status', 'progress', 'created_at', 'items']
+    
+    def _counts(self, obj):
+        counts = Counter(item.status for item in obj.items.all())
+        counts['total'] = sum(counts.values())
+        return counts
+    
+    def get_status(self, obj):
+        counts = self._counts(obj)
+        if counts['done'] + counts['failed'] == counts['total']:
+            return 'done'
+        if counts['queued'] == counts['total']:
+            return 'queued'
+        return 'running'
+    
+    def get_progress(self, obj):
+        counts = self._counts(obj)
+        return {
+            'total': counts['total'],
+            'done': counts['done'],
+            'failed': counts['failed'],
+            'pending': counts['queued'] + counts['running'],
+        }
 
 class DocumentUploadSerializer(serializers.ModelSerializer):
     file = serializers.FileField()
     
     class Meta:
         model = LegalDocument
-        fields = ['file']
+        fields = ['id', 'file', 'original_name', 'file_type', 'file_size', 'uploaded_at', 'processing_status']
+        read_only_fields = ['id', 'original_name', 'file_type', 'file_size', 'uploaded_at', 'processing_status']
     
     def validate_file(self, value):
-        # File size validation (10MB limit)
-        if value.size > 10 * 1024 * 1024:
-            raise serializers.ValidationError("File size cannot exceed 10MB.")
-        
-        # File type validation
-        allowed_types = ['application/pdf', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'text/plain']
-        if value.content_type not in allowed_types:
-            raise serializers.ValidationError("Only PDF, DOCX, and TXT files are supported.")
-        
-        return value
+        return validate_upload(value)
     
     def create(self, validated_data):
         file = validated_data['file']
-        return LegalDocument.objects.create(
+        document = LegalDocument(
             user=self.context['request'].user,
-            file=file,
             original_name=file.name,
             file_type=file.content_type,
-            file_size=file.size
+            file_size=file.size,
+            content_hash=hash_uploaded_file(file)
         )
+        store_upload(document, file)
+        document.save()
+        return document
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    document_id = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'original_name', 'file_size', 'received', 'file_type', 'status', 'error', 'document_id', 'expires_at']
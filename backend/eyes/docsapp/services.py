@@ -1,7 +1,15 @@
 import os
+import math
+import zlib
+import zipfile
+import hashlib
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
 
 # For PDF processing
 try:
@@ -19,14 +27,88 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Formats without real pages are split into sections of this many paragraphs/lines
+DOCX_PARAGRAPHS_PER_PAGE = 40
+TXT_LINES_PER_PAGE = 60
+
+
+class ExtractionError(Exception):
+    """Raised when a whole document cannot be read."""
+
+
+class ExtractedPage(NamedTuple):
+    """Text of one page; `error` is set (and `text` empty) if the page failed."""
+    number: int  # 1-based
+    text: str
+    error: Optional[str] = None
+
+
+# zlib level for stored text; legal prose compresses about 3-4x
+TEXT_COMPRESSION_LEVEL = 6
+
+
+def compress_text(text: str) -> bytes:
+    """Compress text for storage in a BinaryField."""
+    return zlib.compress(text.encode('utf-8'), TEXT_COMPRESSION_LEVEL)
+
+def decompress_text(data) -> str:
+    """Inverse of compress_text; empty data is empty text."""
+    if not data:
+        return ''
+    return zlib.decompress(bytes(data)).decode('utf-8')
+
+def hash_uploaded_file(file) -> str:
+    """SHA-256 of an uploaded file, read chunk by chunk."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+# File signatures; DOCX files are ZIP archives
+PDF_MAGIC = b'%PDF-'
+ZIP_MAGIC = b'PK\x03\x04'
+# Leading bytes looked at to tell a file's type
+SNIFF_BYTES = 4096
+# Control characters (other than whitespace) allowed in a text file, as a share of its bytes
+TEXT_MAX_CONTROL_RATIO = 0.01
+TEXT_WHITESPACE = b'\t\n\r\f\x0b\x1a'
+
+def sniff_file_type(head: bytes) -> Optional[str]:
+    """
+    MIME type of a supported file from its first bytes, or None.
+
+    A ZIP signature is reported as DOCX; confirm it with is_docx once the
+    whole file is there. Text is anything without NUL bytes and with next
+    to no control characters, which covers UTF-8 and the Latin-1 fallback
+    of extract_txt_text.
+    """
+    if head.startswith(PDF_MAGIC):
+        return 'application/pdf'
+    if head.startswith(ZIP_MAGIC):
+        return 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+    if not head or b'\x00' in head:
+        return None
+    control = sum(1 for byte in head if byte < 0x20 and byte not in TEXT_WHITESPACE)
+    if control > len(head) * TEXT_MAX_CONTROL_RATIO:
+        return None
+    return 'text/plain'
+
+def is_docx(file_path: str) -> bool:
+    """Whether a file is a Word document rather than some other ZIP archive."""
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            return 'word/document.xml' in archive.namelist()
+    except (zipfile.BadZipFile, OSError):
+        return False
+
 def extract_text_from_file(file_path: str, file_type: str) -> Optional[str]:
     """
     Extract text from uploaded file based on file type.
-    
+
     Args:
         file_path: Path to the uploaded file
         file_type: MIME type of the file
-    
+
     Returns:
         Extracted text or None if extraction fails
     """
@@ -44,39 +126,144 @@ def extract_text_from_file(file_path: str, file_type: str) -> Optional[str]:
         logger.error(f"Error extracting text from {file_path}: {str(e)}")
         return None
 
+def iter_document_pages(file_path: str, file_type: str, start_page: int = 1) -> Iterator[ExtractedPage]:
+    """
+    Yield the pages of a document, in order, as soon as each is parsed.
+
+    A page that cannot be parsed is yielded with its `error` set instead of
+    aborting the document; ExtractionError is raised only when the file as a
+    whole cannot be read. Pages before `start_page` are skipped, which lets
+    an interrupted extraction resume.
+    """
+    if file_type == 'application/pdf':
+        return iter_pdf_pages(file_path, start_page)
+    elif file_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
+        return iter_docx_pages(file_path, start_page)
+    elif file_type == 'text/plain':
+        return iter_txt_pages(file_path, start_page)
+    raise ExtractionError(f"Unsupported file type: {file_type}")
+
+def join_pages(pages: List[str]) -> str:
+    """Assemble page texts into the document text."""
+    return "\n".join(pages).strip()
+
+def page_offsets(pages: List[str]) -> List[Tuple[int, int]]:
+    """The [start, end) character span of each page within join_pages(pages)."""
+    joined = "\n".join(pages)
+    lead = len(joined) - len(joined.lstrip())
+    length = len(joined.strip())
+    spans = []
+    position = 0
+    for text in pages:
+        start = min(max(position - lead, 0), length)
+        end = min(max(position + len(text) - lead, 0), length)
+        spans.append((start, end))
+        position += len(text) + 1
+    return spans
+
 def extract_pdf_text(file_path: str) -> Optional[str]:
     """Extract text from PDF file."""
-    if not PDF_AVAILABLE:
-        logger.error("PyPDF2 not installed. Cannot process PDF files.")
+    pages = extract_pdf_pages(file_path)
+    if pages is None:
         return None
-    
+    return join_pages(pages)
+
+def extract_pdf_pages(file_path: str) -> Optional[List[str]]:
+    """Extract the text of every page of a PDF file, in page order."""
     try:
-        with open(file_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text.strip()
+        return [page.text for page in iter_pdf_pages(file_path)]
     except Exception as e:
         logger.error(f"Error extracting PDF text: {str(e)}")
         return None
 
+def iter_pdf_pages(file_path: str, start_page: int = 1) -> Iterator[ExtractedPage]:
+    """
+    Yield the pages of a PDF file in order.
+
+    Documents of at least PDF_PARALLEL_MIN_PAGES pages are split into
+    contiguous page ranges that are parsed in parallel by a process pool
+    (PDF_EXTRACTION_WORKERS processes, at least PDF_MIN_PAGES_PER_SHARD pages
+    each). Shards are yielded in order as they finish, so the first pages are
+    available before the last are parsed. Shorter documents are parsed
+    in-process, where starting the pool costs more than it saves.
+    """
+    if not PDF_AVAILABLE:
+        raise ExtractionError("PyPDF2 not installed. Cannot process PDF files.")
+
+    try:
+        with open(file_path, 'rb') as file:
+            page_count = len(PyPDF2.PdfReader(file).pages)
+    except Exception as e:
+        raise ExtractionError(f"Cannot open PDF: {str(e)}") from e
+
+    first = max(start_page, 1) - 1
+    remaining = page_count - first
+    workers = settings.PDF_EXTRACTION_WORKERS if remaining >= settings.PDF_PARALLEL_MIN_PAGES else 1
+    shards = [
+        (first + start, first + stop)
+        for start, stop in pdf_page_shards(remaining, workers, settings.PDF_MIN_PAGES_PER_SHARD)
+    ]
+    if len(shards) <= 1:
+        for start, stop in shards:
+            yield from _extract_pdf_page_range(file_path, start, stop)
+        return
+
+    starts, stops = zip(*shards)
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        # map() yields shard results in submission order
+        for shard_pages in executor.map(_extract_pdf_page_range, repeat(file_path), starts, stops):
+            yield from shard_pages
+
+def pdf_page_shards(page_count: int, workers: int, min_pages_per_shard: int) -> List[Tuple[int, int]]:
+    """Split `page_count` pages into at most `workers` contiguous [start, stop) ranges."""
+    if page_count <= 0:
+        return []
+    shard_count = min(max(workers, 1), max(page_count // max(min_pages_per_shard, 1), 1))
+    shard_size = math.ceil(page_count / shard_count)
+    return [
+        (start, min(start + shard_size, page_count))
+        for start in range(0, page_count, shard_size)
+    ]
+
+def _extract_pdf_page_range(file_path: str, start: int, stop: int) -> List[ExtractedPage]:
+    """Extract the text of pages [start, stop). Runs inside pool workers."""
+    pages = []
+    with open(file_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for index in range(start, stop):
+            try:
+                pages.append(ExtractedPage(index + 1, reader.pages[index].extract_text() or ""))
+            except Exception as e:
+                pages.append(ExtractedPage(index + 1, "", f"Error extracting page {index + 1}: {str(e)}"))
+    return pages
+
 def extract_docx_text(file_path: str) -> Optional[str]:
     """Extract text from DOCX file."""
-    if not DOCX_AVAILABLE:
-        logger.error("python-docx not installed. Cannot process DOCX files.")
-        return None
-    
     try:
-        doc = Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text.strip()
+        return join_pages([page.text for page in iter_docx_pages(file_path)])
     except Exception as e:
         logger.error(f"Error extracting DOCX text: {str(e)}")
         return None
 
+def iter_docx_pages(file_path: str, start_page: int = 1) -> Iterator[ExtractedPage]:
+    """Yield a DOCX file as sections of DOCX_PARAGRAPHS_PER_PAGE paragraphs."""
+    if not DOCX_AVAILABLE:
+        raise ExtractionError("python-docx not installed. Cannot process DOCX files.")
+
+    try:
+        paragraphs = Document(file_path).paragraphs
+    except Exception as e:
+        raise ExtractionError(f"Cannot open DOCX: {str(e)}") from e
+
+    for number, start in enumerate(range(0, len(paragraphs), DOCX_PARAGRAPHS_PER_PAGE), start=1):
+        if number < start_page:
+            continue
+        try:
+            text = "\n".join(paragraph.text for paragraph in paragraphs[start:start + DOCX_PARAGRAPHS_PER_PAGE])
+            yield ExtractedPage(number, text)
+        except Exception as e:
+            yield ExtractedPage(number, "", f"Error extracting section {number}: {str(e)}")
+
 def extract_txt_text(file_path: str) -> Optional[str]:
     """Extract text from TXT file."""
     try:
@@ -93,3 +280,14 @@ def extract_txt_text(file_path: str) -> Optional[str]:
     except Exception as e:
         logger.error(f"Error extracting TXT text: {str(e)}")
         return None
+
+def iter_txt_pages(file_path: str, start_page: int = 1) -> Iterator[ExtractedPage]:
+    """Yield a TXT file as sections of TXT_LINES_PER_PAGE lines."""
+    text = extract_txt_text(file_path)
+    if text is None:
+        raise ExtractionError(f"Cannot read TXT file: {file_path}")
+
+    lines = text.split("\n")
+    for number, start in enumerate(range(0, len(lines), TXT_LINES_PER_PAGE), start=1):
+        if number >= start_page:
+            yield ExtractedPage(number, "\n".join(lines[start:start + TXT_LINES_PER_PAGE]))
@@ -0,0 +1,11 @@
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from .models import LegalDocument
+from .text_store import hand_over_extraction
+
+
+@receiver(pre_delete, sender=LegalDocument)
+def keep_shared_extraction(sender, instance, **kwargs):
+    """Duplicates read their extraction from this document's rows; hand those over before they cascade away."""
+    hand_over_extraction(instance)
@@ -0,0 +1,154 @@
+"""
+Single-flight coalescing of identical concurrent work.
+
+The first caller for a key (the leader) computes the result; everyone else
+asking for the same key while it runs waits and receives that result.
+Within a process followers wait on the leader directly. Across processes
+the leader holds an InflightRequest row, and followers in other processes
+poll `lookup` (normally the analysis cache) until the result appears or
+the lock is released.
+"""
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import weakref
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import InflightRequest
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+# Calls led by this process, keyed by flight key
+_calls = {}
+_calls_lock = threading.Lock()
+
+# Async calls led by this process, per event loop
+_async_calls = weakref.WeakKeyDictionary()
+
+
+def single_flight(key: str, compute: Callable[[], Optional[Any]],
+                  lookup: Callable[[], Optional[Any]]) -> Tuple[Optional[Any], bool]:
+    """
+    Run `compute` once for all concurrent callers of `key`.
+
+    Returns (result, shared): `shared` is True when the result was produced
+    by another caller. `compute` is expected to make its result visible to
+    `lookup` (e.g. by caching it) before it returns.
+    """
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        call.done.wait(settings.SINGLE_FLIGHT_LOCK_TIMEOUT)
+        return call.result, True
+
+    try:
+        call.result, shared = _lead(key, compute, lookup)
+        return call.result, shared
+    finally:
+        with _calls_lock:
+            del _calls[key]
+        call.done.set()
+
+
+def _lead(key: str, compute, lookup) -> Tuple[Optional[str], bool]:
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_LOCK_TIMEOUT
+    while True:
+        if acquire_lock(key, owner):
+            try:
+                # The previous holder may have finished between our lookup and acquire
+                result = lookup()
+                if result is not None:
+                    return result, True
+                return compute(), False
+            finally:
+                release_lock(key, owner)
+
+        result = lookup()
+        if result is not None:
+            return result, True
+        if time.monotonic() > deadline:
+            logger.warning(f"Gave up waiting for in-flight request {key}")
+            return compute(), False
+        time.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+
+
+async def asingle_flight(key: str, compute: Callable[[], Awaitable[Optional[str]]],
+                         lookup: Callable[[], Optional[str]]) -> Tuple[Optional[str], bool]:
+    """Async variant of single_flight; `compute` is a coroutine function, `lookup` is sync."""
+    loop = asyncio.get_running_loop()
+    calls = _async_calls.setdefault(loop, {})
+    future = calls.get(key)
+    if future is not None:
+        return await asyncio.shield(future), True
+
+    future = calls[key] = loop.create_future()
+    result = None
+    try:
+        result, shared = await _alead(key, compute, lookup)
+        return result, shared
+    finally:
+        del calls[key]
+        future.set_result(result)
+
+
+async def _alead(key: str, compute, lookup) -> Tuple[Optional[str], bool]:
+    owner = uuid.uuid4().hex
+    alookup = sync_to_async(lookup)
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_LOCK_TIMEOUT
+    while True:
+        if await sync_to_async(acquire_lock)(key, owner):
+            try:
+                result = await alookup()
+                if result is not None:
+                    return result, True
+                return await compute(), False
+            finally:
+                await sync_to_async(release_lock)(key, owner)
+
+        result = await alookup()
+        if result is not None:
+            return result, True
+        if time.monotonic() > deadline:
+            logger.warning(f"Gave up waiting for in-flight request {key}")
+            return await compute(), False
+        await asyncio.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+
+
+def acquire_lock(key: str, owner: str) -> bool:
+    """Take the cross-process lock for `key`, or an expired one left by a crashed holder."""
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.SINGLE_FLIGHT_LOCK_TIMEOUT)
+    try:
+        with transaction.atomic():
+            InflightRequest.objects.create(key=key, owner=owner, expires_at=expires_at)
+        return True
+    except IntegrityError:
+        taken_over = InflightRequest.objects.filter(key=key, expires_at__lt=now).update(
+            owner=owner,
+            expires_at=expires_at,
+        )
+        return taken_over == 1
+
+
+def release_lock(key: str, owner: str):
+    InflightRequest.objects.filter(key=key, owner=owner).delete()
@@ -1,3 +1,1373 @@
-from django.test import TestCase
+import io
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import string
+import asyncio
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from email.utils import formatdate
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import analysis_cache, jobs, qa_cache, ratelimit, search
+from .management.commands.bench_pdf_extraction import build_sample_pdf
+from .ai_service import GeminiPrompts, GeminiService
+from .async_ai_service import AsyncGeminiService
+from .fake_gemini import FakeGeminiServer, fake_completion
+from .llm_backends import (
+    CircuitOpenError, FakeLLMBackend, GeminiError, GeminiHTTPBackend, GeminiLocalError, LLMBackend, ResilientBackend,
+    backoff_delay, is_loopback_url, retry_after_delay
+)
+from .models import (
+    AnalysisResult, BatchJob, DocumentPage, InflightRequest, LegalDocument, ProcessingJob, QAAnswer, RateLimitBucket,
+    UploadSession
+)
+from .resilience import HedgePool
+from .retrieval import ChunkIndex
+from .chunking import split_into_chunks
+from .services import ExtractedPage, iter_pdf_pages, join_pages, page_offsets, pdf_page_shards
+from .singleflight import acquire_lock, asingle_flight, release_lock
+from .text_store import load_range, load_ranges, load_text, page_span, save_text
+from .tokens import estimate_tokens, request_text
+
+
+class MediaTestCase(TestCase):
+    """Runs with uploads stored in a throwaway MEDIA_ROOT and an authenticated API client."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls._media = override_settings(MEDIA_ROOT=cls.media_root, DOCS_PRECOMPUTE_ANALYSES=[], DOCS_JOBS_EAGER=False)
+        cls._media.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user('tester', password='tester-password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content=b"The Tenant shall pay rent monthly.", name='lease.txt'):
+        response = self.client.post(
+            '/api/docs/upload/',
+            {'file': SimpleUploadedFile(name, content, content_type='text/plain')},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return LegalDocument.objects.get(id=response.json()['id'])
+
+
+class JobQueueTests(MediaTestCase):
+    def test_claim_runs_highest_priority_first_and_only_once(self):
+        low = self.upload(b"Low priority contract.", 'low.txt')
+        high = self.upload(b"High priority contract.", 'high.txt')
+        ProcessingJob.objects.filter(document=high).update(priority=5)
+
+        first = jobs.claim_next_job('worker-a')
+        second = jobs.claim_next_job('worker-b')
+        self.assertEqual((first.document_id, second.document_id), (high.id, low.id))
+        self.assertIsNone(jobs.claim_next_job('worker-c'))
+
+        self.assertTrue(jobs.run_job(first))
+        high.refresh_from_db()
+        self.assertEqual(high.processing_status, 'completed')
+        self.assertEqual(ProcessingJob.objects.get(id=first.id).status, 'done')
+
+    @override_settings(DOCS_JOB_RETRY_BACKOFF=10, DOCS_JOB_MAX_ATTEMPTS=3)
+    def test_failed_job_backs_off_then_fails(self):
+        document = self.upload(b"   ", 'blank.txt')  # no text to extract
+
+        for attempt, backoff in [(1, 10), (2, 20)]:
+            job = jobs.claim_next_job('worker')
+            self.assertEqual(job.attempts, attempt)
+            started = timezone.now()
+            self.assertFalse(jobs.run_job(job))
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'queued')
+            self.assertAlmostEqual((job.run_after - started).total_seconds(), backoff, delta=2)
+            # Not due until the backoff has passed
+            self.assertIsNone(jobs.claim_next_job('worker'))
+            ProcessingJob.objects.filter(id=job.id).update(run_after=timezone.now())
+
+        job = jobs.claim_next_job('worker')
+        self.assertFalse(jobs.run_job(job))
+        job.refresh_from_db()
+        document.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertEqual(document.processing_status, 'failed')
+
+    def test_expired_lock_is_reclaimed_and_the_old_worker_cannot_overwrite_it(self):
+        self.upload()
+        stalled = jobs.claim_next_job('stalled-worker')
+        self.assertIsNone(jobs.claim_next_job('other-worker'))
+
+        ProcessingJob.objects.filter(id=stalled.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = jobs.claim_next_job('other-worker')
+        self.assertEqual((reclaimed.id, reclaimed.attempts), (stalled.id, 2))
+
+        # The stalled worker finishes late: its outcome is discarded
+        self.assertFalse(jobs.run_job(stalled))
+        job = ProcessingJob.objects.get(id=stalled.id)
+        self.assertEqual((job.status, job.locked_by), ('running', 'other-worker'))
+        jobs._fail_job(stalled, 'late failure', retry=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), ('running', ''))
+
+        self.assertFalse(reclaimed.document.pages.exists())
+        self.assertTrue(jobs.run_job(reclaimed))
+        self.assertEqual(ProcessingJob.objects.get(id=stalled.id).status, 'done')
+
+    def test_failed_pages_are_recorded_and_skipped(self):
+        document = self.upload()
+        pages = [ExtractedPage(1, "First page."), ExtractedPage(2, '', 'Unreadable scan'), ExtractedPage(3, "Third page.")]
+        with mock.patch('docsapp.jobs.iter_document_pages', return_value=iter(pages)):
+            self.assertTrue(jobs.run_job(jobs.claim_next_job('worker')))
+
+        document.refresh_from_db()
+        self.assertEqual(document.processing_status, 'completed')
+        self.assertEqual(
+            list(document.pages.order_by('page_number').values_list('page_number', 'error')),
+            [(1, ''), (2, 'Unreadable scan'), (3, '')]
+        )
+        self.assertEqual(load_text(document), "First page.\nThird page.")
+        self.assertEqual(self.client.get(f'/api/docs/{document.id}/status/').json()['failed_pages'], [2])
+
+    @mock.patch('docsapp.jobs.PAGE_SAVE_BATCH', 2)
+    def test_extraction_killed_mid_document_resumes_after_the_saved_pages(self):
+        document = self.upload()
+        starts = []
+
+        def pages(path, file_type, start_page=1):
+            starts.append(start_page)
+            for number in range(start_page, 6):
+                if len(starts) == 1 and number == 4:
+                    raise SystemExit("worker killed")  # not handled by run_job, like a dead process
+                yield ExtractedPage(number, f"Page {number}.")
+
+        with mock.patch('docsapp.jobs.iter_document_pages', side_effect=pages):
+            with self.assertRaises(SystemExit):
+                jobs.run_job(jobs.claim_next_job('doomed-worker'))
+            document.refresh_from_db()
+            self.assertEqual((document.processing_status, document.pages_extracted), ('processing', 2))
+
+            ProcessingJob.objects.filter(document=document).update(locked_until=timezone.now() - timedelta(seconds=1))
+            self.assertTrue(jobs.run_job(jobs.claim_next_job('worker')))
+
+        # Pages 1-2 were saved; page 3 was parsed but not yet saved when the worker died
+        self.assertEqual(starts, [1, 3])
+        document.refresh_from_db()
+        self.assertEqual(list(document.pages.order_by('page_number').values_list('page_number', flat=True)), [1, 2, 3, 4, 5])
+        self.assertEqual(load_text(document), "Page 1.\nPage 2.\nPage 3.\nPage 4.\nPage 5.")
+
+    @override_settings(DOCS_PRECOMPUTE_ANALYSES=['summary'])
+    def test_lock_lost_mid_extraction_leaves_the_document_to_the_new_owner(self):
+        document = self.upload()
+        stalled = jobs.claim_next_job('stalled-worker')
+
+        def reclaim(*args):
+            ProcessingJob.objects.filter(id=stalled.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+            self.reclaimed = jobs.claim_next_job('other-worker')
+
+        with mock.patch('docsapp.jobs.build_document_index', side_effect=reclaim):
+            self.assertFalse(jobs.run_job(stalled))
+        document.refresh_from_db()
+        self.assertEqual(document.processing_status, 'processing')
+        self.assertFalse(ProcessingJob.objects.filter(job_type='analysis').exists())
+
+        self.assertTrue(jobs.run_job(self.reclaimed))
+        document.refresh_from_db()
+        self.assertEqual(document.processing_status, 'completed')
+        self.assertEqual(ProcessingJob.objects.filter(job_type='analysis').count(), 1)
+
+
+    @override_settings(DOCS_PRECOMPUTE_ANALYSES=['summary', 'risks'])
+    def test_precompute_skips_queued_running_and_cached_analyses(self):
+        document = self.upload()
+        self.assertTrue(jobs.run_job(jobs.claim_next_job('worker')))
+        self.assertEqual(
+            sorted(ProcessingJob.objects.filter(job_type='analysis').values_list('analysis_type', flat=True)),
+            ['risks', 'summary']
+        )
+        self.assertEqual(jobs.enqueue_precompute(document), [])
+
+        # The same content uploaded again shares the jobs of the first copy
+        ProcessingJob.objects.filter(analysis_type='summary').update(status='running')
+        duplicate = LegalDocument.objects.create(
+            user=self.user, original_name='copy.txt', file_type='text/plain', file_size=1,
+            content_hash=document.content_hash
+        )
+        self.assertEqual(jobs.enqueue_precompute(duplicate), [])
+
+        # Finished jobs no longer count: only what is not cached is queued again
+        ProcessingJob.objects.filter(job_type='analysis').update(status='done')
+        analysis_cache.store_analysis(
+            analysis_cache.content_key(document), 'summary', GeminiService.PROMPT_VERSIONS['summary'],
+            GeminiService().model_name, "A lease."
+        )
+        self.assertEqual([job.analysis_type for job in jobs.enqueue_precompute(document)], ['risks'])
+
+class DeduplicationTests(MediaTestCase):
+    def test_identical_upload_shares_the_blob_and_reuses_the_extraction(self):
+        first = self.upload()
+        job = jobs.claim_next_job('worker')
+        self.assertTrue(jobs.run_job(job))
+        first.refresh_from_db()
+
+        second = self.upload(name='copy of lease.txt')
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(second.content_hash, first.content_hash)
+        # Extraction is shared with the first document instead of queued or copied
+        self.assertFalse(ProcessingJob.objects.filter(document=second).exists())
+        self.assertEqual(second.processing_status, 'completed')
+        self.assertEqual((second.text_hash, second.text_length), (first.text_hash, first.text_length))
+        self.assertEqual(second.extraction_source_id, first.id)
+        self.assertFalse(second.pages.exists() or second.text_chunks.exists())
+        self.assertEqual(load_text(second), load_text(first))
+        pages = self.client.get(f'/api/docs/{second.id}/pages/').json()['pages']
+        self.assertEqual([page['page_number'] for page in pages], [1])
+
+    def test_deleting_the_original_hands_its_extraction_to_a_duplicate(self):
+        first = self.upload()
+        self.assertTrue(jobs.run_job(jobs.claim_next_job('worker')))
+        text = load_text(LegalDocument.objects.get(id=first.id))
+        second = self.upload(name='second.txt')
+        third = self.upload(name='third.txt')
+        self.assertEqual(third.extraction_source_id, first.id)
+
+        self.assertEqual(self.client.delete(f'/api/docs/{first.id}/').status_code, 204)
+        second.refresh_from_db()
+        third.refresh_from_db()
+        self.assertIsNone(second.extraction_source_id)
+        self.assertEqual(third.extraction_source_id, second.id)
+        self.assertEqual(load_text(second), text)
+        self.assertEqual(load_text(third), text)
+        self.assertEqual(second.pages.count(), 1)
+
+    def test_orphaned_blob_is_reused(self):
+        first = self.upload()
+        path = first.file.name
+        self.assertEqual(self.client.delete(f'/api/docs/{first.id}/').status_code, 204)
+        self.assertTrue(first.file.storage.exists(path))
+
+        again = self.upload()
+        self.assertEqual(again.file.name, path)
+
+
+class BulkUploadTests(MediaTestCase):
+    def archive(self, entries, name='contracts.zip'):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for entry_name, content in entries:
+                archive.writestr(entry_name, content)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='application/zip')
+
+    def bulk(self, *files):
+        return self.client.post('/api/docs/upload/bulk/', {'files': list(files)}, format='multipart')
+
+    def test_archive_entries_become_an_upload_batch(self):
+        response = self.bulk(
+            self.archive([
+                ('2024/leases/lease.txt', b"The Tenant shall pay rent monthly."),
+                ('../../outside.txt', b"Either party may terminate."),
+                ('setup.exe', b"MZ"),
+                ('__MACOSX/._lease.txt', b"metadata"),
+                ('empty-folder/', b""),
+            ]),
+            SimpleUploadedFile('notes.txt', b"Renewal is automatic.", content_type='text/plain'),
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        body = response.json()
+        self.assertEqual((body['accepted'], body['rejected']), (3, 1))
+        self.assertEqual(
+            [(outcome['name'], outcome['status']) for outcome in body['files']],
+            [('lease.txt', 'accepted'), ('outside.txt', 'accepted'), ('setup.exe', 'rejected'), ('notes.txt', 'accepted')]
+        )
+        self.assertIn('Only PDF, DOCX, and TXT', body['files'][2]['error'])
+
+        batch = BatchJob.objects.get(id=body['batch_id'])
+        self.assertEqual(batch.kind, 'upload')
+        documents = LegalDocument.objects.filter(batch_items__batch=batch).order_by('id')
+        self.assertEqual([document.original_name for document in documents], ['lease.txt', 'outside.txt', 'notes.txt'])
+        # Entry paths never reach the stored file names
+        for document in documents:
+            self.assertTrue(os.path.realpath(document.file.path).startswith(os.path.realpath(self.media_root)))
+            self.assertNotIn('..', document.file.name)
+        self.assertEqual(ProcessingJob.objects.filter(document__in=documents, job_type='extract').count(), 3)
+
+    def test_oversized_entries_are_rejected_before_unpacking(self):
+        with mock.patch('docsapp.serializers.MAX_UPLOAD_SIZE', 100), \
+                mock.patch('docsapp.bulk_upload.shutil.copyfileobj', wraps=shutil.copyfileobj) as unpack:
+            body = self.bulk(self.archive([('big.txt', b"x" * 200), ('small.txt', b"Short lease.")])).json()
+        self.assertEqual([outcome['status'] for outcome in body['files']], ['rejected', 'accepted'])
+        self.assertEqual(unpack.call_count, 1)
+
+    def test_declared_size_and_count_limits_reject_the_whole_upload(self):
+        with override_settings(DOCS_BULK_UPLOAD_MAX_BYTES=1000):
+            response = self.bulk(self.archive([('a.txt', b"a" * 600), ('b.txt', b"b" * 600)]))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('at most', response.json()['error'])
+
+        with override_settings(DOCS_BATCH_MAX_DOCUMENTS=2):
+            response = self.bulk(
+                self.archive([('a.txt', b"Lease A."), ('b.txt', b"Lease B.")]),
+                SimpleUploadedFile('c.txt', b"Lease C.", content_type='text/plain'),
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': "A bulk upload can contain at most 2 files."})
+        self.assertFalse(LegalDocument.objects.exists())
+
+    def test_nothing_accepted_and_invalid_archives(self):
+        response = self.bulk(self.archive([('setup.exe', b"MZ")]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['rejected'], 1)
+        self.assertFalse(BatchJob.objects.exists())
+
+        response = self.bulk(SimpleUploadedFile('broken.zip', b"not a zip", content_type='application/zip'))
+        self.assertEqual(response.json(), {'error': "broken.zip is not a valid ZIP archive."})
+
+
+class DocumentListTests(MediaTestCase):
+    def test_cursor_pages_newest_first(self):
+        uploaded = [self.upload(f"Contract number {i}.".encode(), f'contract-{i}.txt') for i in range(3)]
+
+        first = self.client.get('/api/docs/?page_size=2').json()
+        self.assertEqual([document['id'] for document in first['results']], [uploaded[2].id, uploaded[1].id])
+        self.assertIsNone(first['previous'])
+
+        # A document uploaded meanwhile does not shift the next page
+        self.upload(b"A newer contract.", 'newer.txt')
+        second = self.client.get(first['next']).json()
+        self.assertEqual([document['id'] for document in second['results']], [uploaded[0].id])
+        self.assertIsNone(second['next'])
+
+
+    @override_settings(DOCS_LIST_PAGE_SIZE=2, DOCS_LIST_MAX_PAGE_SIZE=3)
+    def test_page_sizes_follow_the_settings(self):
+        for i in range(4):
+            self.upload(f"Contract number {i}.".encode(), f'contract-{i}.txt')
+        self.assertEqual(len(self.client.get('/api/docs/').json()['results']), 2)
+        self.assertEqual(len(self.client.get('/api/docs/?page_size=10').json()['results']), 3)
+
+class TextStoreTests(TestCase):
+    text = string.ascii_letters  # 52 characters: chunks of 10, the last one short
+
+    def setUp(self):
+        patcher = mock.patch('docsapp.text_store.TEXT_CHUNK_CHARS', 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user('tester', password='tester-password')
+        self.document = LegalDocument.objects.create(
+            user=user, original_name='lease.txt', file_type='text/plain', file_size=1
+        )
+        save_text(self.document, self.text)
+
+    def test_ranges_straddling_chunks_are_read_in_one_query(self):
+        self.assertEqual(self.document.text_chunks.count(), 6)
+        with self.assertNumQueries(1):
+            self.assertEqual(load_range(self.document, 9, 21), self.text[9:21])
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                load_ranges(self.document, [(0, 5), (48, None), (15, 35), (10, 20)]),
+                [self.text[0:5], self.text[48:], self.text[15:35], self.text[10:20]]
+            )
+        self.assertEqual(load_range(self.document, 0), self.text)
+
+    def test_empty_ranges_read_nothing(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(load_ranges(self.document, [(5, 5), (30, 20), (52, None)]), ['', '', ''])
+
+    def test_ranges_past_the_end_are_clipped(self):
+        self.assertEqual(load_ranges(self.document, [(50, 100), (60, 70), (-5, 3)]), [self.text[50:], '', self.text[:3]])
+
+    def test_page_span_covers_pages_with_text(self):
+        for number, span in [(1, (0, 20)), (2, (None, None)), (3, (21, 52))]:
+            DocumentPage.objects.create(document=self.document, page_number=number, char_start=span[0], char_end=span[1])
+        self.assertEqual(page_span(self.document, 1, 3), (0, 52))
+        self.assertEqual(page_span(self.document, 2, 3), (21, 52))
+        self.assertIsNone(page_span(self.document, 2, 2))
+        self.assertIsNone(page_span(self.document, 4, 9))
+
+
+class DocumentTextTests(MediaTestCase):
+    pages = ["A" * 40, "B" * 40, "C" * 40]
+
+    def setUp(self):
+        super().setUp()
+        self.document = LegalDocument.objects.create(
+            user=self.user, original_name='lease.txt', file_type='text/plain', file_size=1,
+            processing_status='completed', pages_extracted=len(self.pages)
+        )
+        save_text(self.document, join_pages(self.pages))
+        DocumentPage.objects.bulk_create([
+            DocumentPage(document=self.document, page_number=number, text=text, char_start=start, char_end=end)
+            for number, (text, (start, end)) in enumerate(zip(self.pages, page_offsets(self.pages)), start=1)
+        ])
+
+    def get_text(self, query, **headers):
+        return self.client.get(f'/api/docs/{self.document.id}/text/?{query}', **headers)
+
+    def test_etag_round_trip(self):
+        response = self.get_text('pages=2')
+        self.assertEqual(response.json()['text'], "B" * 40)
+        self.assertEqual(self.get_text('pages=2', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.get_text('pages=3', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    @override_settings(DOCS_TEXT_MAX_CHARS=60)
+    def test_truncated_page_range_continues_on_the_page_it_was_cut_in(self):
+        data = self.get_text('pages=1-3').json()
+        self.assertEqual((data['start'], data['end'], data['next_start']), (0, 60, 60))
+        self.assertEqual((data['first_page'], data['last_page'], data['next_page']), (1, 2, 2))
+
+        data = self.get_text(f'pages={data["next_page"]}-3').json()
+        self.assertEqual(data['text'], "B" * 40 + "\n" + "C" * 19)
+        self.assertEqual((data['last_page'], data['next_page']), (3, 3))
+
+        data = self.get_text('pages=3-9').json()
+        self.assertEqual(data['text'], "C" * 40)
+        self.assertEqual((data['last_page'], data['next_page']), (3, None))
+
+
+class ChunkedUploadTests(MediaTestCase):
+    content = b"The Tenant shall pay rent monthly. The Landlord shall keep the roof in repair."
+
+    def setUp(self):
+        super().setUp()
+        session_dir = override_settings(DOCS_UPLOAD_SESSION_DIR=f'{self.media_root}/sessions')
+        session_dir.enable()
+        self.addCleanup(session_dir.disable)
+
+    def put_chunk(self, session_id, offset, data):
+        return self.client.put(
+            f'/api/docs/upload/sessions/{session_id}/?offset={offset}', data, content_type='application/octet-stream'
+        )
+
+    def test_chunk_at_the_wrong_offset_is_refused_with_the_resume_point(self):
+        session = self.client.post('/api/docs/upload/sessions/', {'name': 'lease.txt', 'size': len(self.content)}).json()
+
+        self.assertEqual(self.put_chunk(session['id'], 0, self.content[:40]).json()['received'], 40)
+        conflict = self.put_chunk(session['id'], 20, self.content[20:])
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict.json()['received'], 40)
+
+        resumed = self.put_chunk(session['id'], 40, self.content[40:])
+        self.assertEqual(resumed.json()['received'], len(self.content))
+
+    def test_complete_is_idempotent(self):
+        session = self.client.post('/api/docs/upload/sessions/', {'name': 'lease.txt', 'size': len(self.content)}).json()
+        self.put_chunk(session['id'], 0, self.content)
+
+        created = self.client.post(f'/api/docs/upload/sessions/{session["id"]}/complete/')
+        retried = self.client.post(f'/api/docs/upload/sessions/{session["id"]}/complete/')
+        self.assertEqual((created.status_code, retried.status_code), (201, 200))
+        self.assertEqual(created.json()['id'], retried.json()['id'])
+        self.assertEqual(LegalDocument.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(UploadSession.objects.get(id=session['id']).status, 'completed')
+
+        document = LegalDocument.objects.get(id=created.json()['id'])
+        with document.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+
+
+@override_settings(PDF_EXTRACTION_WORKERS=3, PDF_MIN_PAGES_PER_SHARD=5)
+class PdfExtractionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = f'{directory}/contract.pdf'
+        build_sample_pdf(self.path, 30, lines_per_page=2)
+
+    def assert_pages(self, pages, numbers):
+        self.assertEqual([page.number for page in pages], list(numbers))
+        for page in pages:
+            self.assertIn(f"section {page.number}.1.", page.text)
+            self.assertIsNone(page.error)
+
+    def test_shards_are_contiguous_and_cover_every_page(self):
+        for page_count, workers, min_pages in [(1, 4, 25), (30, 3, 5), (31, 3, 5), (30, 4, 25), (100, 8, 1), (7, 0, 0)]:
+            shards = pdf_page_shards(page_count, workers, min_pages)
+            self.assertLessEqual(len(shards), max(workers, 1))
+            self.assertEqual(shards[0][0], 0)
+            self.assertEqual(shards[-1][1], page_count)
+            for (_, stop), (start, _) in zip(shards, shards[1:]):
+                self.assertEqual(stop, start)
+        self.assertEqual(pdf_page_shards(30, 3, 5), [(0, 10), (10, 20), (20, 30)])
+        self.assertEqual(pdf_page_shards(30, 4, 25), [(0, 30)])
+        self.assertEqual(pdf_page_shards(0, 4, 25), [])
+
+    @override_settings(PDF_PARALLEL_MIN_PAGES=0)
+    def test_sharded_extraction_keeps_page_order(self):
+        self.assert_pages(list(iter_pdf_pages(self.path)), range(1, 31))
+        self.assert_pages(list(iter_pdf_pages(self.path, start_page=8)), range(8, 31))
+
+    @override_settings(PDF_PARALLEL_MIN_PAGES=31)
+    def test_short_pdfs_are_extracted_in_process(self):
+        with mock.patch('docsapp.services.ProcessPoolExecutor') as pool:
+            self.assert_pages(list(iter_pdf_pages(self.path)), range(1, 31))
+        pool.assert_not_called()
+
+    def test_page_offsets_locate_each_page_in_the_joined_text(self):
+        pages = ["  Preamble", "", "Clause 1.", "Clause 2.  ", "   "]
+        text = join_pages(pages)
+        spans = page_offsets(pages)
+        self.assertEqual([text[start:end] for start, end in spans], ["Preamble", "", "Clause 1.", "Clause 2.", ""])
+        self.assertEqual(spans[-1], (len(text), len(text)))
+
+
+class ChunkingTests(SimpleTestCase):
+    def test_short_and_blank_text(self):
+        self.assertEqual(split_into_chunks("  Whole lease.  ", 100), ["Whole lease."])
+        self.assertEqual(split_into_chunks(" \n ", 100), [])
+
+    def test_cuts_on_the_strongest_boundary_that_fits(self):
+        text = (
+            "Section 1. Rent\n1. The Tenant pays monthly.\n2. Late rent accrues interest.\n"
+            "Section 2. Repairs\nThe Landlord maintains the roof."
+        )
+        self.assertEqual(split_into_chunks(text, 80), [
+            "Section 1. Rent\n1. The Tenant pays monthly.\n2. Late rent accrues interest.",
+            "Section 2. Repairs\nThe Landlord maintains the roof.",
+        ])
+        # A section too long for one chunk is cut between its numbered clauses
+        self.assertEqual(split_into_chunks(text, 50)[:2], [
+            "Section 1. Rent\n1. The Tenant pays monthly.", "2. Late rent accrues interest."
+        ])
+
+    def test_chunks_are_consecutive_without_overlap_or_loss(self):
+        text = "\n\n".join(
+            f"Clause {number}. " + " ".join(f"Term{number}x{word} applies; it binds both parties." for word in range(number % 7 + 1))
+            for number in range(60)
+        )
+        for max_chars in (40, 150, 700):
+            chunks = split_into_chunks(text, max_chars)
+            self.assertTrue(all(0 < len(chunk) <= max_chars for chunk in chunks))
+            self.assertEqual(''.join(''.join(chunks).split()), ''.join(text.split()))
+
+    def test_text_without_boundaries_is_hard_cut(self):
+        self.assertEqual(split_into_chunks("x" * 25, 10), ["x" * 10, "x" * 10, "x" * 5])
+
+
+class ChunkIndexTests(SimpleTestCase):
+    text = "\n\n".join([
+        "The Tenant shall pay rent on the first day of every month to the Landlord.",
+        "Either party may end this lease. Termination requires notice, and termination takes effect after sixty days.",
+        "The Landlord shall maintain the roof and the heating system in good repair.",
+        "Termination for cause is governed by the default clause below and the applicable law.",
+    ])
+
+    def setUp(self):
+        self.index = ChunkIndex.build(self.text, 120)
+
+    def test_ranks_chunks_by_bm25(self):
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.top_chunks("termination notice", 3), [1, 3])
+        self.assertEqual(self.index.top_chunks("roof repair", 3), [2])
+        self.assertEqual(self.index.top_chunks("indemnity", 3), [])
+
+    def test_survives_serialization(self):
+        restored = ChunkIndex.from_bytes(self.index.to_bytes(), self.index.vocabulary)
+        self.assertEqual(restored.score("termination").tolist(), self.index.score("termination").tolist())
+
+
+class SearchBackendTests(TestCase):
+    def setUp(self):
+        search._available.clear()
+        self.addCleanup(search._available.clear)
+
+    def test_missing_index_is_looked_up_again(self):
+        with mock.patch.object(connection.introspection, 'table_names', return_value=[]):
+            self.assertIsNone(search.search_backend())
+        # The migration that adds the index has run since
+        self.assertEqual(search.search_backend(), 'fts5')
+
+
+class SQLiteConnectionTests(SimpleTestCase):
+    """The test database lives in memory, so open a file database with the configured OPTIONS"""
+    databases = {'default'}
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'db.sqlite3')
+        self.wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': self.path})
+        self.addCleanup(self.wrapper.close)
+
+    def test_init_command_enables_wal(self):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        self.wrapper.ensure_connection()
+        self.assertEqual(self.wrapper.transaction_mode, 'IMMEDIATE')
+        # What transaction.atomic() issues on SQLite before the first query
+        self.wrapper._start_transaction_under_autocommit()
+        self.addCleanup(self.wrapper.connection.rollback)
+
+        other = sqlite3.connect(self.path, timeout=0)
+        self.addCleanup(other.close)
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            other.execute('BEGIN IMMEDIATE')
+
+
+@override_settings(GEMINI_BACKGROUND_RESERVE=0.2)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('docsapp.ratelimit.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_waits_for_tokens_to_refill(self):
+        self.assertIsNone(ratelimit.try_acquire([('rpm', 60, 60)]))
+        self.assertAlmostEqual(ratelimit.try_acquire([('rpm', 60, 1)]), 1.0)
+        self.now += 1
+        self.assertIsNone(ratelimit.try_acquire([('rpm', 60, 1)]))
+
+    def test_takes_from_every_bucket_or_none(self):
+        self.assertIsNone(ratelimit.try_acquire([('rpm', 10, 1), ('tpm', 100, 95)]))
+        self.assertIsNotNone(ratelimit.try_acquire([('rpm', 10, 1), ('tpm', 100, 10)]))
+        self.assertEqual(RateLimitBucket.objects.get(name='rpm').tokens, 9)
+
+    def test_lost_compare_and_swap_takes_nothing(self):
+        ratelimit.try_acquire([('rpm', 10, 1)])
+        read = RateLimitBucket.objects.filter
+
+        def read_then_race(**kwargs):
+            rows = read(**kwargs)
+            if 'name__in' in kwargs:
+                rows = list(rows)
+                # Another process takes tokens between our read and write
+                RateLimitBucket.objects.all().filter(name='rpm').update(tokens=0, version=F('version') + 1)
+            return rows
+
+        with mock.patch.object(RateLimitBucket.objects, 'filter', side_effect=read_then_race):
+            self.assertEqual(ratelimit.try_acquire([('rpm', 10, 1)]), 0.0)
+        self.assertEqual(RateLimitBucket.objects.get(name='rpm').tokens, 0)
+
+    def test_background_calls_leave_the_reserve(self):
+        self.assertIsNone(ratelimit.try_acquire([('rpm', 10, 8)]))
+        with ratelimit.background():
+            self.assertIsNotNone(ratelimit.try_acquire([('rpm', 10, 1)]))
+        self.assertIsNone(ratelimit.try_acquire([('rpm', 10, 1)]))
+
+
+class SingleFlightTests(TestCase):
+    def test_concurrent_callers_share_one_computation(self):
+        computed = []
+
+        async def compute():
+            computed.append(1)
+            await asyncio.sleep(0.05)
+            return "analysis"
+
+        async def callers():
+            return await asyncio.gather(*(asingle_flight('summary:1', compute, lambda: None) for _ in range(3)))
+
+        results = async_to_sync(callers)()
+        self.assertEqual(len(computed), 1)
+        self.assertEqual(results, [("analysis", False), ("analysis", True), ("analysis", True)])
+        self.assertFalse(InflightRequest.objects.exists())
+
+    def test_lock_excludes_other_processes_until_released_or_expired(self):
+        self.assertTrue(acquire_lock('qa:1', 'a'))
+        self.assertFalse(acquire_lock('qa:1', 'b'))
+        release_lock('qa:1', 'a')
+        self.assertTrue(acquire_lock('qa:1', 'b'))
+
+        InflightRequest.objects.filter(key='qa:1').update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(acquire_lock('qa:1', 'c'))
+        self.assertEqual(InflightRequest.objects.get(key='qa:1').owner, 'c')
+
+
+@mock.patch.object(GeminiService, 'run_analysis', return_value="Fresh summary.")
+@override_settings(ANALYSIS_CACHE_TTL=3600, ANALYSIS_CACHE_MAX_ENTRIES=2, CACHE_EVICTION_SAMPLE_RATE=0)
+class AnalysisCacheTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document = self.upload()
+        self.key = analysis_cache.content_key(self.document)
+        self.version = GeminiService.PROMPT_VERSIONS['summary']
+        self.model = GeminiService().model_name
+
+    def store(self, result="Cached summary.", key=None, version=None):
+        analysis_cache.store_analysis(key or self.key, 'summary', version or self.version, self.model, result)
+
+    def test_hit_and_refresh(self, run_analysis):
+        self.store()
+        self.assertEqual(analysis_cache.get_or_run_analysis(self.document, 'summary'), ("Cached summary.", True))
+        run_analysis.assert_not_called()
+
+        self.assertEqual(analysis_cache.get_or_run_analysis(self.document, 'summary', refresh=True), ("Fresh summary.", False))
+        self.assertEqual(analysis_cache.get_or_run_analysis(self.document, 'summary'), ("Fresh summary.", True))
+        self.assertEqual(run_analysis.call_count, 1)
+
+    def test_expired_entry_is_a_miss_but_serves_as_stale_fallback(self, run_analysis):
+        self.store()
+        AnalysisResult.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertIsNone(analysis_cache.get_cached_analysis(self.key, 'summary', self.version, self.model))
+        self.assertEqual(analysis_cache.get_stale_analysis(self.key, 'summary'), "Cached summary.")
+
+        run_analysis.return_value = None  # Gemini failed
+        self.assertEqual(analysis_cache.get_or_run_analysis(self.document, 'summary'), ("Cached summary.", True))
+
+        self.assertEqual(analysis_cache.prune_analysis_cache(), 1)
+        self.assertFalse(AnalysisResult.objects.exists())
+
+    def test_older_prompt_version_is_a_miss_and_invalidated_as_stale(self, run_analysis):
+        self.store("Old summary.", version='old')
+        self.assertEqual(analysis_cache.get_or_run_analysis(self.document, 'summary'), ("Fresh summary.", False))
+        self.assertEqual(AnalysisResult.objects.count(), 2)
+
+        self.assertEqual(analysis_cache.invalidate_analyses(stale_only=True), 1)
+        self.assertEqual(list(AnalysisResult.objects.values_list('prompt_version', flat=True)), [self.version])
+        self.assertEqual(analysis_cache.invalidate_analyses(analysis_type='summary', key=self.key), 1)
+
+    def test_size_bound_is_enforced_by_sampled_writes_and_prune(self, run_analysis):
+        for index in range(3):
+            self.store(key=f'content-{index}')
+            AnalysisResult.objects.filter(content_hash=f'content-{index}').update(
+                last_accessed_at=timezone.now() - timedelta(minutes=10 - index)
+            )
+        # No write was sampled: nothing evicted yet
+        self.assertEqual(AnalysisResult.objects.count(), 3)
+        self.assertEqual(analysis_cache.prune_analysis_cache(), 1)
+        self.assertEqual(set(AnalysisResult.objects.values_list('content_hash', flat=True)), {'content-1', 'content-2'})
+
+        with override_settings(CACHE_EVICTION_SAMPLE_RATE=1):
+            self.store(key='content-3')
+        self.assertEqual(set(AnalysisResult.objects.values_list('content_hash', flat=True)), {'content-2', 'content-3'})
+
+
+class CombinedBackend(LLMBackend):
+    """Answers combined (JSON-schema) prompts with `combined`, and each separate analysis with its operation name."""
+    name = 'combined'
+
+    def __init__(self, combined):
+        self.combined = combined
+        self.operations = []
+
+    def generate(self, model_name, body, operation):
+        self.operations.append(operation)
+        text = self.combined if 'responseSchema' in body.get('generationConfig', {}) else f"Separate {operation}."
+        return {'candidates': [{'content': {'parts': [{'text': text}]}}]}
+
+
+@mock.patch('docsapp.ai_service.record_call')
+class CombinedAnalysisTests(SimpleTestCase):
+    types = ['summary', 'risks']
+
+    def test_parse_combined_keeps_only_complete_string_fields(self, record_call):
+        parse = GeminiPrompts.parse_combined
+        self.assertEqual(parse(self.types, '{"summary": " A lease. ", "risks": "- Late fees", "extra": "x"}'),
+                         {'summary': "A lease.", 'risks': "- Late fees"})
+        self.assertEqual(parse(self.types, '{"summary": "A lease.", "risks": ["- Late fees"]}'), {'summary': "A lease."})
+        self.assertEqual(parse(self.types, '{"summary": "  ", "risks": null}'), {})
+        for malformed in (None, '', 'Here is the analysis:', '{"summary": "A lease.', '["A lease."]', '"A lease."'):
+            self.assertEqual(parse(self.types, malformed), {}, malformed)
+
+    def test_fields_missing_from_the_combined_response_are_requested_separately(self, record_call):
+        service = GeminiService()
+        for combined, separate in [('{"summary": "A lease."}', ['risks']), ('{"summary": "A lea', ['summary', 'risks'])]:
+            service.backend = CombinedBackend(combined)
+            results = service.run_analyses(self.types, "The Tenant shall pay rent.")
+            self.assertEqual(sorted(service.backend.operations), sorted(['analyze'] + separate))
+            for analysis_type in separate:
+                self.assertEqual(results[analysis_type], f"Separate {analysis_type}.")
+
+
+@mock.patch.object(GeminiService, 'run_analyses', return_value={'summary': "Fresh summary.", 'risks': "Fresh risks."})
+class CombinedAnalysisCacheTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document = self.upload()
+        self.key = analysis_cache.content_key(self.document)
+        self.model = GeminiService().model_name
+
+    def store(self, analysis_type, result):
+        analysis_cache.store_analysis(self.key, analysis_type, GeminiService.PROMPT_VERSIONS[analysis_type], self.model, result)
+
+    def test_only_misses_are_generated_and_cached(self, run_analyses):
+        self.store('summary', "Cached summary.")
+        results = analysis_cache.get_or_run_analyses(self.document, ['summary', 'risks'])
+        self.assertEqual(results, {'summary': ("Cached summary.", True), 'risks': ("Fresh risks.", False)})
+        self.assertEqual(run_analyses.call_args.args[0], ['risks'])
+        self.assertEqual(analysis_cache.get_or_run_analysis(self.document, 'risks'), ("Fresh risks.", True))
+
+    def test_waits_for_another_process_generating_the_same_types(self, run_analyses):
+        versions = GeminiService.PROMPT_VERSIONS
+        flight = analysis_cache.flight_key(self.key, 'risks+summary', f"{versions['risks']}+{versions['summary']}", self.model)
+        self.assertTrue(acquire_lock(flight, 'other-process'))
+
+        def other_process_finishes(seconds):
+            self.store('summary', "Their summary.")
+            self.store('risks', "Their risks.")
+
+        with mock.patch('docsapp.singleflight.time', wraps=time) as clock:
+            clock.sleep.side_effect = other_process_finishes
+            results = analysis_cache.get_or_run_analyses(self.document, ['summary', 'risks'])
+        self.assertEqual(results, {'summary': ("Their summary.", True), 'risks': ("Their risks.", True)})
+        run_analyses.assert_not_called()
+
+
+@mock.patch.object(GeminiService, 'answer_question', return_value="Monthly.")
+@override_settings(QA_CACHE_TTL=3600)
+class QACacheTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document = self.upload()
+        save_text(self.document, "The Tenant shall pay rent monthly.")
+
+    def test_normalized_questions_share_an_entry(self, answer_question):
+        self.assertEqual(qa_cache.normalize_question("What is the notice period?"), "what notice period")
+        for variant in ("what is  the NOTICE period", "Ｗhat is the notice-period?!", "Please, what notice period"):
+            self.assertEqual(qa_cache.question_key(variant), qa_cache.question_key("What is the notice period?"), variant)
+        # Words that change the answer are kept
+        for different in ("What is not the notice period?", "Who may give notice?", "What is our notice period?"):
+            self.assertNotEqual(qa_cache.question_key(different), qa_cache.question_key("What is the notice period?"))
+
+        self.assertEqual(qa_cache.get_or_answer_question(self.document, "When is rent due?"), ("Monthly.", False))
+        self.assertEqual(qa_cache.get_or_answer_question(self.document, "when is rent due"), ("Monthly.", True))
+        self.assertEqual(answer_question.call_count, 1)
+
+    def test_answers_to_older_text_are_deleted_on_lookup(self, answer_question):
+        qa_cache.get_or_answer_question(self.document, "When is rent due?")
+        save_text(self.document, "The Tenant shall pay rent weekly.")
+
+        key = qa_cache.question_key("When is rent due?")
+        entry = QAAnswer.objects.get()
+        self.assertIsNone(qa_cache.get_cached_answer(
+            self.document, key, self.document.text_hash, entry.prompt_version, entry.model_name
+        ))
+        self.assertFalse(QAAnswer.objects.exists())
+
+    def test_expired_answer_is_refreshed_but_served_when_gemini_fails(self, answer_question):
+        qa_cache.get_or_answer_question(self.document, "When is rent due?")
+        QAAnswer.objects.update(created_at=timezone.now() - timedelta(hours=2))
+
+        answer_question.return_value = None
+        self.assertEqual(qa_cache.get_or_answer_question(self.document, "When is rent due?"), ("Monthly.", True))
+
+        answer_question.return_value = "On the first of the month."
+        self.assertEqual(
+            qa_cache.get_or_answer_question(self.document, "When is rent due?"), ("On the first of the month.", False)
+        )
+        self.assertEqual(answer_question.call_count, 3)
+
+    def test_no_stale_answer_for_other_text(self, answer_question):
+        qa_cache.get_or_answer_question(self.document, "When is rent due?")
+        save_text(self.document, "The Tenant shall pay rent weekly.")
+        answer_question.return_value = None
+        self.assertEqual(qa_cache.get_or_answer_question(self.document, "When is rent due?"), (None, False))
+
+
+class ScriptedBackend(LLMBackend):
+    """Inner backend whose calls raise the queued exceptions (or succeed when the queue is empty)."""
+    name = 'scripted'
+
+    def __init__(self):
+        self.errors = []
+
+    def _next(self):
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'ok': True}
+
+    def generate(self, model_name, body, operation):
+        return self._next()
+
+    def stream(self, model_name, body, operation):
+        yield {'piece': 1}
+        yield self._next()
+
+    async def agenerate(self, model_name, body, operation):
+        return self._next()
+
+
+@override_settings(
+    GEMINI_BREAKER_ERROR_RATE=0.5, GEMINI_BREAKER_WINDOW=4, GEMINI_BREAKER_MIN_CALLS=2,
+    GEMINI_BREAKER_COOLDOWN=30, GEMINI_HEDGE_PERCENTILE=0
+)
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.inner = ScriptedBackend()
+        self.backend = ResilientBackend(self.inner)
+        self.now = 1000.0
+        patcher = mock.patch('docsapp.resilience.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _generate(self):
+        return self.backend.generate('model', {}, 'summary')
+
+    def _open_breaker(self):
+        self.inner.errors = [GeminiError('down'), GeminiError('down')]
+        for _ in range(2):
+            with self.assertRaises(GeminiError):
+                self._generate()
+        self.assertEqual(self.backend.breaker.state, 'open')
+
+    def test_closed_open_half_open_closed(self):
+        self._open_breaker()
+        with self.assertRaises(CircuitOpenError):
+            self._generate()
+
+        self.now += 31
+        self.assertEqual(self._generate(), {'ok': True})  # the half-open trial
+        self.assertEqual(self.backend.breaker.state, 'closed')
+
+    def test_failed_trial_reopens(self):
+        self._open_breaker()
+        self.now += 31
+        self.inner.errors = [GeminiError('still down')]
+        with self.assertRaises(GeminiError):
+            self._generate()
+        self.assertEqual(self.backend.breaker.state, 'open')
+
+    def test_local_errors_count_as_successes(self):
+        self.inner.errors = [GeminiLocalError('no key')] * 3
+        for _ in range(3):
+            with self.assertRaises(GeminiLocalError):
+                self._generate()
+        self.assertEqual(self.backend.breaker.state, 'closed')
+
+    def test_abandoned_trial_stream_releases_the_trial(self):
+        self._open_breaker()
+        self.now += 31
+        stream = self.backend.stream('model', {}, 'summary')
+        next(stream)
+        self.assertEqual(self.backend.breaker.state, 'half_open')
+        stream.close()  # the client disconnected mid-stream
+
+        self.assertEqual(self._generate(), {'ok': True})
+        self.assertEqual(self.backend.breaker.state, 'closed')
+
+    def test_unexpected_error_in_trial_reopens(self):
+        self._open_breaker()
+        self.now += 31
+        self.inner.errors = [KeyError('candidates')]
+        with self.assertRaises(KeyError):
+            self._generate()
+        self.assertEqual(self.backend.breaker.state, 'open')
+
+        self.now += 31
+        self.assertEqual(self._generate(), {'ok': True})
+        self.assertEqual(self.backend.breaker.state, 'closed')
+
+    def test_cancelled_async_trial_reopens(self):
+        self._open_breaker()
+        self.now += 31
+        self.inner.errors = [asyncio.CancelledError()]
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(self.backend.agenerate('model', {}, 'summary'))
+        self.assertEqual(self.backend.breaker.state, 'open')
+        self.assertFalse(self.backend.breaker._trial_running)
+
+
+class StallingBackend(LLMBackend):
+    """Holds its first call until released; answers the others at once. Records the thread of each call."""
+    name = 'stalling'
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.threads = []
+
+    def generate(self, model_name, body, operation):
+        self.threads.append(threading.current_thread().name)
+        if len(self.threads) == 1:
+            self.release.wait(5)
+            return {'call': 'primary'}
+        return {'call': 'hedge'}
+
+
+@mock.patch('docsapp.llm_backends.hedge_delay', return_value=0.05)
+class HedgeTests(SimpleTestCase):
+    def setUp(self):
+        self.inner = StallingBackend()
+        self.addCleanup(self.inner.release.set)
+        self.backend = ResilientBackend(self.inner)
+
+    def test_slow_call_is_hedged_on_the_shared_pool(self, hedge_delay):
+        self.assertEqual(self.backend.generate('model', {}, 'summary'), {'call': 'hedge'})
+        self.assertEqual(len(self.inner.threads), 2)
+        self.assertTrue(all(name.startswith('gemini-hedge') for name in self.inner.threads))
+
+    def test_calls_run_unhedged_while_the_pool_is_busy(self, hedge_delay):
+        self.backend.hedge_pool = HedgePool(1)
+        busy = threading.Event()
+        self.addCleanup(busy.set)
+        self.assertIsNotNone(self.backend.hedge_pool.try_submit(busy.wait, 5))
+        self.assertIsNone(self.backend.hedge_pool.try_submit(busy.wait, 5))
+
+        self.inner.release.set()
+        self.assertEqual(self.backend.generate('model', {}, 'summary'), {'call': 'primary'})
+        self.assertEqual(self.inner.threads, [threading.current_thread().name])
+
+
+@override_settings(GEMINI_MAX_RETRIES=2, GEMINI_BACKOFF_BASE=0.5, GEMINI_BACKOFF_MAX=8.0, GEMINI_RPM=0, GEMINI_TPM=0)
+class RetryTests(SimpleTestCase):
+    body = {'contents': [{'parts': [{'text': "Summarize the lease."}]}]}
+
+    def setUp(self):
+        self.backend = GeminiHTTPBackend()
+        self.sleeps = []
+        # Only the backend's sleeps are skipped; the fake server keeps its own
+        patcher = mock.patch('docsapp.llm_backends.time', wraps=time)
+        self.sleep = patcher.start().sleep
+        self.sleep.side_effect = self.sleeps.append
+        self.addCleanup(patcher.stop)
+
+    def serve(self, **options):
+        server = FakeGeminiServer(latency=0.01, **options).start()
+        self.addCleanup(server.stop)
+        self.enterContext(override_settings(GEMINI_API_BASE=server.base_url))
+        return server
+
+    def test_backoff_delay_has_full_jitter_under_a_doubling_cap(self):
+        with mock.patch('docsapp.llm_backends.random.uniform', side_effect=lambda low, high: (low, high)):
+            self.assertEqual([backoff_delay(attempt) for attempt in range(6)], [(0, ceiling) for ceiling in (0.5, 1, 2, 4, 8, 8)])
+
+    def test_retry_after_delay_reads_seconds_or_an_http_date(self):
+        def delay(value):
+            response = requests.Response()
+            if value is not None:
+                response.headers['Retry-After'] = value
+            return retry_after_delay(response)
+
+        self.assertEqual(delay('3'), 3.0)
+        self.assertEqual(delay('-1'), 0.0)
+        self.assertAlmostEqual(delay(formatdate(time.time() + 30, usegmt=True)), 30, delta=2)
+        self.assertEqual(delay(formatdate(time.time() - 30, usegmt=True)), 0.0)
+        self.assertIsNone(delay('soon'))
+        self.assertIsNone(delay(None))
+
+    def test_429_waits_for_retry_after_then_gives_up(self):
+        server = self.serve(rpm=1)
+        self.assertIn('candidates', self.backend.generate('model', self.body, 'summary'))
+
+        with self.assertRaisesRegex(GeminiError, '429'):
+            self.backend.generate('model', self.body, 'summary')
+        self.assertEqual(self.sleeps, [1.0, 1.0])
+        self.assertEqual(server.stats['rejected'], 3)
+
+    def test_5xx_is_retried_with_backoff(self):
+        server = self.serve(error_rate=1.0)
+
+        def wait(delay):
+            self.sleeps.append(delay)
+            if len(self.sleeps) == 2:
+                server.error_rate = 0.0  # the upstream recovers during the second wait
+
+        self.sleep.side_effect = wait
+        with mock.patch('docsapp.llm_backends.random.uniform', side_effect=lambda low, high: high):
+            self.assertIn('candidates', self.backend.generate('model', self.body, 'summary'))
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+        self.assertEqual((server.stats['requests'], server.stats['errors']), (3, 2))
+
+    def test_5xx_exhausts_the_retries(self):
+        server = self.serve(error_rate=1.0)
+        with self.assertRaisesRegex(GeminiError, '503'):
+            self.backend.generate('model', self.body, 'summary')
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertEqual(server.stats['requests'], 3)
+
+    def test_read_timeouts_are_not_retried(self):
+        server = self.serve()
+        server.latency = 0.5
+        with override_settings(GEMINI_TIMEOUTS={'default': 0.1}):
+            with self.assertRaises(GeminiError):
+                self.backend.generate('model', self.body, 'summary')
+            with self.assertRaises(GeminiError):
+                asyncio.run(self.backend.agenerate('model', self.body, 'summary'))
+        self.assertEqual(server.stats['requests'], 2)
+        self.assertEqual(self.sleeps, [])
+
+
+class FakeGeminiTests(SimpleTestCase):
+    body = {'contents': [{'parts': [{'text': "Summarize the lease."}]}]}
+
+    def serve(self, **options):
+        server = FakeGeminiServer(**options).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def post(self, server):
+        return requests.post(f"{server.base_url}/models/model:generateContent", json=self.body, timeout=5)
+
+    def test_fake_backend_is_deterministic_and_fills_json_schemas(self):
+        backend = FakeLLMBackend()
+        text = backend.generate('model', self.body, 'summary')['candidates'][0]['content']['parts'][0]['text']
+        self.assertEqual(text, fake_completion("Summarize the lease."))
+        self.assertEqual(asyncio.run(backend.agenerate('model', self.body, 'summary')), backend.generate('model', self.body, 'summary'))
+        streamed = ''.join(event['candidates'][0]['content']['parts'][0]['text'] for event in backend.stream('model', self.body, 'summary'))
+        self.assertEqual(streamed.strip(), text)
+
+        schema = dict(self.body, generationConfig={'responseSchema': {
+            'type': 'OBJECT', 'properties': {'summary': {'type': 'STRING'}, 'risks': {'type': 'STRING'}}
+        }})
+        combined = backend.generate('model', schema, 'analyze')['candidates'][0]['content']['parts'][0]['text']
+        self.assertEqual(sorted(json.loads(combined)), ['risks', 'summary'])
+
+    def test_no_api_key_is_needed_for_a_local_server(self):
+        server = self.serve(latency=0)
+        with mock.patch('docsapp.llm_backends.config', return_value=None):
+            with override_settings(GEMINI_API_BASE=server.base_url, GEMINI_RPM=0, GEMINI_TPM=0):
+                self.assertIn('candidates', GeminiHTTPBackend().generate('model', self.body, 'summary'))
+            with self.assertRaisesRegex(GeminiLocalError, 'GEMINI_API_KEY'):
+                GeminiHTTPBackend().generate('model', self.body, 'summary')
+        self.assertTrue(is_loopback_url('http://localhost:8765/v1beta'))
+        self.assertFalse(is_loopback_url('https://generativelanguage.googleapis.com/v1beta'))
+
+    def test_error_rate(self):
+        server = self.serve(latency=0, error_rate=0.5, seed=7)
+        statuses = [self.post(server).status_code for _ in range(40)]
+        self.assertEqual(set(statuses), {200, 503})
+        self.assertEqual(statuses.count(503), server.stats['errors'])
+        self.assertTrue(10 <= server.stats['errors'] <= 30)
+
+    def test_rpm_cap_answers_429_with_retry_after(self):
+        server = self.serve(latency=0, rpm=3)
+        responses = [self.post(server) for _ in range(5)]
+        self.assertEqual([response.status_code for response in responses], [200, 200, 200, 429, 429])
+        self.assertEqual(responses[-1].headers['Retry-After'], '1')
+        self.assertEqual(responses[-1].json()['error']['status'], 'RESOURCE_EXHAUSTED')
+        self.assertEqual(server.stats['rejected'], 2)
+
+    def test_max_concurrent_cap(self):
+        server = self.serve(latency=0.3, max_concurrent=2)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            statuses = sorted(response.status_code for response in executor.map(lambda _: self.post(server), range(4)))
+        self.assertEqual(statuses, [200, 200, 429, 429])
+
+
+class EchoBackend(LLMBackend):
+    """Answers every prompt with a fixed JSON object, whatever was asked."""
+    name = 'echo'
+
+    async def agenerate(self, model_name, body, operation):
+        text = '{"summary": "A lease.", "risks": "- Late fees"}'
+        return {'candidates': [{'content': {'parts': [{'text': text}]}}]}
+
+
+@mock.patch('docsapp.async_ai_service.record_call')
+class AsyncServiceTests(SimpleTestCase):
+    def setUp(self):
+        self.service = AsyncGeminiService()
+        self.service.backend = EchoBackend()
+
+    def test_run_analyses_is_async(self, record_call):
+        results = asyncio.run(self.service.run_analyses(['summary', 'risks'], "The Tenant shall pay rent."))
+        self.assertEqual(results, {'summary': "A lease.", 'risks': "- Late fees"})
+        self.assertEqual(record_call.call_count, 1)
+
+    def test_shares_prompts_but_not_the_sync_interface(self, record_call):
+        self.assertNotIsInstance(self.service, GeminiService)
+        self.assertFalse(hasattr(self.service, 'stream_analysis'))
+        self.assertEqual(
+            self.service.prompts.qa_prompt("Rent is due monthly.", "When?"),
+            GeminiService().prompts.qa_prompt("Rent is due monthly.", "When?")
+        )
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('tester', password='tester-password')
+        self.document = LegalDocument.objects.create(
+            user=self.user, original_name='lease.txt', file_type='text/plain', file_size=1
+        )
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def ask(self, body, document_id=None, **headers):
+        return self.client.post(
+            f'/api/docs/{document_id or self.document.id}/qa/async/', body, content_type='application/json', **headers
+        )
+
+    def test_qa_checks_credentials_and_document_before_the_question(self):
+        self.assertEqual(self.ask({}).status_code, 401)
+        self.assertEqual(self.ask({}, document_id=self.document.id + 1, **self.auth).status_code, 404)
+        self.assertEqual(self.ask({}, **self.auth).json(), {'error': 'Question is required.'})
+        # Only then is the text required
+        response = self.ask({'question': 'Who pays rent?'}, **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('text not available', response.json()['error'])
+
+
+class PieceBackend(LLMBackend):
+    """Streams `pieces` one event at a time, then fails if `error` is set."""
+    name = 'pieces'
+
+    def __init__(self, pieces, error=None):
+        self.pieces = pieces
+        self.error = error
+        self.calls = 0
+
+    def stream(self, model_name, body, operation):
+        self.calls += 1
+        for piece in self.pieces:
+            yield {'candidates': [{'content': {'parts': [{'text': piece}]}}]}
+        if self.error:
+            raise self.error
+
+
+class StreamingTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document = self.upload()
+        save_text(self.document, "The Tenant shall pay rent monthly.")
+
+    def stream(self, backend, path='summary', **extra):
+        with mock.patch('docsapp.ai_service.get_llm_backend', return_value=backend):
+            response = self.client.post(f'/api/docs/{self.document.id}/{path}/?stream=1', extra, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+            return self.events(b''.join(response.streaming_content))
+
+    def events(self, body):
+        """(event, data) of each event in a server-sent event stream"""
+        body = body.decode('utf-8')
+        self.assertTrue(body.endswith('\n\n'))
+        parsed = []
+        for block in body[:-2].split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in block.split('\n'))
+            parsed.append((fields.get('event', 'message'), json.loads(fields['data'])))
+        return parsed
+
+    def test_deltas_then_done_and_the_result_is_cached(self):
+        events = self.stream(PieceBackend(["A lease ", "for an ", "apartment."]))
+        self.assertEqual(events, [
+            ('message', {'delta': "A lease "}), ('message', {'delta': "for an "}), ('message', {'delta': "apartment."}),
+            ('done', {}),
+        ])
+        response = self.client.post(f'/api/docs/{self.document.id}/summary/')
+        self.assertEqual(response.json(), {'summary': "A lease for an apartment.", 'cached': True})
+
+    def test_cached_result_is_replayed_in_one_event(self):
+        self.stream(PieceBackend(["A lease."]))
+        backend = PieceBackend(["Regenerated."])
+        self.assertEqual(self.stream(backend), [('message', {'delta': "A lease."}), ('done', {})])
+        self.assertEqual(backend.calls, 0)
+
+    def test_failure_mid_stream_ends_with_an_error_event(self):
+        events = self.stream(PieceBackend(["The Tenant "], error=GeminiError('connection reset')), path='qa', question="Who pays?")
+        self.assertEqual(events, [
+            ('message', {'delta': "The Tenant "}),
+            ('error', {'error': 'Generation failed. Please try again later.'}),
+        ])
+        # Nothing partial was cached
+        self.assertFalse(QAAnswer.objects.exists())
+
+    def test_errors_before_the_stream_are_rendered_as_an_error_event(self):
+        save_text(self.document, '')
+        response = self.client.post(f'/api/docs/{self.document.id}/summary/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            self.events(response.content),
+            [('error', {'error': 'Document text not available. Processing may have failed.'})]
+        )
+
+
+class FanOutTests(SimpleTestCase):
+    @mock.patch('docsapp.ai_service.connections')
+    def test_pool_workers_close_their_connections(self, connections):
+        service = GeminiService()
+        with mock.patch.object(service, '_make_request', side_effect=lambda prompt, operation: prompt.upper()):
+            self.assertEqual(service._request_concurrently(['a', 'b', 'c'], 'summary'), ['A', 'B', 'C'])
+        self.assertEqual(connections.close_all.call_count, 3)
+
+
+class TreeBackend(LLMBackend):
+    """
+    Answers map prompts with "P<part>" and reduce prompts with "R<n>", each
+    padded to a fixed length, and records which results every reduce merged.
+    """
+    name = 'tree'
+    padding = " lorem" * 150
+
+    def __init__(self):
+        self.merged = {}
+        self.lock = threading.Lock()
+
+    def generate(self, model_name, body, operation):
+        prompt = request_text(body)
+        part = re.search(r"This is part (\d+) of", prompt)
+        if part:
+            text = f"P{part.group(1)}"
+        else:
+            with self.lock:
+                text = f"R{len(self.merged) + 1}"
+                self.merged[text] = re.findall(r"\b[PR]\d+\b", prompt)
+        return {'candidates': [{'content': {'parts': [{'text': text + self.padding}]}}]}
+
+    def leaves(self, result):
+        return [leaf for name in self.merged[result] for leaf in self.leaves(name)] if result in self.merged else [result]
+
+
+@mock.patch('docsapp.ai_service.record_call')
+@override_settings(AI_PROMPT_TOKENS={'default': 500, 'summary': 500}, AI_MAX_FANOUT=4)
+class MapReduceTests(SimpleTestCase):
+    text = "\n\n".join(f"Section {number}. " + "The Tenant shall keep the premises in good order. " * 30 for number in range(12))
+
+    def setUp(self):
+        self.service = GeminiService()
+        self.service.backend = TreeBackend()
+
+    def test_group_partials_keeps_order_and_takes_at_least_two(self, record_call):
+        partials = ["alpha " * 40, "beta " * 40, "gamma " * 40, "delta"]
+        separator = "\n\n---\n\n"
+        # Each pair is over the budget, but a group always takes two partials
+        self.assertEqual(
+            GeminiPrompts.group_partials(partials, 60),
+            [separator.join(partials[:2]), separator.join(partials[2:])]
+        )
+        self.assertEqual(GeminiPrompts.group_partials(partials, 1000), [separator.join(partials)])
+
+    def test_partials_are_reduced_in_several_rounds_into_one_result(self, record_call):
+        prompts = self.service.prompts.map_prompts(self.text, self.service.prompts._summary_prompt, 'summary')
+        self.assertGreater(len(prompts), 4)
+
+        result = self.service.summarize_document(self.text)
+
+        backend = self.service.backend
+        final = result.split()[0]
+        self.assertEqual(final, f"R{len(backend.merged)}")
+        # More than one reduce round, and every part reaches the result exactly once, in order
+        self.assertTrue(any(name.startswith('R') for name in backend.merged[final]))
+        self.assertEqual(backend.leaves(final), [f"P{part}" for part in range(1, len(prompts) + 1)])
+        for prompt in (request_text(self.service.prompts.request_body(p, 'summary')) for p in prompts):
+            self.assertLessEqual(estimate_tokens(prompt), 500)
+
+    def test_a_failed_part_fails_the_analysis(self, record_call):
+        backend = self.service.backend
+        generate = backend.generate
+        backend.generate = lambda model_name, body, operation: (
+            {} if "This is part 3 of" in request_text(body) else generate(model_name, body, operation)
+        )
+        self.assertIsNone(self.service.summarize_document(self.text))
+        self.assertEqual(backend.merged, {})
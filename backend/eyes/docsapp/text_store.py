@@ -0,0 +1,145 @@
+"""
+Compressed storage of extracted document text.
+
+The text of a document is cut into TEXT_CHUNK_CHARS-character chunks, each
+zlib-compressed into a DocumentTextChunk row. The LegalDocument row only
+keeps the text's length and hash, which is all that caches and status
+checks need, so fetching a document no longer drags its text along.
+Readers load the whole text, or just the chunks under a character range.
+Page texts live in DocumentPage, compressed the same way, along with the
+span of each page within the document text.
+
+A duplicate upload stores nothing of its own: it points at the document
+whose rows hold the extraction (LegalDocument.extraction_source), and
+readers go through `extraction_id`. When that document is deleted its rows
+pass to one of the duplicates.
+"""
+import hashlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Max, Min
+
+from .models import DocumentChunkIndex, DocumentPage, DocumentTextChunk, LegalDocument
+from .services import compress_text, decompress_text
+
+# Chunks are located by index, so stored text must be rewritten if this changes
+TEXT_CHUNK_CHARS = 64 * 1024
+
+# Rows that make up the extraction of a document
+EXTRACTION_MODELS = (DocumentPage, DocumentTextChunk, DocumentChunkIndex)
+
+
+def text_key(text: str) -> str:
+    """SHA-256 of a text, for content that has no uploaded file behind it."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def compress_chunks(text: str) -> List[bytes]:
+    """The compressed chunks of a text, in order."""
+    return [compress_text(text[start:start + TEXT_CHUNK_CHARS]) for start in range(0, len(text), TEXT_CHUNK_CHARS)]
+
+
+def save_text(document: LegalDocument, text: str):
+    """Replace the stored text of a document."""
+    with transaction.atomic():
+        DocumentTextChunk.objects.filter(document=document).delete()
+        DocumentTextChunk.objects.bulk_create([
+            DocumentTextChunk(document=document, index=index, data=data)
+            for index, data in enumerate(compress_chunks(text))
+        ])
+        document.extraction_source = None
+        document.text_length = len(text)
+        document.text_hash = text_key(text) if text else ''
+        document.save(update_fields=['extraction_source', 'text_length', 'text_hash'])
+
+
+def share_text(source: LegalDocument, target: LegalDocument):
+    """Give `target` the extraction of `source` by reference: pages, text and chunk index."""
+    with transaction.atomic():
+        for model in EXTRACTION_MODELS:
+            model.objects.filter(document=target).delete()
+        target.extraction_source_id = source.extraction_id
+        target.text_length = source.text_length
+        target.text_hash = source.text_hash
+        target.pages_extracted = source.pages_extracted
+        target.save(update_fields=['extraction_source', 'text_length', 'text_hash', 'pages_extracted'])
+
+
+def hand_over_extraction(document: LegalDocument):
+    """Before `document` is deleted, move the extraction rows it holds for its duplicates to the oldest of them."""
+    copies = LegalDocument.objects.filter(extraction_source_id=document.id).order_by('id')
+    heir = copies.values_list('id', flat=True).first()
+    if heir is None:
+        return
+    with transaction.atomic():
+        for model in EXTRACTION_MODELS:
+            model.objects.filter(document_id=document.id).update(document_id=heir)
+        copies.exclude(id=heir).update(extraction_source_id=heir)
+        LegalDocument.objects.filter(id=heir).update(extraction_source=None)
+
+
+def load_text(document: LegalDocument) -> str:
+    """The whole extracted text of a document ('' before extraction)."""
+    if not document.text_length:
+        return ''
+    chunks = DocumentTextChunk.objects.filter(document_id=document.extraction_id).order_by('index').values_list('data', flat=True)
+    return ''.join(decompress_text(data) for data in chunks)
+
+
+aload_text = sync_to_async(load_text)
+
+
+def load_range(document: LegalDocument, start: int, end: Optional[int] = None) -> str:
+    """Characters [start, end) of the extracted text, reading only the chunks they fall in."""
+    return load_ranges(document, [(start, end)])[0]
+
+
+def load_ranges(document: LegalDocument, spans: Sequence[Tuple[int, Optional[int]]]) -> List[str]:
+    """Several character ranges of the extracted text, with one query for all the chunks they need."""
+    bounds = []
+    needed = set()
+    for start, end in spans:
+        start = max(start, 0)
+        end = document.text_length if end is None else min(end, document.text_length)
+        bounds.append((start, end))
+        if start < end:
+            needed.update(range(start // TEXT_CHUNK_CHARS, (end - 1) // TEXT_CHUNK_CHARS + 1))
+
+    chunks: Dict[int, str] = {}
+    if needed:
+        rows = DocumentTextChunk.objects.filter(document_id=document.extraction_id, index__in=sorted(needed)).values_list('index', 'data')
+        chunks = {index: decompress_text(data) for index, data in rows}
+
+    texts = []
+    for start, end in bounds:
+        if start >= end:
+            texts.append('')
+            continue
+        first = start // TEXT_CHUNK_CHARS
+        joined = ''.join(chunks.get(index, '') for index in range(first, (end - 1) // TEXT_CHUNK_CHARS + 1))
+        offset = first * TEXT_CHUNK_CHARS
+        texts.append(joined[start - offset:end - offset])
+    return texts
+
+
+def page_span(document: LegalDocument, first_page: int, last_page: int) -> Optional[Tuple[int, int]]:
+    """Character range covering pages first_page..last_page, or None when they have no text."""
+    span = DocumentPage.objects.filter(
+        document_id=document.extraction_id, page_number__gte=first_page, page_number__lte=last_page, char_start__isnull=False
+    ).aggregate(start=Min('char_start'), end=Max('char_end'))
+    if span['start'] is None:
+        return None
+    return span['start'], span['end']
+
+
+def page_at(document: LegalDocument, offset: int) -> Optional[int]:
+    """Number of the page holding character `offset` (or the next page after it), or None past the last page."""
+    return (
+        DocumentPage.objects
+        .filter(document_id=document.extraction_id, char_end__gt=offset)
+        .order_by('page_number')
+        .values_list('page_number', flat=True)
+        .first()
+    )
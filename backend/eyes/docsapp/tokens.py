@@ -0,0 +1,113 @@
+"""
+Token estimation and prompt budgeting.
+
+Prompts are sized in tokens rather than characters: a character limit
+leaves most of the context unused on documents of short words and can
+overflow it on others. Each operation has a prompt limit (AI_PROMPT_TOKENS)
+and an output reservation (AI_MAX_OUTPUT_TOKENS); document text fills
+whatever the instructions and question leave over.
+"""
+import re
+import logging
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+from .chunking import split_into_chunks
+from .models import LLMCallLog
+
+logger = logging.getLogger(__name__)
+
+# ASCII words, single digits, and any other single non-space character
+# (punctuation, non-Latin letters), which roughly matches how Gemini's
+# tokenizer splits legal text.
+TOKEN_PIECE = re.compile(r"[A-Za-z]+|\d|[^\sA-Za-z\d]")
+
+# Words of up to this many letters are usually a single token
+LETTERS_PER_TOKEN = 8
+
+# Document text is never squeezed below this, however long the question
+MIN_TEXT_TOKENS = 256
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of Gemini tokens in `text`."""
+    return sum(1 + (len(piece) - 1) // LETTERS_PER_TOKEN for piece in TOKEN_PIECE.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of `text` estimated at no more than `max_tokens`."""
+    used = 0
+    for match in TOKEN_PIECE.finditer(text):
+        used += 1 + (len(match.group()) - 1) // LETTERS_PER_TOKEN
+        if used > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+def split_into_token_chunks(text: str, max_tokens: int) -> List[str]:
+    """
+    split_into_chunks with a token limit. The character size of the cut
+    comes from the text's own characters-per-token ratio, and chunks that
+    still come out too large are split again.
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return [text.strip()] if text.strip() else []
+
+    max_chars = max(len(text) * max_tokens // tokens, 1)
+    chunks = []
+    for chunk in split_into_chunks(text, max_chars):
+        if len(chunk) > 1 and estimate_tokens(chunk) > max_tokens:
+            chunks.extend(split_into_token_chunks(chunk, max_tokens))
+        else:
+            chunks.append(chunk)
+    return chunks
+
+
+def output_tokens(operation: str) -> int:
+    """Tokens reserved for the model's answer to an operation."""
+    return settings.AI_MAX_OUTPUT_TOKENS.get(operation, settings.AI_MAX_OUTPUT_TOKENS['default'])
+
+
+def prompt_limit(operation: str) -> int:
+    """Token limit of a whole prompt, leaving room for the output in the model's context window."""
+    limit = settings.AI_PROMPT_TOKENS.get(operation, settings.AI_PROMPT_TOKENS['default'])
+    return min(limit, settings.GEMINI_CONTEXT_TOKENS - output_tokens(operation))
+
+
+def text_budget(operation: str, template: str) -> int:
+    """
+    Tokens left for document text in a prompt, given the prompt rendered
+    without the text (instructions, part markers, question).
+    """
+    return max(prompt_limit(operation) - estimate_tokens(template), MIN_TEXT_TOKENS)
+
+
+def request_text(data: Dict[str, Any]) -> str:
+    """The prompt text of a Gemini request body."""
+    return "".join(
+        part.get('text', '')
+        for content in data.get('contents', [])
+        for part in content.get('parts', [])
+    )
+
+
+def record_call(operation: str, model_name: str, prompt: str, usage: Optional[Dict[str, Any]],
+                latency: float, succeeded: bool):
+    """Log the token usage of a model call; `usage` is the response's usageMetadata."""
+    if not settings.LLM_CALL_LOG:
+        return
+    usage = usage or {}
+    try:
+        LLMCallLog.objects.create(
+            operation=operation,
+            model_name=model_name,
+            estimated_prompt_tokens=estimate_tokens(prompt),
+            prompt_tokens=usage.get('promptTokenCount'),
+            completion_tokens=usage.get('candidatesTokenCount'),
+            latency_ms=int(latency * 1000),
+            succeeded=succeeded,
+        )
+    except Exception as e:
+        logger.error(f"Error recording model call: {str(e)}")
@@ -1,17 +1,39 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     # Document management
     path('', views.DocumentListView.as_view(), name='document-list'),
     path('upload/', views.DocumentUploadView.as_view(), name='document-upload'),
+    path('upload/bulk/', views.document_bulk_upload, name='document-bulk-upload'),
+    path('upload/sessions/', views.upload_session_create, name='upload-session-create'),
+    path('upload/sessions/<int:session_id>/', views.upload_session_detail, name='upload-session-detail'),
+    path('upload/sessions/<int:session_id>/complete/', views.upload_session_complete, name='upload-session-complete'),
+    path('search/', views.document_search, name='document-search'),
     path('<int:pk>/', views.DocumentDetailView.as_view(), name='document-detail'),
+    path('<int:document_id>/status/', views.document_status, name='document-status'),
+    path('<int:document_id>/pages/', views.document_pages, name='document-pages'),
+    path('<int:document_id>/text/', views.document_text, name='document-text'),
     
     # AI-powered features
     path('<int:document_id>/summary/', views.document_summary, name='document-summary'),
     path('<int:document_id>/simplify/', views.document_simplify, name='document-simplify'),
     path('<int:document_id>/risks/', views.document_risks, name='document-risks'),
     path('<int:document_id>/qa/', views.document_qa, name='document-qa'),
+    path('<int:document_id>/analyze/', views.document_analyze, name='document-analyze'),
+    
+    # Batch analysis jobs (and bulk upload progress)
+    path('batch/', views.batch_create, name='batch-create'),
+    path('batch/<int:batch_id>/', views.batch_detail, name='batch-detail'),
+    
+    # Cache and latency metrics (staff only)
+    path('metrics/', views.ai_metrics, name='ai-metrics'),
+    
+    # Async variants of the AI features (serve through eyes/asgi.py)
+    path('<int:document_id>/summary/async/', async_views.document_summary, name='document-summary-async'),
+    path('<int:document_id>/simplify/async/', async_views.document_simplify, name='document-simplify-async'),
+    path('<int:document_id>/risks/async/', async_views.document_risks, name='document-risks-async'),
+    path('<int:document_id>/qa/async/', async_views.document_qa, name='document-qa-async'),
     
     # Test APIs (for development/testing)
     path('test/gemini/', views.test_gemini_connection, name='test-gemini'),
@@ -1,27 +1,53 @@
 import os
+import json
 import logging
 from rest_framework import generics, status
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import api_view, parser_classes, permission_classes, renderer_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.settings import api_settings
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.conf import settings
 
-from .models import LegalDocument
-from .serializers import LegalDocumentSerializer, DocumentUploadSerializer
+from . import metrics
+from .models import BatchJob, BatchJobItem, DocumentPage, LegalDocument, QAAnswer, UploadSession
+from .serializers import (
+    LegalDocumentSerializer, DocumentUploadSerializer, DocumentPageSerializer, BatchJobSerializer, UploadSessionSerializer
+)
 from .services import extract_text_from_file
+from .jobs import create_analysis_batch, enqueue_extraction
+from .bulk_upload import BulkUploadError, bulk_upload
+from .chunked_upload import OffsetMismatch, UploadSessionError, abort_session, complete_session, start_session, write_chunk
 from .ai_service import GeminiService
+from .llm_backends import get_llm_backend
+from .analysis_cache import get_or_run_analysis, get_or_run_analyses, stream_analysis
+from .qa_cache import get_or_answer_question, stream_answer
+from .pagination import DocumentCursorPagination
+from .search import remove_document, search_documents
+from .renderers import EventStreamRenderer
+from .compression import compress_response
+from .text_store import load_range, page_at, page_span
 
 logger = logging.getLogger(__name__)
 
+# AI endpoints can also answer with a server-sent event stream
+STREAMING_RENDERERS = list(api_settings.DEFAULT_RENDERER_CLASSES) + [EventStreamRenderer]
+
 class DocumentListView(generics.ListAPIView):
-    """List all documents for the authenticated user"""
+    """List the authenticated user's documents, newest first, a page at a time"""
     serializer_class = LegalDocumentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = DocumentCursorPagination
     
     def get_queryset(self):
-        return LegalDocument.objects.filter(user=self.request.user)
+        # Only the listed columns
+        return LegalDocument.objects.filter(user=self.request.user).only(*LegalDocumentSerializer.Meta.fields)
 
 class DocumentUploadView(generics.CreateAPIView):
     """Upload a new document"""
@@ -31,24 +57,101 @@ class DocumentUploadView(generics.CreateAPIView):
     
     def perform_create(self, serializer):
         document = serializer.save()
+
+        # Text extraction runs in the worker pool; clients poll the status endpoint
+        enqueue_extraction(document)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser])
+def document_bulk_upload(request):
+    """Upload many documents at once, as files and/or ZIP archives of them"""
+    files = request.FILES.getlist('files')
+    if not files:
+        return Response(
+            {'error': 'Send the documents (or ZIP archives of them) in the "files" field.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        batch, outcomes = bulk_upload(request.user, files)
+    except BulkUploadError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    accepted = sum(1 for outcome in outcomes if outcome['status'] == 'accepted')
+    body = {
+        'accepted': accepted,
+        'rejected': len(outcomes) - accepted,
+        'files': outcomes,
+    }
+    if batch is None:
+        body['error'] = 'None of the files could be accepted.'
+        return Response(body, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Extraction progress, per document, is polled on the batch
+    body['batch_id'] = batch.id
+    body['batch_url'] = request.build_absolute_uri(reverse('batch-detail', args=[batch.id]))
+    return Response(body, status=status.HTTP_201_CREATED)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def upload_session_create(request):
+    """Start a resumable chunked upload, for files too large for a single upload"""
+    try:
+        size = int(request.data.get('size'))
+    except (TypeError, ValueError):
+        return Response({'error': 'size must be the file size in bytes.'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        session = start_session(request.user, request.data.get('name') or '', size)
+    except UploadSessionError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+@api_view(['GET', 'PUT', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def upload_session_detail(request, session_id):
+    """Progress of a chunked upload; PUT sends the next chunk (raw body at ?offset=), DELETE cancels it"""
+    session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+    
+    if request.method == 'DELETE':
+        abort_session(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    if request.method == 'PUT':
+        try:
+            offset = int(request.query_params.get('offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({'error': 'offset must be a byte offset.'}, status=status.HTTP_400_BAD_REQUEST)
+        if offset < 0 or length <= 0:
+            return Response(
+                {'error': 'Send the chunk as the request body, with its byte offset as ?offset=.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Extract text in the background (you might want to use Celery for this in production)
         try:
-            file_path = document.file.path
-            extracted_text = extract_text_from_file(file_path, document.file_type)
-            
-            if extracted_text:
-                document.extracted_text = extracted_text
-                document.processing_status = 'completed'
-            else:
-                document.processing_status = 'failed'
-            
-            document.save()
-            
-        except Exception as e:
-            logger.error(f"Error processing document {document.id}: {str(e)}")
-            document.processing_status = 'failed'
-            document.save()
+            session = write_chunk(session, offset, request.stream, length)
+        except OffsetMismatch as e:
+            # The client resumes from `received`
+            return Response({'error': str(e), 'received': e.received}, status=status.HTTP_409_CONFLICT)
+        except UploadSessionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response(UploadSessionSerializer(session).data)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def upload_session_complete(request, session_id):
+    """Finish a chunked upload: the file becomes a document and its extraction is queued"""
+    session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+    try:
+        document, created = complete_session(session)
+    except UploadSessionError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = DocumentUploadSerializer(document, context={'request': request})
+    return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 class DocumentDetailView(generics.RetrieveDestroyAPIView):
     """Get or delete a specific document"""
@@ -58,8 +161,201 @@ class DocumentDetailView(generics.RetrieveDestroyAPIView):
     def get_queryset(self):
         return LegalDocument.objects.filter(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        document_id = instance.id
+        instance.delete()
+        remove_document(document_id)
+
+def _wants_refresh(request):
+    """`?refresh=1` bypasses cached AI results"""
+    return request.query_params.get('refresh', '').lower() in ('1', 'true', 'yes')
+
+def _wants_stream(request):
+    """`?stream=1` or `Accept: text/event-stream` streams AI output as server-sent events"""
+    return (
+        request.query_params.get('stream', '').lower() in ('1', 'true', 'yes')
+        or 'text/event-stream' in request.META.get('HTTP_ACCEPT', '')
+    )
+
+def _event_stream(deltas):
+    """Relay generated text to the client as server-sent events"""
+    def events():
+        try:
+            for delta in deltas:
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.error(f"Error while streaming AI output: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'error': 'Generation failed. Please try again later.'})}\n\n"
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def document_status(request, document_id):
+    """Poll the processing status of an uploaded document"""
+    document = get_object_or_404(
+        LegalDocument.objects.only('id', 'user_id', 'processing_status', 'pages_extracted', 'extraction_source'),
+        id=document_id,
+        user=request.user
+    )
+    job = document.jobs.filter(job_type='extract').order_by('-id').first()
+
+    return Response({
+        'id': document.id,
+        'processing_status': document.processing_status,
+        'pages_extracted': document.pages_extracted,
+        'failed_pages': list(
+            DocumentPage.objects.filter(document_id=document.extraction_id).exclude(error='')
+            .values_list('page_number', flat=True)
+        ),
+        'attempts': job.attempts if job else 0,
+        'max_attempts': job.max_attempts if job else 0,
+        'next_attempt_at': job.run_after if job and job.status == 'queued' else None,
+        'error': job.last_error if job and job.last_error else None,
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def document_pages(request, document_id):
+    """Read extracted pages, available while the rest of the document is still processing"""
+    document = get_object_or_404(
+        LegalDocument.objects.only('id', 'user_id', 'processing_status', 'pages_extracted', 'extraction_source'),
+        id=document_id,
+        user=request.user
+    )
+
+    try:
+        start = max(int(request.query_params.get('start', 1)), 1)
+        count = min(max(int(request.query_params.get('count', 10)), 1), 100)
+    except ValueError:
+        return Response(
+            {'error': 'start and count must be integers.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    pages = DocumentPage.objects.filter(
+        document_id=document.extraction_id, page_number__gte=start, page_number__lt=start + count
+    )
+    next_start = start + count if start + count <= document.pages_extracted else None
+
+    return Response({
+        'id': document.id,
+        'processing_status': document.processing_status,
+        'pages_extracted': document.pages_extracted,
+        'pages': DocumentPageSerializer(pages, many=True).data,
+        'next_start': next_start,
+    })
+
+def _parse_page_range(value):
+    """`3` or `3-7` -> (first, last); ValueError when malformed."""
+    first, _, last = value.partition('-')
+    first = int(first)
+    last = int(last) if last else first
+    if first < 1 or last < first:
+        raise ValueError(value)
+    return first, last
+
+@compress_response
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def document_text(request, document_id):
+    """
+    Read the extracted text a range at a time: `?pages=3` or `?pages=3-7`
+    (up to 100 pages), or `?start=&end=` in characters. Each request reads
+    only the stored chunks under the range. A page range longer than
+    DOCS_TEXT_MAX_CHARS is cut short and continues at `next_page`, the page
+    it was cut in. Responses carry an ETag and are compressed when the
+    client accepts gzip or br.
+    """
+    document = get_object_or_404(
+        LegalDocument.objects.only('id', 'user_id', 'text_length', 'text_hash', 'pages_extracted', 'extraction_source'),
+        id=document_id,
+        user=request.user
+    )
+
+    if not document.text_length:
+        return Response(
+            {'error': 'Document text not available. Processing may have failed.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    page_range = None
+    try:
+        if 'pages' in request.query_params:
+            first, last = _parse_page_range(request.query_params['pages'])
+            page_range = (first, min(last, first + 99))
+            start, span_end = page_span(document, *page_range) or (0, 0)
+            end = span_end
+        else:
+            start = max(int(request.query_params.get('start', 0)), 0)
+            end = int(request.query_params.get('end', start + settings.DOCS_TEXT_DEFAULT_CHARS))
+    except ValueError:
+        return Response(
+            {'error': 'pages must be a page number or range like 3-7; start and end must be integers.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    end = max(min(end, start + settings.DOCS_TEXT_MAX_CHARS, document.text_length), start)
+
+    # The text hash and the resolved range identify the response
+    etag = quote_etag(f"{document.text_hash[:32]}-{start}-{end}")
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    data = {
+        'id': document.id,
+        'text_length': document.text_length,
+        'start': start,
+        'end': end,
+        'text': load_range(document, start, end),
+        'next_start': end if end < document.text_length else None,
+    }
+    if page_range:
+        first_page, last_page = page_range[0], max(min(page_range[1], document.pages_extracted), page_range[0])
+        if end < span_end:
+            # Cut at DOCS_TEXT_MAX_CHARS: the rest of the range starts on the page holding `end`
+            last_page, next_page = page_at(document, end - 1), page_at(document, end)
+        else:
+            next_page = last_page + 1 if last_page < document.pages_extracted else None
+        data['first_page'], data['last_page'], data['next_page'] = first_page, last_page, next_page
+
+    response = Response(data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def document_search(request):
+    """Full-text search of the user's documents, best matches first with highlighted snippets"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response(
+            {'error': 'q is required.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        limit = int(request.query_params.get('limit', settings.SEARCH_RESULTS_LIMIT))
+        limit = min(max(limit, 1), settings.SEARCH_RESULTS_MAX_LIMIT)
+    except ValueError:
+        return Response(
+            {'error': 'limit must be an integer.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response({
+        'query': query,
+        'results': search_documents(request.user, query, limit),
+    })
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(STREAMING_RENDERERS)
 def document_summary(request, document_id):
     """Generate a summary of the document using AI"""
     document = get_object_or_404(
@@ -68,17 +364,19 @@ def document_summary(request, document_id):
         user=request.user
     )
     
-    if not document.extracted_text:
+    if not document.text_length:
         return Response(
             {'error': 'Document text not available. Processing may have failed.'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    gemini_service = GeminiService()
-    summary = gemini_service.summarize_document(document.extracted_text)
+    if _wants_stream(request):
+        return _event_stream(stream_analysis(document, 'summary', refresh=_wants_refresh(request)))
+    
+    summary, cached = get_or_run_analysis(document, 'summary', refresh=_wants_refresh(request))
     
     if summary:
-        return Response({'summary': summary})
+        return Response({'summary': summary, 'cached': cached})
     else:
         return Response(
             {'error': 'Failed to generate summary. Please try again later.'},
@@ -87,6 +385,7 @@ def document_summary(request, document_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(STREAMING_RENDERERS)
 def document_simplify(request, document_id):
     """Simplify the document language using AI"""
     document = get_object_or_404(
@@ -95,17 +394,19 @@ def document_simplify(request, document_id):
         user=request.user
     )
     
-    if not document.extracted_text:
+    if not document.text_length:
         return Response(
             {'error': 'Document text not available. Processing may have failed.'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    gemini_service = GeminiService()
-    simplified = gemini_service.simplify_clauses(document.extracted_text)
+    if _wants_stream(request):
+        return _event_stream(stream_analysis(document, 'simplify', refresh=_wants_refresh(request)))
+    
+    simplified, cached = get_or_run_analysis(document, 'simplify', refresh=_wants_refresh(request))
     
     if simplified:
-        return Response({'simplified_text': simplified})
+        return Response({'simplified_text': simplified, 'cached': cached})
     else:
         return Response(
             {'error': 'Failed to simplify document. Please try again later.'},
@@ -114,6 +415,7 @@ def document_simplify(request, document_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(STREAMING_RENDERERS)
 def document_risks(request, document_id):
     """Identify risks in the document using AI"""
     document = get_object_or_404(
@@ -122,17 +424,19 @@ def document_risks(request, document_id):
         user=request.user
     )
     
-    if not document.extracted_text:
+    if not document.text_length:
         return Response(
             {'error': 'Document text not available. Processing may have failed.'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    gemini_service = GeminiService()
-    risks = gemini_service.identify_risks(document.extracted_text)
+    if _wants_stream(request):
+        return _event_stream(stream_analysis(document, 'risks', refresh=_wants_refresh(request)))
+    
+    risks, cached = get_or_run_analysis(document, 'risks', refresh=_wants_refresh(request))
     
     if risks:
-        return Response({'risks': risks})
+        return Response({'risks': risks, 'cached': cached})
     else:
         return Response(
             {'error': 'Failed to identify risks. Please try again later.'},
@@ -141,6 +445,50 @@ def document_risks(request, document_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+def document_analyze(request, document_id):
+    """Run several AI analyses of the document in one request"""
+    document = get_object_or_404(
+        LegalDocument, 
+        id=document_id, 
+        user=request.user
+    )
+    
+    analysis_types = request.data.get('types') or list(GeminiService.ANALYSIS_TYPES)
+    if isinstance(analysis_types, str):
+        analysis_types = [analysis_types]
+    if not isinstance(analysis_types, list) or any(
+        name not in GeminiService.ANALYSIS_TYPES for name in analysis_types
+    ):
+        return Response(
+            {'error': f"Unknown analysis types. Choose from: {', '.join(GeminiService.ANALYSIS_TYPES)}."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    analysis_types = list(dict.fromkeys(analysis_types))
+    
+    if not document.text_length:
+        return Response(
+            {'error': 'Document text not available. Processing may have failed.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    results = get_or_run_analyses(document, analysis_types, refresh=_wants_refresh(request))
+    failed = [name for name, (result, _) in results.items() if not result]
+    
+    if len(failed) == len(analysis_types):
+        return Response(
+            {'error': 'Failed to analyze document. Please try again later.'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    return Response({
+        'results': {name: result for name, (result, _) in results.items() if result},
+        'cached': {name: cached for name, (result, cached) in results.items() if result},
+        'failed': failed,
+    })
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@renderer_classes(STREAMING_RENDERERS)
 def document_qa(request, document_id):
     """Answer questions about the document using AI"""
     document = get_object_or_404(
@@ -156,19 +504,22 @@ def document_qa(request, document_id):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    if not document.extracted_text:
+    if not document.text_length:
         return Response(
             {'error': 'Document text not available. Processing may have failed.'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    gemini_service = GeminiService()
-    answer = gemini_service.answer_question(document.extracted_text, question)
+    if _wants_stream(request):
+        return _event_stream(stream_answer(document, question, refresh=_wants_refresh(request)))
+    
+    answer, cached = get_or_answer_question(document, question, refresh=_wants_refresh(request))
     
     if answer:
         return Response({
             'question': question,
-            'answer': answer
+            'answer': answer,
+            'cached': cached
         })
     else:
         return Response(
@@ -176,6 +527,90 @@ def document_qa(request, document_id):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+def _batch_queryset():
+    items = BatchJobItem.objects.select_related('document')
+    return BatchJob.objects.prefetch_related(Prefetch('items', queryset=items))
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch_create(request):
+    """Queue the same AI analysis for many documents"""
+    document_ids = request.data.get('document_ids')
+    analysis_type = request.data.get('analysis_type')
+    
+    if analysis_type not in GeminiService.ANALYSIS_TYPES:
+        return Response(
+            {'error': f"analysis_type must be one of: {', '.join(GeminiService.ANALYSIS_TYPES)}."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if (not isinstance(document_ids, list) or not document_ids
+            or not all(isinstance(document_id, int) for document_id in document_ids)):
+        return Response(
+            {'error': 'document_ids must be a non-empty list of document ids.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    document_ids = list(dict.fromkeys(document_ids))
+    if len(document_ids) > settings.DOCS_BATCH_MAX_DOCUMENTS:
+        return Response(
+            {'error': f"A batch can contain at most {settings.DOCS_BATCH_MAX_DOCUMENTS} documents."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    found = set(
+        LegalDocument.objects.filter(user=request.user, id__in=document_ids).values_list('id', flat=True)
+    )
+    missing = [document_id for document_id in document_ids if document_id not in found]
+    if missing:
+        return Response(
+            {'error': 'Documents not found.', 'document_ids': missing},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    batch = create_analysis_batch(request.user, document_ids, analysis_type)
+    batch = _batch_queryset().get(id=batch.id)
+    return Response(BatchJobSerializer(batch).data, status=status.HTTP_201_CREATED)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def batch_detail(request, batch_id):
+    """Progress and per-document results of a batch analysis, or extraction progress of a bulk upload"""
+    batch = get_object_or_404(
+        _batch_queryset(),
+        id=batch_id,
+        user=request.user
+    )
+    return Response(BatchJobSerializer(batch).data)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def ai_metrics(request):
+    """Cache hit ratios, upstream health and latencies of the AI endpoints, for the process serving the request"""
+    snapshot = metrics.snapshot()
+    counters = snapshot['counters']
+    backend = get_llm_backend()
+    calls = counters.get('gemini.calls', 0)
+    return Response({
+        'qa_cache': {
+            'hits': counters.get('qa_cache.hits', 0),
+            'misses': counters.get('qa_cache.misses', 0),
+            'hit_ratio': metrics.ratio('qa_cache.hits', 'qa_cache.misses'),
+            'stale_served': counters.get('qa_cache.stale_served', 0),
+            'entries': QAAnswer.objects.count(),
+        },
+        'gemini': {
+            'backend': backend.name,
+            'calls': calls,
+            'hedged': counters.get('gemini.hedged', 0),
+            'hedge_rate': round(counters.get('gemini.hedged', 0) / calls, 4) if calls else 0.0,
+            'hedge_wins': counters.get('gemini.hedge_wins', 0),
+            'breaker': backend.breaker.snapshot(),
+            'breaker_rejected': counters.get('gemini.breaker_rejected', 0),
+        },
+        'counters': counters,
+        'timings': snapshot['timings'],
+    })
+
 # Test APIs for easy feature testing
 @api_view(['GET'])
 def test_gemini_connection(request):
@@ -183,18 +618,20 @@ def test_gemini_connection(request):
     gemini_service = GeminiService()
     
     # Simple test prompt
-    test_response = gemini_service._make_request("Hello, can you respond with 'Gemini API is working!'?")
+    test_response = gemini_service._make_request("Hello, can you respond with 'Gemini API is working!'?", operation='test')
     
     if test_response:
         return Response({
             'status': 'success',
             'message': 'Gemini API is connected and working',
+            'backend': gemini_service.backend.name,
             'response': test_response
         })
     else:
         return Response({
             'status': 'error',
-            'message': 'Failed to connect to Gemini API. Check your API key.'
+            'message': 'Failed to connect to Gemini API. Check your API key.',
+            'backend': gemini_service.backend.name
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
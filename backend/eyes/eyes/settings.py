@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -90,12 +90,58 @@ WSGI_APPLICATION = 'eyes.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=sqlite (default) suits a single node; DB_ENGINE=postgresql for
+# deployments with several web or worker processes.
+
+DB_ENGINE = config('DB_ENGINE', default='sqlite')
+
+if DB_ENGINE in ('postgres', 'postgresql'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='legal_eyes'),
+            'USER': config('DB_USER', default='legal_eyes'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            # Persistent connections, checked before reuse
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    # psycopg's connection pool (needs psycopg[pool]); replaces persistent connections
+    if config('DB_POOL', default=False, cast=bool):
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=20, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'OPTIONS': {
+                # Seconds a writer waits for the database lock before "database is locked"
+                'timeout': config('DB_SQLITE_BUSY_TIMEOUT', default=20, cast=int),
+                # IMMEDIATE takes the write lock when a transaction starts, so writers
+                # queue on the busy timeout instead of failing to upgrade a read lock.
+                # The in-memory test database shares one cache that locks per table and
+                # ignores the busy timeout: runs whose tests write from several threads
+                # inside a test's transaction need DB_SQLITE_TRANSACTION_MODE=DEFERRED
+                'transaction_mode': config('DB_SQLITE_TRANSACTION_MODE', default='IMMEDIATE'),
+                # WAL lets readers run alongside the writer. With NORMAL, WAL syncs at
+                # checkpoints only: safe on a crash, may lose recent commits on power loss
+                'init_command': (
+                    f"PRAGMA journal_mode={config('DB_SQLITE_JOURNAL_MODE', default='WAL')};"
+                    f"PRAGMA synchronous={config('DB_SQLITE_SYNCHRONOUS', default='NORMAL')};"
+                ),
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -144,6 +190,156 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Document list pagination (cursor based; clients may ask for ?page_size= up to the max)
+DOCS_LIST_PAGE_SIZE = config('DOCS_LIST_PAGE_SIZE', default=50, cast=int)
+DOCS_LIST_MAX_PAGE_SIZE = config('DOCS_LIST_MAX_PAGE_SIZE', default=200, cast=int)
+
+# Extracted text endpoint: characters returned when no end is given, and at most per request
+DOCS_TEXT_DEFAULT_CHARS = config('DOCS_TEXT_DEFAULT_CHARS', default=20000, cast=int)
+DOCS_TEXT_MAX_CHARS = config('DOCS_TEXT_MAX_CHARS', default=200000, cast=int)
+
+# Full-text document search (SQLite FTS5 / PostgreSQL tsvector, see docsapp/search.py)
+SEARCH_RESULTS_LIMIT = config('SEARCH_RESULTS_LIMIT', default=20, cast=int)
+SEARCH_RESULTS_MAX_LIMIT = config('SEARCH_RESULTS_MAX_LIMIT', default=100, cast=int)
+# Characters of extracted text indexed per document
+SEARCH_INDEX_MAX_CHARS = config('SEARCH_INDEX_MAX_CHARS', default=1000000, cast=int)
+
+# Background document processing
+# Uploads are queued as ProcessingJob rows and picked up by the worker pool
+# started with `python manage.py run_workers`.
+DOCS_WORKER_CONCURRENCY = config('DOCS_WORKER_CONCURRENCY', default=2, cast=int)
+DOCS_JOB_MAX_ATTEMPTS = config('DOCS_JOB_MAX_ATTEMPTS', default=3, cast=int)
+DOCS_JOB_VISIBILITY_TIMEOUT = config('DOCS_JOB_VISIBILITY_TIMEOUT', default=300, cast=int)  # seconds
+DOCS_JOB_RETRY_BACKOFF = config('DOCS_JOB_RETRY_BACKOFF', default=10, cast=int)  # seconds, doubled per attempt
+DOCS_JOB_POLL_INTERVAL = config('DOCS_JOB_POLL_INTERVAL', default=1.0, cast=float)  # seconds
+# Batch analysis jobs run behind extraction jobs
+DOCS_ANALYSIS_JOB_PRIORITY = config('DOCS_ANALYSIS_JOB_PRIORITY', default=-10, cast=int)
+# Analyses queued for every document once extraction completes (comma-separated,
+# empty to disable), so the first view is served from the analysis cache. They
+# run behind batch jobs and are skipped in eager mode.
+DOCS_PRECOMPUTE_ANALYSES = config('DOCS_PRECOMPUTE_ANALYSES', default='summary,risks', cast=Csv())
+DOCS_PRECOMPUTE_JOB_PRIORITY = config('DOCS_PRECOMPUTE_JOB_PRIORITY', default=-20, cast=int)
+DOCS_BATCH_MAX_DOCUMENTS = config('DOCS_BATCH_MAX_DOCUMENTS', default=500, cast=int)
+# Bulk uploads (upload/bulk/) take up to DOCS_BATCH_MAX_DOCUMENTS files, counting the
+# entries of ZIP archives, of at most this many bytes in total once unpacked.
+# Their extraction runs behind single uploads and ahead of batch analyses.
+DOCS_BULK_UPLOAD_MAX_BYTES = config('DOCS_BULK_UPLOAD_MAX_BYTES', default=500 * 1024 * 1024, cast=int)
+DOCS_BULK_UPLOAD_JOB_PRIORITY = config('DOCS_BULK_UPLOAD_JOB_PRIORITY', default=-5, cast=int)
+# Django refuses multipart requests with more files than this (default 100)
+DATA_UPLOAD_MAX_NUMBER_FILES = DOCS_BATCH_MAX_DOCUMENTS
+# Resumable chunked uploads (upload/sessions/), for files over the 10MB single-upload limit.
+# Partial files live in DOCS_UPLOAD_SESSION_DIR, which must be shared by every server
+# receiving uploads; sessions left unfinished for DOCS_UPLOAD_SESSION_TTL seconds are
+# removed by `python manage.py purge_upload_sessions`.
+DOCS_CHUNKED_UPLOAD_MAX_SIZE = config('DOCS_CHUNKED_UPLOAD_MAX_SIZE', default=200 * 1024 * 1024, cast=int)
+DOCS_UPLOAD_CHUNK_MAX_SIZE = config('DOCS_UPLOAD_CHUNK_MAX_SIZE', default=8 * 1024 * 1024, cast=int)
+DOCS_UPLOAD_SESSION_DIR = config('DOCS_UPLOAD_SESSION_DIR', default=str(BASE_DIR / 'upload_sessions'))
+DOCS_UPLOAD_SESSION_TTL = config('DOCS_UPLOAD_SESSION_TTL', default=24 * 3600, cast=int)  # seconds
+# Run jobs inline in the request instead of queueing them (handy for local development)
+DOCS_JOBS_EAGER = config('DOCS_JOBS_EAGER', default=False, cast=bool)
+
+# PDF extraction
+# Pages of long PDFs are split into contiguous shards parsed by a process pool.
+# Below PDF_PARALLEL_MIN_PAGES pages the pool costs more than it saves (2 workers
+# ran at 0.78x on 120 pages), so shorter PDFs are parsed in-process.
+PDF_EXTRACTION_WORKERS = config('PDF_EXTRACTION_WORKERS', default=4, cast=int)
+PDF_MIN_PAGES_PER_SHARD = config('PDF_MIN_PAGES_PER_SHARD', default=25, cast=int)
+PDF_PARALLEL_MIN_PAGES = config('PDF_PARALLEL_MIN_PAGES', default=200, cast=int)
+
+# AI analysis
+# Model backend: 'gemini' (the REST API), 'fake' (deterministic offline responses,
+# no API key needed) or a dotted path to a docsapp.llm_backends.LLMBackend subclass
+LLM_BACKEND = config('LLM_BACKEND', default='gemini')
+FAKE_LLM_LATENCY = config('FAKE_LLM_LATENCY', default=0.0, cast=float)  # seconds per fake call
+GEMINI_MODEL = config('GEMINI_MODEL', default='gemini-2.0-flash')
+GEMINI_API_BASE = config('GEMINI_API_BASE', default='https://generativelanguage.googleapis.com/v1beta')
+# Shared keep-alive HTTP client used for every Gemini call
+GEMINI_POOL_MAXSIZE = config('GEMINI_POOL_MAXSIZE', default=20, cast=int)  # connections kept per host
+GEMINI_MAX_RETRIES = config('GEMINI_MAX_RETRIES', default=3, cast=int)  # on 429/5xx and connection errors
+GEMINI_BACKOFF_BASE = config('GEMINI_BACKOFF_BASE', default=0.5, cast=float)  # seconds, doubled per retry
+GEMINI_BACKOFF_MAX = config('GEMINI_BACKOFF_MAX', default=8.0, cast=float)  # longer Retry-After waits give up
+# Connection limit of the async client used by the ASGI endpoints
+GEMINI_ASYNC_MAX_CONNECTIONS = config('GEMINI_ASYNC_MAX_CONNECTIONS', default=200, cast=int)
+GEMINI_CONNECT_TIMEOUT = config('GEMINI_CONNECT_TIMEOUT', default=5, cast=float)
+# Read timeout per operation, in seconds
+GEMINI_TIMEOUTS = {
+    'default': config('GEMINI_TIMEOUT', default=30, cast=float),
+    'summary': config('GEMINI_SUMMARY_TIMEOUT', default=60, cast=float),
+    'simplify': config('GEMINI_SIMPLIFY_TIMEOUT', default=60, cast=float),
+    'risks': config('GEMINI_RISKS_TIMEOUT', default=60, cast=float),
+    'analyze': config('GEMINI_ANALYZE_TIMEOUT', default=90, cast=float),
+    'qa': config('GEMINI_QA_TIMEOUT', default=30, cast=float),
+    'test': config('GEMINI_TEST_TIMEOUT', default=10, cast=float),
+}
+# Gemini quota, enforced across all processes by a database token bucket (0 disables a limit)
+GEMINI_RPM = config('GEMINI_RPM', default=2000, cast=int)  # requests per minute
+GEMINI_TPM = config('GEMINI_TPM', default=4000000, cast=int)  # input tokens per minute
+GEMINI_RATE_LIMIT_MAX_WAIT = config('GEMINI_RATE_LIMIT_MAX_WAIT', default=60, cast=float)  # seconds
+# Share of each quota that queued analysis jobs leave free for interactive requests
+GEMINI_BACKGROUND_RESERVE = config('GEMINI_BACKGROUND_RESERVE', default=0.2, cast=float)
+# Hedged requests: a call still running after the GEMINI_HEDGE_PERCENTILE latency
+# of recent calls of its operation (at least GEMINI_HEDGE_MIN_DELAY) is sent
+# again and the first response wins. GEMINI_HEDGE_BUDGET caps the share of calls
+# hedged. A percentile of 0 disables hedging. Calls that may be hedged run on
+# GEMINI_HEDGE_WORKERS shared threads; while all are busy, calls run unhedged.
+GEMINI_HEDGE_PERCENTILE = config('GEMINI_HEDGE_PERCENTILE', default=0.95, cast=float)
+GEMINI_HEDGE_MIN_DELAY = config('GEMINI_HEDGE_MIN_DELAY', default=2.0, cast=float)  # seconds
+GEMINI_HEDGE_MIN_SAMPLES = config('GEMINI_HEDGE_MIN_SAMPLES', default=20, cast=int)
+GEMINI_HEDGE_BUDGET = config('GEMINI_HEDGE_BUDGET', default=0.05, cast=float)
+GEMINI_HEDGE_WORKERS = config('GEMINI_HEDGE_WORKERS', default=32, cast=int)
+# Circuit breaker: once GEMINI_BREAKER_ERROR_RATE of the last GEMINI_BREAKER_WINDOW
+# calls failed (after retries), calls fail fast for GEMINI_BREAKER_COOLDOWN seconds
+# and cached results are served where available. An error rate of 0 disables it.
+GEMINI_BREAKER_ERROR_RATE = config('GEMINI_BREAKER_ERROR_RATE', default=0.5, cast=float)
+GEMINI_BREAKER_WINDOW = config('GEMINI_BREAKER_WINDOW', default=20, cast=int)
+GEMINI_BREAKER_MIN_CALLS = config('GEMINI_BREAKER_MIN_CALLS', default=10, cast=int)
+GEMINI_BREAKER_COOLDOWN = config('GEMINI_BREAKER_COOLDOWN', default=30, cast=float)  # seconds
+# Prompt budgets, in estimated tokens (see docsapp/tokens.py). Document text fills
+# each prompt up to AI_PROMPT_TOKENS for its operation after the instructions and
+# question; long documents are analysed in chunks of that size (map-reduce).
+# AI_MAX_OUTPUT_TOKENS is reserved for the answer within GEMINI_CONTEXT_TOKENS.
+GEMINI_CONTEXT_TOKENS = config('GEMINI_CONTEXT_TOKENS', default=1048576, cast=int)
+AI_PROMPT_TOKENS = {
+    'default': config('AI_PROMPT_TOKENS', default=6000, cast=int),
+    'summary': config('AI_SUMMARY_PROMPT_TOKENS', default=6000, cast=int),
+    'simplify': config('AI_SIMPLIFY_PROMPT_TOKENS', default=6000, cast=int),
+    'risks': config('AI_RISKS_PROMPT_TOKENS', default=6000, cast=int),
+    # One prompt answers several analyses, so the text must leave room for all of them
+    'analyze': config('AI_ANALYZE_PROMPT_TOKENS', default=4000, cast=int),
+    'qa': config('AI_QA_PROMPT_TOKENS', default=3000, cast=int),
+}
+AI_MAX_OUTPUT_TOKENS = {
+    'default': config('AI_MAX_OUTPUT_TOKENS', default=2048, cast=int),
+    'simplify': config('AI_SIMPLIFY_MAX_OUTPUT_TOKENS', default=8192, cast=int),
+    'analyze': config('AI_ANALYZE_MAX_OUTPUT_TOKENS', default=8192, cast=int),
+    'qa': config('AI_QA_MAX_OUTPUT_TOKENS', default=1024, cast=int),
+}
+# Record prompt/completion token counts of every call (LLMCallLog, see `manage.py llm_usage`)
+LLM_CALL_LOG = config('LLM_CALL_LOG', default=True, cast=bool)
+# Maximum concurrent Gemini calls made for one analysis
+AI_MAX_FANOUT = config('AI_MAX_FANOUT', default=8, cast=int)
+# Q&A retrieval: documents are indexed in chunks of RETRIEVAL_CHUNK_CHARS and the
+# best RETRIEVAL_TOP_K chunks are sent to Gemini, up to the 'qa' prompt budget
+RETRIEVAL_CHUNK_CHARS = config('RETRIEVAL_CHUNK_CHARS', default=1500, cast=int)
+RETRIEVAL_TOP_K = config('RETRIEVAL_TOP_K', default=8, cast=int)
+# Identical concurrent analyses share one Gemini call (single-flight). Waiting
+# callers poll for the result; a lock older than the timeout is taken over.
+SINGLE_FLIGHT_LOCK_TIMEOUT = config('SINGLE_FLIGHT_LOCK_TIMEOUT', default=180, cast=float)  # seconds
+SINGLE_FLIGHT_POLL_INTERVAL = config('SINGLE_FLIGHT_POLL_INTERVAL', default=0.25, cast=float)  # seconds
+# Cached analysis results expire after this many seconds (0 keeps them forever)
+ANALYSIS_CACHE_TTL = config('ANALYSIS_CACHE_TTL', default=30 * 24 * 3600, cast=int)
+# Least recently used results are evicted beyond this many entries
+ANALYSIS_CACHE_MAX_ENTRIES = config('ANALYSIS_CACHE_MAX_ENTRIES', default=10000, cast=int)
+# Q&A answers are cached per document and normalized question, with the same
+# TTL/LRU rules, bounded per document and in total
+QA_CACHE_TTL = config('QA_CACHE_TTL', default=30 * 24 * 3600, cast=int)
+QA_CACHE_MAX_PER_DOCUMENT = config('QA_CACHE_MAX_PER_DOCUMENT', default=200, cast=int)
+QA_CACHE_MAX_ENTRIES = config('QA_CACHE_MAX_ENTRIES', default=50000, cast=int)
+# Share of cache writes that also enforce the LRU bounds above, so most writes
+# skip the count and scan. Between checks a cache may overshoot its bound a
+# little; `manage.py prune_analysis_cache` enforces the bounds exactly.
+CACHE_EVICTION_SAMPLE_RATE = config('CACHE_EVICTION_SAMPLE_RATE', default=0.01, cast=float)
+
 # Logging configuration
 LOGGING = {
     'version': 1,